@@ -0,0 +1,52 @@
+import asyncio
+import logging
+import time
+
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_INTERVAL, ARCHIVE_VACUUM_PAGES
+
+
+class PostArchiver:
+    """Перенос старых завершённых постов из posts в posts_archive.
+
+    posts остаётся «горячей» таблицей: ожидающие посты и завершённые за
+    последние `after_days` дней. Перенос идёт пачками по `batch_size` -
+    каждая пачка отдельная короткая транзакция в потоке-писателе, так что
+    запись новых постов и публикация успевают выполняться между пачками.
+    Архив хранится в том же файле и занимает большую часть освободившихся
+    страниц posts; incremental_vacuum возвращает ОС только оставшиеся
+    свободными (в основном место индексов posts).
+    """
+
+    def __init__(self, db, after_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE,
+                 vacuum_pages=ARCHIVE_VACUUM_PAGES, interval=ARCHIVE_INTERVAL):
+        self.db = db
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.interval = interval
+
+    async def archive(self, now=None):
+        """Один проход архивации. Возвращает (перенесено постов, освобождено страниц)."""
+        now = time.time() if now is None else now
+        before = int(now - self.after_days * 86400)
+        archived = 0
+        while True:
+            moved = await self.db.archive_posts(before, self.batch_size)
+            archived += moved
+            if moved < self.batch_size:
+                break
+        freed = await self.db.vacuum_free_pages(self.vacuum_pages)
+        if archived or freed:
+            logging.info(f"Archived {archived} posts older than {self.after_days} days, freed {freed} pages.")
+        return archived, freed
+
+    async def run(self):
+        if self.after_days <= 0:
+            logging.info("Post archiving disabled.")
+            return
+        while True:
+            try:
+                await self.archive()
+            except Exception as e:
+                logging.error(f"Post archiving failed: {e}")
+            await asyncio.sleep(self.interval)
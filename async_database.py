@@ -0,0 +1,59 @@
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import Database
+from metrics import DB_CALL_DURATION
+
+DB_READER_THREADS = 4
+
+
+class AsyncDatabase:
+    """Асинхронный фасад над `Database` с тем же набором методов.
+
+    Все записи выполняются в одном потоке-писателе (SQLite допускает только
+    одного писателя, так что очередь исключает ожидание блокировок), чтение
+    (`get_*`) - в пуле потоков-читателей. Каждый поток держит собственное
+    соединение, в режиме WAL читатели не блокируются писателем.
+    """
+
+    def __init__(self, db_name, reader_threads=DB_READER_THREADS):
+        self.db = Database(db_name)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix='db-reader')
+
+    @staticmethod
+    def is_read_method(name):
+        return name.startswith('get_')
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if not callable(method):
+            return method
+
+        executor = self._readers if self.is_read_method(name) else self._writer
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            try:
+                return await loop.run_in_executor(executor, functools.partial(method, *args, **kwargs))
+            finally:
+                DB_CALL_DURATION.observe(time.perf_counter() - started, name)
+
+        # Кэшируем обёртку, чтобы __getattr__ не вызывался повторно
+        self.__dict__[name] = call
+        return call
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._shutdown)
+
+    def _shutdown(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.db.close()
+        logging.info("Async database closed.")
@@ -0,0 +1,374 @@
+"""Бенчмарки слоя хранения.
+
+Запуск: python benchmark.py [--ops N] [--updates N] [--publish-posts N] [--import-rows N] [--archive-rows N]
+
+- ops/sec основных запросов `Database` при новом соединении на каждый
+  вызов (старое поведение) и при долгоживущем соединении;
+- латентность обработчиков (p50/p99) и задержка event loop при
+  конкурентных апдейтах: синхронный `Database` против `AsyncDatabase`;
+- время цикла публикации N постов (claim + сохранение результатов):
+  транзакция на каждый пост против `mark_published` пачками;
+- задержка от апдейта до ответа обработчика в режимах polling и webhook
+  против локального фейкового Telegram (fake_servers.py);
+- латентность создания счёта CryptoPay: новый httpx-клиент на каждый
+  счёт против общего `CryptoPayClient`;
+- пропускная способность импорта постов из CSV: разбор и проверка строк,
+  вставка по одной против `add_posts` одной транзакцией.
+- архивация: скорость переноса N опубликованных постов в posts_archive,
+  размеры файла (после checkpoint WAL), «горячей» posts с индексами и
+  архива, а также латентность «живых» запросов до и после архивации.
+  Архив лежит в том же файле и занимает большую часть освобождённых
+  страниц posts, так что incremental_vacuum возвращает ОС только остаток
+  (в основном место индексов posts), а не весь объём перенесённых строк.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import time
+
+import httpx
+
+from archive import PostArchiver
+from async_database import AsyncDatabase
+from bot import SchedulerBot, build_application, run
+from database import Database
+from cryptopay import CryptoPayClient
+from post_import import PostImporter
+from fake_servers import FakeCryptoPayServer, FakeTelegramServer, command_update
+
+
+class PerCallDatabase(Database):
+    """Старое поведение: новое соединение на каждый вызов."""
+
+    def get_connection(self):
+        return sqlite3.connect(self.db_name, detect_types=sqlite3.PARSE_DECLTYPES)
+
+
+def _measure(func, ops):
+    started = time.perf_counter()
+    for i in range(ops):
+        func(i)
+    elapsed = time.perf_counter() - started
+    return ops / elapsed if elapsed else float('inf')
+
+
+def bench_database(db_cls, ops):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = db_cls(os.path.join(tmp, 'bench.db'))
+        past = int(time.time()) - 60
+        results = {
+            'add_post': _measure(lambda i: db.add_post(i % 50, -100 - i % 5, f'post {i}', '[]', past), ops),
+            'get_user_posts': _measure(lambda i: db.get_user_posts(i % 50), ops),
+            'get_posts_to_publish': _measure(lambda i: db.get_posts_to_publish(), max(1, ops // 10)),
+        }
+        db.close()
+        return results
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _latency_report(values):
+    return {
+        'p50_ms': percentile(values, 50) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': max(values, default=0.0) * 1000,
+    }
+
+
+async def _run_handlers(db, updates, concurrency, use_async):
+    """Имитирует поток апдейтов: каждый обработчик пишет пост и читает список постов."""
+    past = int(time.time()) - 60
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, loop_lags = [], []
+    done = asyncio.Event()
+
+    async def ticker():
+        # Задержка event loop: насколько позже запланированного просыпается корутина
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            loop_lags.append(time.perf_counter() - started - 0.001)
+
+    async def handler(i):
+        async with semaphore:
+            started = time.perf_counter()
+            if use_async:
+                await db.add_post(i % 50, -100, f'post {i}', '[]', past)
+                await db.get_user_posts(i % 50)
+            else:
+                db.add_post(i % 50, -100, f'post {i}', '[]', past)
+                db.get_user_posts(i % 50)
+            latencies.append(time.perf_counter() - started)
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.gather(*(handler(i) for i in range(updates)))
+    done.set()
+    await ticker_task
+    return {'handler': _latency_report(latencies), 'loop_lag': _latency_report(loop_lags)}
+
+
+def bench_handlers(updates, concurrency):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'sync.db'))
+        results['sync_database'] = asyncio.run(_run_handlers(db, updates, concurrency, use_async=False))
+        db.close()
+
+        async def run_async():
+            async_db = AsyncDatabase(os.path.join(tmp, 'async.db'))
+            try:
+                return await _run_handlers(async_db, updates, concurrency, use_async=True)
+            finally:
+                await async_db.close()
+
+        results['async_database'] = asyncio.run(run_async())
+    return results
+
+
+def bench_publish_cycle(posts, batch_size):
+    results = {}
+    past = int(time.time()) - 60
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('per_post_commit', 'batched_commit'):
+            db = Database(os.path.join(tmp, f'{mode}.db'))
+            for i in range(posts):
+                db.add_post(i % 50, -100 - i % 20, f'post {i}', '[]', past)
+
+            started = time.perf_counter()
+            claimed = db.claim_due_posts('bench', 600, posts)
+            if mode == 'per_post_commit':
+                for post in claimed:
+                    db.set_post_published(post[0], post[0], 'bench')
+            else:
+                for i in range(0, len(claimed), batch_size):
+                    db.mark_published([(post[0], post[0]) for post in claimed[i:i + batch_size]], 'bench')
+            results[mode] = {'posts': len(claimed), 'wall_time_s': time.perf_counter() - started}
+            db.close()
+    return results
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _run_update_mode(mode, updates, db_path):
+    fake = FakeTelegramServer()
+    await fake.start()
+    replies = {}
+    fake.call_listeners.append(
+        lambda method, params: method == 'sendMessage' and params['chat_id'] in replies
+        and not replies[params['chat_id']].done() and replies[params['chat_id']].set_result(time.perf_counter())
+    )
+
+    bot_logic = SchedulerBot(db_path, update_mode=mode)
+    application = build_application(bot_logic, token='123:BENCH', base_url=fake.base_url)
+    port = _free_port()
+    stop_event = asyncio.Event()
+    bot_task = asyncio.create_task(run(
+        application, bot_logic, port, webhook_base_url=f'http://127.0.0.1:{port}', stop_event=stop_event
+    ))
+
+    # Ждём, пока бот начнёт принимать апдейты
+    ready_method = 'setWebhook' if mode == 'webhook' else 'getUpdates'
+    while not any(call[0] == ready_method for call in fake.calls):
+        if bot_task.done():
+            bot_task.result()
+        await asyncio.sleep(0.01)
+
+    loop = asyncio.get_running_loop()
+    latencies = []
+    for i in range(updates):
+        # /help от пользователя без доступа: ответ без обращений к БД
+        user_id = 10_000 + i
+        replies[user_id] = loop.create_future()
+        started = time.perf_counter()
+        await fake.push_update(command_update(i + 1, user_id, '/help'))
+        latencies.append(await asyncio.wait_for(replies[user_id], 10) - started)
+
+    stop_event.set()
+    await bot_task
+    await fake.stop()
+    return _latency_report(latencies)
+
+
+def bench_update_modes(updates):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('polling', 'webhook'):
+            results[mode] = asyncio.run(_run_update_mode(mode, updates, os.path.join(tmp, f'{mode}.db')))
+    return results
+
+
+async def _run_invoices(invoices, latency):
+    fake = FakeCryptoPayServer(latency=latency)
+    await fake.start()
+    url = f'{fake.base_url}/createInvoice'
+    payload = {'asset': 'USDT', 'amount': 1.0, 'description': 'bench', 'external_id': 'bench'}
+
+    per_call = []
+    for _ in range(invoices):
+        started = time.perf_counter()
+        async with httpx.AsyncClient() as client:
+            (await client.post(url, json=payload)).raise_for_status()
+        per_call.append(time.perf_counter() - started)
+
+    shared = []
+    client = CryptoPayClient(token='bench', base_url=fake.base_url)
+    for _ in range(invoices):
+        started = time.perf_counter()
+        await client.create_invoice(1.0, 'bench', 'bench')
+        shared.append(time.perf_counter() - started)
+    await client.close()
+
+    await fake.stop()
+    return {'client_per_invoice': _latency_report(per_call), 'shared_client': _latency_report(shared)}
+
+
+def bench_invoices(invoices, latency):
+    return asyncio.run(_run_invoices(invoices, latency))
+
+
+def bench_import(rows):
+    channels = [(-100 - i, f'Канал {i}') for i in range(5)]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['channel', 'text', 'media', 'time'])
+    for i in range(rows):
+        writer.writerow([channels[i % 5][1], f'post {i}', 'photo_file_id' if i % 3 == 0 else '', '2099-01-01 12:00'])
+    content = buffer.getvalue().encode()
+
+    started = time.perf_counter()
+    posts, errors = PostImporter(1, channels).run(io.BytesIO(content), 'csv')
+    parse_time = time.perf_counter() - started
+    results = {'rows': rows, 'errors': len(errors), 'parse_rows_per_s': rows / parse_time}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'per_row.db'))
+        started = time.perf_counter()
+        for post in posts:
+            db.add_post(*post)
+        results['insert_per_row_rows_per_s'] = len(posts) / (time.perf_counter() - started)
+        db.close()
+
+        db = Database(os.path.join(tmp, 'bulk.db'))
+        started = time.perf_counter()
+        db.add_posts(posts)
+        results['insert_bulk_rows_per_s'] = len(posts) / (time.perf_counter() - started)
+        db.close()
+    return results
+
+
+def _live_queries(db, users, ops):
+    """ops/sec запросов, которые бот выполняет на каждый апдейт или цикл публикации."""
+    return {
+        'get_user_posts_page': _measure(lambda i: db.get_user_posts_page(i % users, 10), ops),
+        'get_user_pending_posts': _measure(lambda i: db.get_user_pending_posts(i % users), ops),
+        'get_status_counters': _measure(lambda i: db.get_status_counters(), ops),
+        'get_pending_post_times': _measure(lambda i: db.get_pending_post_times(), max(1, ops // 10)),
+    }
+
+
+def _db_sizes(conn, path):
+    """Размеры в МБ: файл базы, posts с индексами, posts_archive; свободные страницы."""
+    # Иначе часть страниц ещё в WAL и размер основного файла ничего не говорит
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    tables = dict(conn.execute(
+        "SELECT m.tbl_name, SUM(s.pgsize) FROM dbstat s JOIN sqlite_master m ON m.name = s.name "
+        "WHERE m.tbl_name IN ('posts', 'posts_archive') GROUP BY m.tbl_name"
+    ))
+    return {
+        'file_mb': os.path.getsize(path) / 2 ** 20,
+        'posts_mb': tables.get('posts', 0) / 2 ** 20,
+        'archive_mb': tables.get('posts_archive', 0) / 2 ** 20,
+        'free_pages': conn.execute('PRAGMA freelist_count').fetchone()[0],
+    }
+
+
+def bench_archive(rows, users=1000, ops=500):
+    now = int(time.time())
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'archive.db')
+        db = Database(path)
+        conn = db.get_connection()
+        # Опубликованные посты за последние ~90 дней и немного ожидающих
+        conn.execute(
+            '''
+            WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < ?)
+            INSERT INTO posts (user_id, channel_id, text, media_ids, publish_time, is_published, status, message_id)
+            SELECT i % ?, -100 - i % 20, 'archived post ' || i || printf('%.200c', 'x'), '[]',
+                   ? - 86400 * 60 - i * 5, 1, 'published', i
+            FROM seq
+            ''',
+            (rows, users, now)
+        )
+        conn.executemany(
+            'INSERT INTO posts (user_id, channel_id, text, media_ids, publish_time) VALUES (?, ?, ?, ?, ?)',
+            [(i % users, -100 - i % 20, f'pending {i}', '[]', now + 3600 + i) for i in range(users * 5)]
+        )
+        conn.commit()
+        results = {'rows': rows, 'size_before': _db_sizes(conn, path)}
+        results['live_before'] = _live_queries(db, users, ops)
+
+        async def run_archiver():
+            async_db = AsyncDatabase(path)
+            try:
+                started = time.perf_counter()
+                archived, freed = await PostArchiver(async_db, after_days=30).archive(now)
+                return archived, freed, time.perf_counter() - started
+            finally:
+                await async_db.close()
+
+        archived, freed, elapsed = asyncio.run(run_archiver())
+        results.update({
+            'archived': archived,
+            'archive_rows_per_s': archived / elapsed,
+            'freed_pages': freed,
+            'size_after': _db_sizes(conn, path),
+        })
+        results['live_after'] = _live_queries(db, users, ops)
+        db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--publish-posts', type=int, default=1000)
+    parser.add_argument('--flush-size', type=int, default=50)
+    parser.add_argument('--telegram-updates', type=int, default=200)
+    parser.add_argument('--invoices', type=int, default=200)
+    parser.add_argument('--import-rows', type=int, default=10000)
+    parser.add_argument('--archive-rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    report = {
+        'per_call_connection': bench_database(PerCallDatabase, args.ops),
+        'persistent_connection': bench_database(Database, args.ops),
+        'handlers': bench_handlers(args.updates, args.concurrency),
+        'publish_cycle': bench_publish_cycle(args.publish_posts, args.flush_size),
+        'update_to_handler': bench_update_modes(args.telegram_updates),
+        'cryptopay_invoice': bench_invoices(args.invoices, latency=0.0),
+        'post_import': bench_import(args.import_rows),
+        'archive': bench_archive(args.archive_rows),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
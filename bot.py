@@ -3,9 +3,11 @@ import asyncio
 import datetime
 import pytz
 import uuid
-import httpx
 import json
 import traceback
+import hmac
+import io
+import signal
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
 from telegram.ext import (
@@ -16,21 +18,72 @@ from aiohttp import web
 from config import (
     BOT_TOKEN, ADMIN_IDS,
     WEB_SERVER_PORT, MOSCOW_TZ, WEB_SERVER_BASE_URL,
-    CRYPTOPAY_BOT_TOKEN, CRYPTOPAY_WEBHOOK_PATH, CRYPTOPAY_CREATE_INVOICE_URL,
-    DB_NAME
+    CRYPTOPAY_WEBHOOK_PATH, CRYPTOPAY_API_URL,
+    DB_NAME, PUBLISHER_MODE,
+    MAX_MEDIA_PER_POST, MEDIA_GROUP_WINDOW,
+    TELEGRAM_UPDATE_MODE, TELEGRAM_WEBHOOK_PATH, TELEGRAM_WEBHOOK_SECRET,
+    MY_POSTS_PAGE_SIZE, METRICS_PATH, MAX_IMPORT_FILE_SIZE, IMPORT_ERRORS_SHOWN
 )
-from database import Database
+from async_database import AsyncDatabase
+from database import QuotaExceededError, post_day
+from cryptopay import CryptoPayClient, CryptoPayError, CircuitOpenError
+from metrics import HANDLER_DURATION, WEBHOOK_DURATION, metrics_handler, timed
+from notifications import NotificationQueue
+from state_store import create_state_store
+from post_import import PostImporter, detect_format
+from quota import QuotaService
+from recurrence import RecurringExpander, day_over_limit, describe_recurrence, parse_recurrence
+from stats import StatsService
+from publisher import PublishDispatcher
+from scheduler import PostScheduler, PublishNotifier, register_publisher_gauges
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+POST_STATUS_LABELS = {
+    'pending': "⏳ В ожидании",
+    'publishing': "📤 Публикуется",
+    'published': "✅ Опубликован",
+    'failed': "❌ Ошибка публикации",
+    'skipped': "⏭ Пропущен (просрочен)",
+}
+
+
+def channel_picker_markup(channels, selected):
+    """Клавиатура выбора нескольких каналов для /schedule_post."""
+    keyboard = [
+        [InlineKeyboardButton(f"{'✅' if cid in selected else '▫️'} {name}", callback_data=f"schedule_toggle_{cid}")]
+        for cid, name in channels
+    ]
+    keyboard.append([InlineKeyboardButton(f"Далее ➡️ ({len(selected)})", callback_data="schedule_done")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def format_publish_time(publish_ts, fmt='%Y-%m-%d %H:%M:%S'):
+    """Форматирует publish_time (UTC epoch) по московскому времени."""
+    return datetime.datetime.fromtimestamp(publish_ts, MOSCOW_TZ).strftime(fmt)
+
 class SchedulerBot:
-    def __init__(self, db_name):
-        self.db = Database(db_name)
-        self.user_states = {}
-        self.post_data = {}
+    def __init__(self, db_name, update_mode=TELEGRAM_UPDATE_MODE, publisher_mode=PUBLISHER_MODE):
+        self.db = AsyncDatabase(db_name)
+        self.update_mode = update_mode
+        self.user_states = create_state_store(self.db, 'user_states')
+        self.post_data = create_state_store(self.db, 'post_data')
+        self.album_timers = {}
+        self.stats = StatsService(self.db)
+        self.quota = QuotaService(self.db)
+        self.recurring = RecurringExpander(self.db, self.quota)
+        self.publisher_mode = publisher_mode
+        if publisher_mode == 'external':
+            # Публикует отдельный процесс scheduler.py, сюда - только уведомления о новых постах
+            self.scheduler = PublishNotifier()
+            self.dispatcher = PublishDispatcher()
+        else:
+            self.scheduler = PostScheduler(self.db, on_change=self.stats.invalidate)
+            self.dispatcher = self.scheduler.dispatcher
         self.application = None
-        self.publisher_task = None
+        self.cryptopay = None
+        self.notifications = None
         self.start_time = datetime.datetime.now(MOSCOW_TZ)
 
     def set_application(self, application):
@@ -45,7 +98,7 @@ class SchedulerBot:
             await update.message.reply_text("❌ У вас нет доступа к этому боту")
             return
             
-        self.db.add_user(user.id, user.username)
+        await self.db.add_user(user.id, user.username)
         await update.message.reply_text(
             f"Привет, {user.first_name}!\n"
             "Я бот для отложенного постинга в Telegram-каналах.\n"
@@ -63,6 +116,9 @@ class SchedulerBot:
             "/my_channels - Показать мои каналы.\n"
             "/remove_channel - Отвязать канал.\n"
             "/schedule_post - Запланировать пост.\n"
+            "/import_posts - Запланировать посты из CSV/JSON файла.\n"
+            "/repeat_post - Запланировать повторяющийся пост.\n"
+            "/my_repeats - Повторяющиеся посты.\n"
             "/my_posts - Показать мои посты.\n"
             "/cancel_post - Отменить пост.\n"
             "/balance - Проверить баланс.\n"
@@ -76,15 +132,13 @@ class SchedulerBot:
             await update.message.reply_text("❌ У вас нет доступа")
             return
             
-        user_info = self.db.get_user(user_id)
-        if not user_info:
+        channel_limit = await self.quota.check_channel_limit(user_id)
+        if channel_limit is None:
             await update.message.reply_text("Пожалуйста, сначала используйте /start.")
             return
 
-        current_channels = self.db.get_user_channels(user_id)
-        max_channels = user_info[6] if user_info and user_info[6] is not None else 1
-
-        if len(current_channels) >= max_channels:
+        allowed, max_channels = channel_limit
+        if not allowed:
             await update.message.reply_text(f"❌ Вы достигли лимита каналов ({max_channels}).")
             return
 
@@ -92,7 +146,7 @@ class SchedulerBot:
             "1. Добавьте меня как администратора в ваш канал с правом на публикацию сообщений.\n"
             "2. Перешлите мне любое сообщение из этого канала."
         )
-        self.user_states[user_id] = {'stage': 'awaiting_channel_forward'}
+        await self.user_states.set(user_id, {'stage': 'awaiting_channel_forward'})
 
     async def my_channels(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
@@ -100,7 +154,7 @@ class SchedulerBot:
             await update.message.reply_text("❌ У вас нет доступа")
             return
             
-        channels = self.db.get_user_channels(user_id)
+        channels = await self.db.get_user_channels(user_id)
         if not channels:
             await update.message.reply_text("У вас нет привязанных каналов. Используйте /add_channel.")
             return
@@ -116,7 +170,7 @@ class SchedulerBot:
             await update.message.reply_text("❌ У вас нет доступа")
             return
             
-        channels = self.db.get_user_channels(user_id)
+        channels = await self.db.get_user_channels(user_id)
         if not channels:
             await update.message.reply_text("У вас нет каналов для удаления.")
             return
@@ -130,42 +184,119 @@ class SchedulerBot:
             await update.message.reply_text("❌ У вас нет доступа")
             return
             
-        channels = self.db.get_user_channels(user_id)
+        channels = await self.db.get_user_channels(user_id)
+        if not channels:
+            await update.message.reply_text("Сначала добавьте канал через /add_channel.")
+            return
+
+        await self.post_data.set(user_id, {'channel_ids': []})
+        await update.message.reply_text(
+            "Выберите каналы для поста (можно несколько) и нажмите «Далее»:",
+            reply_markup=channel_picker_markup(channels, set())
+        )
+        await self.user_states.set(user_id, {'stage': 'awaiting_post_channel_selection'})
+
+    async def repeat_post(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if not self.is_user_admin(user_id):
+            await update.message.reply_text("❌ У вас нет доступа")
+            return
+
+        channels = await self.db.get_user_channels(user_id)
         if not channels:
             await update.message.reply_text("Сначала добавьте канал через /add_channel.")
             return
 
-        keyboard = [[InlineKeyboardButton(name, callback_data=f"schedule_channel_{cid}")] for cid, name in channels]
-        await update.message.reply_text("Выберите канал для поста:", reply_markup=InlineKeyboardMarkup(keyboard))
-        self.user_states[user_id] = {'stage': 'awaiting_post_channel_selection'}
+        keyboard = [[InlineKeyboardButton(name, callback_data=f"repeat_channel_{cid}")] for cid, name in channels]
+        await update.message.reply_text("Выберите канал для повторяющегося поста:", reply_markup=InlineKeyboardMarkup(keyboard))
+        await self.user_states.set(user_id, {'stage': 'awaiting_post_channel_selection'})
+
+    async def my_repeats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if not self.is_user_admin(user_id):
+            await update.message.reply_text("❌ У вас нет доступа")
+            return
+
+        templates = await self.db.get_user_recurring_posts(user_id)
+        if not templates:
+            await update.message.reply_text("Нет повторяющихся постов. Используйте /repeat_post.")
+            return
+
+        response_text = "Повторяющиеся посты:\n"
+        keyboard = []
+        for recurring_id, channel_id, text, cron, interval_seconds, next_run, end_time in templates:
+            until = f", до {format_publish_time(end_time, '%Y-%m-%d %H:%M')}" if end_time else ""
+            response_text += (
+                f"\n**ID:** {recurring_id} | **Канал ID:** {channel_id}\n"
+                f"**Расписание:** {describe_recurrence(cron, interval_seconds)}{until}\n"
+                f"**Следующее вхождение:** {format_publish_time(next_run)} МСК\n"
+                f"**Текст:** {(text or '')[:50]}...\n"
+            )
+            keyboard.append([InlineKeyboardButton(f"Остановить {recurring_id}", callback_data=f"cancel_repeat_{recurring_id}")])
+        await update.message.reply_text(response_text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+    async def import_posts(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if not self.is_user_admin(user_id):
+            await update.message.reply_text("❌ У вас нет доступа")
+            return
+
+        if not await self.db.get_user_channels(user_id):
+            await update.message.reply_text("Сначала добавьте канал через /add_channel.")
+            return
+
+        await update.message.reply_text(
+            "Отправьте файл .csv, .json или .jsonl с постами.\n"
+            "Поля: channel (ID или название канала), text, media (file_id через пробел, "
+            "видео с префиксом video:), time (ГГГГ-ММ-ДД ЧЧ:ММ по МСК).\n"
+            "Пример CSV:\n"
+            "channel,text,media,time\n"
+            "Мой канал,Привет!,,2030-01-01 12:00"
+        )
+        await self.user_states.set(user_id, {'stage': 'awaiting_import_file'})
 
     async def my_posts(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         if not self.is_user_admin(user_id):
             await update.message.reply_text("❌ У вас нет доступа")
             return
-            
-        posts = self.db.get_user_posts(user_id)
-        if not posts:
+
+        page = await self.render_posts_page(user_id)
+        if page is None:
             await update.message.reply_text("У вас нет запланированных постов.")
             return
+        response_text, reply_markup = page
+        await update.message.reply_text(response_text, reply_markup=reply_markup, parse_mode='Markdown')
 
-        response_text = "Ваши запланированные посты:\n"
-        for post_id, channel_id, text, publish_time_str, is_published in posts:
-            channel_info = self.db.get_channel_info(channel_id)
-            channel_name = channel_info[3] if channel_info else f"Канал ID: {channel_id}"
-            status = "✅ Опубликован" if is_published else "⏳ В ожидании"
+    async def render_posts_page(self, user_id, before=None, after=None):
+        """Текст и клавиатура одной страницы /my_posts или None, если постов нет."""
+        posts, has_more = await self.db.get_user_posts_page(user_id, MY_POSTS_PAGE_SIZE, before=before, after=after)
+        if not posts:
+            return None
 
-            publish_time_dt = datetime.datetime.fromisoformat(publish_time_str)
-            moscow_time_str = publish_time_dt.astimezone(MOSCOW_TZ).strftime('%Y-%m-%d %H:%M:%S')
+        response_text = "Ваши запланированные посты:\n"
+        for post_id, channel_id, channel_name, text, publish_time, status in posts:
+            channel_name = channel_name or f"Канал ID: {channel_id}"
+            moscow_time_str = format_publish_time(publish_time)
 
             response_text += (
                 f"\n**ID:** {post_id} | **Канал:** {channel_name}\n"
                 f"**Время:** {moscow_time_str} МСК\n"
-                f"**Статус:** {status}\n"
+                f"**Статус:** {POST_STATUS_LABELS.get(status, status)}\n"
                 f"**Текст:** {(text or '')[:50]}...\n"
             )
-        await update.message.reply_text(response_text, parse_mode='Markdown')
+
+        # Переход назад возможен, если мы пришли по курсору, вперёд - если есть ещё посты
+        has_newer = has_more if after is not None else before is not None
+        has_older = has_more if after is None else True
+        buttons = []
+        if has_newer:
+            first_id, first_time = posts[0][0], posts[0][4]
+            buttons.append(InlineKeyboardButton("⬅️ Новее", callback_data=f"my_posts_prev_{first_time}_{first_id}"))
+        if has_older:
+            last_id, last_time = posts[-1][0], posts[-1][4]
+            buttons.append(InlineKeyboardButton("Старее ➡️", callback_data=f"my_posts_next_{last_time}_{last_id}"))
+        return response_text, InlineKeyboardMarkup([buttons]) if buttons else None
 
     async def cancel_post(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
@@ -173,15 +304,14 @@ class SchedulerBot:
             await update.message.reply_text("❌ У вас нет доступа")
             return
             
-        pending_posts = [p for p in self.db.get_user_posts(user_id) if not p[4]]
+        pending_posts = await self.db.get_user_pending_posts(user_id)
         if not pending_posts:
             await update.message.reply_text("Нет постов для отмены.")
             return
 
         keyboard = []
-        for post_id, channel_id, text, publish_time_str, is_published in pending_posts:
-            publish_time_dt = datetime.datetime.fromisoformat(publish_time_str)
-            time_str = publish_time_dt.astimezone(MOSCOW_TZ).strftime('%H:%M')
+        for post_id, channel_id, publish_time in pending_posts:
+            time_str = format_publish_time(publish_time, '%H:%M')
             keyboard.append([InlineKeyboardButton(f"Отменить пост {post_id} на {time_str}", callback_data=f"cancel_post_{post_id}")])
 
         await update.message.reply_text("Выберите пост для отмены:", reply_markup=InlineKeyboardMarkup(keyboard))
@@ -192,7 +322,7 @@ class SchedulerBot:
             await update.message.reply_text("❌ У вас нет доступа")
             return
             
-        balance = self.db.get_user_balance(user_id)
+        balance = await self.db.get_user_balance(user_id)
         await update.message.reply_text(f"💰 Ваш баланс: **{balance:.2f} USD**", parse_mode='Markdown')
         
     async def deposit(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -206,7 +336,7 @@ class SchedulerBot:
             "Минимальная сумма - 1 USD. Оплата через **@CryptoBot**.",
             parse_mode='Markdown'
         )
-        self.user_states[user_id] = {'stage': 'awaiting_deposit_amount'}
+        await self.user_states.set(user_id, {'stage': 'awaiting_deposit_amount'})
 
     async def create_cryptopay_invoice(self, user_id, amount_str: str, update: Update):
         try:
@@ -220,34 +350,26 @@ class SchedulerBot:
 
         order_id = str(uuid.uuid4())
 
-        headers = {'Crypto-Pay-API-Token': CRYPTOPAY_BOT_TOKEN}
-        payload = {
-            "asset": "USDT",
-            "amount": amount,
-            "description": f"Пополнение баланса (user_id: {user_id})",
-            "external_id": order_id,
-        }
-
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(CRYPTOPAY_CREATE_INVOICE_URL, headers=headers, json=payload)
-                data = response.json()
+        try:
+            invoice = await self.cryptopay.create_invoice(
+                amount, f"Пополнение баланса (user_id: {user_id})", order_id
+            )
+        except CircuitOpenError:
+            await update.message.reply_text("❌ Платежная система временно недоступна. Попробуйте позже.")
+            return
+        except CryptoPayError as e:
+            logging.error(f"CryptoPay invoice error: {e}")
+            await update.message.reply_text("❌ Не удалось создать счет.")
+            return
 
-                if response.status_code == 201 and data.get('ok'):
-                    pay_url = data['result']['pay_url']
-                    self.db.add_payment(user_id, amount, order_id, 'pending', pay_url, 'cryptopay')
-                    keyboard = [[InlineKeyboardButton("💳 Перейти к оплате", url=pay_url)]]
-                    await update.message.reply_text(
-                        f"💰 Создан счет на **{amount} USDT**.",
-                        reply_markup=InlineKeyboardMarkup(keyboard),
-                        parse_mode='Markdown'
-                    )
-                else:
-                    logging.error(f"CryptoPay invoice error: {data}")
-                    await update.message.reply_text("❌ Не удалось создать счет.")
-            except Exception as e:
-                logging.error(f"HTTP error during deposit: {e}")
-                await update.message.reply_text("❌ Ошибка связи с платежной системой.")
+        pay_url = invoice['pay_url']
+        await self.db.add_payment(user_id, amount, order_id, 'pending', pay_url, 'cryptopay')
+        keyboard = [[InlineKeyboardButton("💳 Перейти к оплате", url=pay_url)]]
+        await update.message.reply_text(
+            f"💰 Создан счет на **{amount} USDT**.",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
 
     async def show_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показывает статус бота, время и статистику"""
@@ -265,24 +387,18 @@ class SchedulerBot:
             minutes, seconds = divmod(remainder, 60)
             uptime_str = f"{int(hours)}ч {int(minutes)}м {int(seconds)}с"
             
-            channels = self.db.get_channels()
-            posts = self.db.get_scheduled_posts()
-            
-            scheduled_count = len(posts)
-            
+            stats = await self.stats.get()
+
             next_post_time = "Нет запланированных"
-            if posts:
-                next_post = posts[0]
-                next_time_str = next_post[5]
-                next_time = datetime.datetime.strptime(next_time_str, '%Y-%m-%d %H:%M:%S')
-                next_post_time = MOSCOW_TZ.localize(next_time).strftime('%d.%m.%Y %H:%M')
+            if stats['next_publish_time'] is not None:
+                next_post_time = format_publish_time(stats['next_publish_time'], '%d.%m.%Y %H:%M')
             
             status_message = (
                 f"🤖 **СТАТУС БОТА**\n\n"
                 f"⏰ **Текущее время:** {current_time_str} (МСК)\n"
                 f"🕐 **Время работы:** {uptime_str}\n"
-                f"📊 **Каналов подключено:** {len(channels)}\n"
-                f"📅 **Запланировано публикаций:** {scheduled_count}\n"
+                f"📊 **Каналов подключено:** {stats['channels']}\n"
+                f"📅 **Запланировано публикаций:** {stats['scheduled']}\n"
                 f"⏱ **Ближайшая публикация:** {next_post_time}\n"
                 f"🟢 **Статус:** Активен\n\n"
                 f"_Последнее обновление: {current_time.strftime('%H:%M:%S')}_"
@@ -300,7 +416,7 @@ class SchedulerBot:
             await update.message.reply_text("❌ У вас нет доступа")
             return
         
-        channels = self.db.get_user_channels(user_id)
+        channels = await self.db.get_user_channels(user_id)
         
         if not channels:
             await update.message.reply_text("📭 Каналы не добавлены")
@@ -317,7 +433,7 @@ class SchedulerBot:
         if not self.is_user_admin(user_id):
             return
             
-        state = self.user_states.get(user_id, {}).get('stage')
+        state = (await self.user_states.get(user_id, {})).get('stage')
 
         if state == 'awaiting_channel_forward':
             if update.message.forward_from_chat and update.message.forward_from_chat.type == 'channel':
@@ -332,22 +448,28 @@ class SchedulerBot:
                     await update.message.reply_text("❌ Бот должен быть админом с правом на публикацию.")
                     return
 
-                if self.db.add_channel(user_id, channel_id, channel_name):
+                if await self.db.add_channel(user_id, channel_id, channel_name):
+                    self.stats.invalidate()
+                    self.quota.invalidate(user_id)
                     await update.message.reply_text(f"✅ Канал **{channel_name}** добавлен!", parse_mode='Markdown')
                 else:
                     await update.message.reply_text("❌ Ошибка добавления канала.")
-                self.user_states.pop(user_id, None)
+                await self.user_states.pop(user_id)
             else:
                 await update.message.reply_text("❌ Пожалуйста, перешлите сообщение из канала.")
 
         elif state == 'awaiting_post_text':
-            self.post_data.setdefault(user_id, {})['text'] = update.message.text
-            await update.message.reply_text("Отправьте фото/видео или `-` (дефис), если медиа нет.")
-            self.user_states[user_id]['stage'] = 'awaiting_post_media'
+            post_info = await self.post_data.get(user_id, {})
+            post_info['text'] = update.message.text
+            await self.post_data.set(user_id, post_info)
+            await update.message.reply_text(
+                f"Отправьте фото/видео (альбом - до {MAX_MEDIA_PER_POST} файлов) или `-` (дефис), если медиа нет."
+            )
+            await self.user_states.set(user_id, {'stage': 'awaiting_post_media'})
 
         elif state == 'awaiting_post_media' and update.message.text == '-':
             await update.message.reply_text("Введите время публикации (МСК) в формате `ГГГГ-ММ-ДД ЧЧ:ММ`")
-            self.user_states[user_id]['stage'] = 'awaiting_post_time'
+            await self.user_states.set(user_id, {'stage': 'awaiting_post_time'})
 
         elif state == 'awaiting_post_time':
             try:
@@ -358,28 +480,193 @@ class SchedulerBot:
                     await update.message.reply_text("❌ Время должно быть в будущем.")
                     return
 
-                post_info = self.post_data.get(user_id, {})
-                self.db.add_post(user_id, post_info['channel_id'], post_info.get('text'), json.dumps(post_info.get('media_ids', [])), utc_time.isoformat())
-                await update.message.reply_text(f"✅ Пост запланирован на **{moscow_time.strftime('%Y-%m-%d %H:%M')}** МСК!", parse_mode='Markdown')
-                self.user_states.pop(user_id, None)
-                self.post_data.pop(user_id, None)
+                post_info = await self.post_data.get(user_id, {})
+                publish_ts = int(utc_time.timestamp())
+                if post_info.get('repeat'):
+                    post_info['first_run'] = publish_ts
+                    await self.post_data.set(user_id, post_info)
+                    await update.message.reply_text(
+                        "Как часто повторять? Интервал (`30m`, `6h`, `1d`, `1w`) или cron по МСК (`0 10 * * mon`).\n"
+                        "Дату окончания можно добавить через `;`: `1d; 2030-12-31 23:59`",
+                        parse_mode='Markdown'
+                    )
+                    await self.user_states.set(user_id, {'stage': 'awaiting_post_repeat'})
+                    return
+                channel_ids = post_info.get('channel_ids') or [post_info['channel_id']]
+                day = post_day(publish_ts)
+                remaining = await self.quota.remaining_posts(user_id, day)
+                if remaining is not None and remaining < len(channel_ids):
+                    await update.message.reply_text(self.daily_limit_message(day, remaining, len(channel_ids)))
+                    return
+                daily_limit = await self.quota.daily_limit(user_id)
+                media_ids = json.dumps(post_info.get('media_ids', []))
+                try:
+                    if len(channel_ids) == 1:
+                        post_id = await self.db.add_post(
+                            user_id, channel_ids[0], post_info.get('text'), media_ids, publish_ts, daily_limit=daily_limit
+                        )
+                        added = [(post_id, publish_ts)]
+                    else:
+                        # Рассылка: текст и медиа хранятся один раз, каналы публикуются и повторяются независимо
+                        added = await self.db.add_fanout_post(
+                            user_id, channel_ids, post_info.get('text'), media_ids, publish_ts, daily_limit=daily_limit
+                        )
+                except QuotaExceededError:
+                    # Кэш счётчика отстал (например, пост добавлен из другого процесса)
+                    self.quota.forget_day(user_id, day)
+                    await update.message.reply_text(self.daily_limit_message(day, 0, len(channel_ids)))
+                    return
+                self.quota.record_posts(user_id, day, len(added))
+                for post_id, publish_time in added:
+                    self.scheduler.add_new_post(post_id, publish_time)
+                self.stats.invalidate()
+                targets = f" в {len(channel_ids)} каналах" if len(channel_ids) > 1 else ""
+                await update.message.reply_text(f"✅ Пост запланирован{targets} на **{moscow_time.strftime('%Y-%m-%d %H:%M')}** МСК!", parse_mode='Markdown')
+                await self.user_states.pop(user_id)
+                await self.post_data.pop(user_id)
             except (ValueError, KeyError):
                 await update.message.reply_text("❌ Неверный формат времени или ошибка. Попробуйте снова.")
 
+        elif state == 'awaiting_post_repeat':
+            spec, _, end_str = update.message.text.partition(';')
+            try:
+                cron, interval_seconds = parse_recurrence(spec)
+            except ValueError as e:
+                await update.message.reply_text(f"❌ {e}")
+                return
+
+            post_info = await self.post_data.get(user_id, {})
+            end_time = None
+            if end_str.strip():
+                try:
+                    end_time = int(MOSCOW_TZ.localize(datetime.datetime.strptime(end_str.strip(), '%Y-%m-%d %H:%M')).timestamp())
+                except ValueError:
+                    await update.message.reply_text("❌ Неверный формат даты окончания. Попробуйте снова.")
+                    return
+                if end_time < post_info['first_run']:
+                    await update.message.reply_text("❌ Дата окончания раньше первой публикации.")
+                    return
+
+            daily_limit = await self.quota.daily_limit(user_id)
+            if daily_limit is not None:
+                day = day_over_limit(cron, interval_seconds, post_info['first_run'], end_time, daily_limit)
+                if day is not None:
+                    await update.message.reply_text(
+                        f"❌ По этому расписанию на {day} выходит больше {daily_limit} пост(ов) - "
+                        f"это дневной лимит вашего тарифа. Задайте интервал реже или смените тариф."
+                    )
+                    return
+
+            recurring_id = await self.db.add_recurring_post(
+                user_id, post_info['channel_id'], post_info.get('text'), json.dumps(post_info.get('media_ids', [])),
+                cron, interval_seconds, post_info['first_run'], end_time
+            )
+            await self.expand_recurring_posts()
+            until = f", до {format_publish_time(end_time, '%Y-%m-%d %H:%M')}" if end_time else ""
+            await update.message.reply_text(
+                f"✅ Повторяющийся пост {recurring_id}: первая публикация "
+                f"**{format_publish_time(post_info['first_run'], '%Y-%m-%d %H:%M')}** МСК, "
+                f"{describe_recurrence(cron, interval_seconds)}{until}.",
+                parse_mode='Markdown'
+            )
+            await self.user_states.pop(user_id)
+            await self.post_data.pop(user_id)
+
         elif state == 'awaiting_deposit_amount':
             await self.create_cryptopay_invoice(user_id, update.message.text, update)
-            self.user_states.pop(user_id, None)
+            await self.user_states.pop(user_id)
             
     async def handle_media(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         if not self.is_user_admin(user_id):
             return
             
-        if self.user_states.get(user_id, {}).get('stage') == 'awaiting_post_media':
-            media_id = update.message.photo[-1].file_id if update.message.photo else update.message.video.file_id
-            self.post_data.setdefault(user_id, {})['media_ids'] = [media_id]
-            await update.message.reply_text("Введите время публикации (МСК) в формате `ГГГГ-ММ-ДД ЧЧ:ММ`")
-            self.user_states[user_id]['stage'] = 'awaiting_post_time'
+        if (await self.user_states.get(user_id, {})).get('stage') != 'awaiting_post_media':
+            return
+
+        if update.message.photo:
+            media = {'type': 'photo', 'file_id': update.message.photo[-1].file_id}
+        else:
+            media = {'type': 'video', 'file_id': update.message.video.file_id}
+
+        post_info = await self.post_data.get(user_id, {})
+        media_ids = post_info.setdefault('media_ids', [])
+        if len(media_ids) < MAX_MEDIA_PER_POST:
+            media_ids.append(media)
+            await self.post_data.set(user_id, post_info)
+
+        if update.message.media_group_id is None:
+            await self.finish_media_collection(user_id, update)
+            return
+
+        # Альбом приходит отдельными сообщениями: ждём, пока они перестанут поступать
+        timer = self.album_timers.pop(user_id, None)
+        if timer:
+            timer.cancel()
+        self.album_timers[user_id] = asyncio.create_task(self.close_album_window(user_id, update))
+
+    async def close_album_window(self, user_id, update: Update):
+        await asyncio.sleep(MEDIA_GROUP_WINDOW)
+        self.album_timers.pop(user_id, None)
+        await self.finish_media_collection(user_id, update)
+
+    async def finish_media_collection(self, user_id, update: Update):
+        if (await self.user_states.get(user_id, {})).get('stage') != 'awaiting_post_media':
+            return
+        count = len((await self.post_data.get(user_id, {})).get('media_ids', []))
+        await update.message.reply_text(
+            f"Медиафайлов в посте: {count}.\n"
+            "Введите время публикации (МСК) в формате `ГГГГ-ММ-ДД ЧЧ:ММ`"
+        )
+        await self.user_states.set(user_id, {'stage': 'awaiting_post_time'})
+
+    async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if not self.is_user_admin(user_id):
+            return
+
+        if (await self.user_states.get(user_id, {})).get('stage') != 'awaiting_import_file':
+            return
+
+        document = update.message.document
+        file_format = detect_format(document.file_name)
+        if file_format is None:
+            await update.message.reply_text("❌ Поддерживаются файлы .csv, .json и .jsonl.")
+            return
+        if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+            await update.message.reply_text("❌ Файл больше 20 МБ.")
+            return
+
+        tg_file = await document.get_file()
+        content = await tg_file.download_as_bytearray()
+        importer = PostImporter(user_id, await self.db.get_user_channels(user_id))
+        # Разбор и проверка тысяч строк - в потоке, чтобы не блокировать event loop
+        posts, errors = await asyncio.to_thread(importer.run, io.BytesIO(content), file_format)
+        posts, over_limit = await self.apply_daily_limit(user_id, posts)
+        errors += over_limit
+
+        added = []
+        if posts:
+            try:
+                added = await self.db.add_posts(posts, daily_limit=await self.quota.daily_limit(user_id))
+            except QuotaExceededError as e:
+                errors.append((0, f"превышен дневной лимит ({e.limit} постов) на {e.day}, файл не импортирован"))
+            self.quota.invalidate(user_id)
+        for post_id, publish_time in added:
+            self.scheduler.add_new_post(post_id, publish_time)
+        if added:
+            self.stats.invalidate()
+        logging.info(f"User {user_id} imported {len(added)} posts, {len(errors)} rows rejected.")
+
+        report = f"✅ Запланировано постов: {len(added)}"
+        if errors:
+            report += f"\n❌ Строк с ошибками: {len(errors)}"
+            for line_no, error in errors[:IMPORT_ERRORS_SHOWN]:
+                report += f"\n- строка {line_no}: {error}" if line_no else f"\n- {error}"
+            if len(errors) > IMPORT_ERRORS_SHOWN:
+                report += f"\n... и ещё {len(errors) - IMPORT_ERRORS_SHOWN}"
+        await update.message.reply_text(report[:4096])
+        await self.user_states.pop(user_id)
 
     async def handle_callback_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
@@ -391,37 +678,90 @@ class SchedulerBot:
             return
 
         if data.startswith('remove_channel_'):
-            self.db.remove_channel(user_id, int(data.split('_')[2]))
+            await self.db.remove_channel(user_id, int(data.split('_')[2]))
+            self.stats.invalidate()
+            self.quota.invalidate(user_id)
             await query.edit_message_text("✅ Канал удален.")
-        elif data.startswith('schedule_channel_'):
-            self.post_data[user_id] = {'channel_id': int(data.split('_')[2])}
+        elif data.startswith('schedule_toggle_'):
+            channel_id = int(data.split('_')[2])
+            post_info = await self.post_data.get(user_id, {})
+            channel_ids = post_info.setdefault('channel_ids', [])
+            if channel_id in channel_ids:
+                channel_ids.remove(channel_id)
+            else:
+                channel_ids.append(channel_id)
+            await self.post_data.set(user_id, post_info)
+            channels = await self.db.get_user_channels(user_id)
+            await query.edit_message_reply_markup(reply_markup=channel_picker_markup(channels, set(channel_ids)))
+        elif data == 'schedule_done':
+            if not (await self.post_data.get(user_id, {})).get('channel_ids'):
+                await query.message.reply_text("❌ Выберите хотя бы один канал.")
+                return
             await query.edit_message_text("Отправьте текст поста.")
-            self.user_states[user_id] = {'stage': 'awaiting_post_text'}
+            await self.user_states.set(user_id, {'stage': 'awaiting_post_text'})
+        elif data.startswith(('schedule_channel_', 'repeat_channel_')):
+            post_info = {'channel_id': int(data.split('_')[2])}
+            if data.startswith('repeat_channel_'):
+                post_info['repeat'] = True
+            await self.post_data.set(user_id, post_info)
+            await query.edit_message_text("Отправьте текст поста.")
+            await self.user_states.set(user_id, {'stage': 'awaiting_post_text'})
+        elif data.startswith('my_posts_'):
+            direction, cursor = data[len('my_posts_'):].split('_', 1)
+            publish_time, post_id = cursor.rsplit('_', 1)
+            cursor = (int(publish_time), int(post_id))
+            if direction == 'next':
+                page = await self.render_posts_page(user_id, before=cursor)
+            else:
+                page = await self.render_posts_page(user_id, after=cursor)
+            if page:
+                await query.edit_message_text(page[0], reply_markup=page[1], parse_mode='Markdown')
         elif data.startswith('cancel_post_'):
-            self.db.delete_post(int(data.split('_')[2]))
+            post_id = int(data.split('_')[2])
+            deleted = await self.db.delete_post(post_id)
+            if deleted:
+                self.quota.forget_day(deleted[0], post_day(deleted[1]))
+            self.scheduler.discard_post(post_id)
+            self.stats.invalidate()
             await query.edit_message_text("✅ Пост отменен.")
+        elif data.startswith('cancel_repeat_'):
+            for post_id in await self.db.cancel_recurring_post(user_id, int(data.split('_')[2])):
+                self.scheduler.discard_post(post_id)
+            self.stats.invalidate()
+            self.quota.invalidate(user_id)
+            await query.edit_message_text("✅ Повторяющийся пост остановлен.")
+
+    @staticmethod
+    def daily_limit_message(day, remaining, requested):
+        if remaining:
+            return f"❌ На {day} можно запланировать ещё {remaining} пост(ов), а выбрано каналов: {requested}."
+        return f"❌ Достигнут дневной лимит постов на {day}. Выберите другую дату или смените тариф."
+
+    async def apply_daily_limit(self, user_id, posts):
+        """Отбрасывает строки импорта сверх дневного лимита: (посты, [(0, ошибка)] по дням)."""
+        remaining, accepted, rejected = {}, [], {}
+        for post in posts:
+            day = post_day(post[4])
+            if day not in remaining:
+                remaining[day] = await self.quota.remaining_posts(user_id, day)
+            if remaining[day] is None:
+                accepted.append(post)
+            elif remaining[day] > 0:
+                remaining[day] -= 1
+                accepted.append(post)
+            else:
+                rejected[day] = rejected.get(day, 0) + 1
+        errors = [(0, f"превышен дневной лимит на {day}: пропущено постов - {count}") for day, count in sorted(rejected.items())]
+        return accepted, errors
 
-    async def publish_scheduled_posts(self, application):
-        while True:
-            await asyncio.sleep(60)
-            posts = self.db.get_posts_to_publish()
-            for post_id, user_id, channel_id, text, media_ids_str in posts:
-                try:
-                    media_ids = json.loads(media_ids_str or '[]')
-                    message = None
-                    if not media_ids:
-                        message = await application.bot.send_message(channel_id, text, parse_mode='Markdown')
-                    else:
-                        message = await application.bot.send_photo(channel_id, media_ids[0], caption=text, parse_mode='Markdown')
-
-                    if message:
-                        self.db.set_post_published(post_id, message.message_id)
-                        logging.info(f"Post {post_id} published.")
-                except Exception as e:
-                    logging.error(f"Error publishing post {post_id}: {traceback.format_exc()}")
+    async def expand_recurring_posts(self):
+        added = await self.recurring.expand()
+        for post_id, publish_time in added:
+            self.scheduler.add_new_post(post_id, publish_time)
+        if added:
+            self.stats.invalidate()
 
 async def cryptopay_webhook_handler(request):
-    application = request.app['bot_app']
     bot_logic = request.app['bot_logic']
     try:
         data = await request.json()
@@ -430,13 +770,11 @@ async def cryptopay_webhook_handler(request):
         if data.get('update_type') == 'invoice_paid':
             payload = data['payload']
             order_id = payload.get('external_id')
-            payment_info = bot_logic.db.get_payment_by_order_id(order_id)
+            settled = await bot_logic.db.settle_payment(order_id)
 
-            if payment_info and payment_info[4] == 'pending':
-                user_id, amount = payment_info[1], float(payment_info[2])
-                bot_logic.db.update_payment_status(order_id, 'success')
-                bot_logic.db.add_balance(user_id, amount)
-                await application.bot.send_message(user_id, f"✅ Баланс пополнен на **{amount:.2f} USD**.", parse_mode='Markdown')
+            if settled:
+                user_id, amount = settled
+                bot_logic.notifications.notify(user_id, f"✅ Баланс пополнен на **{amount:.2f} USD**.")
                 logging.info(f"User {user_id} balance updated for order {order_id}")
 
         return web.json_response({'status': 'ok'})
@@ -445,9 +783,29 @@ async def cryptopay_webhook_handler(request):
         return web.json_response({'status': 'error'}, status=500)
 
 
-def main():
-    bot_logic = SchedulerBot(DB_NAME)
-    application = Application.builder().token(BOT_TOKEN).build()
+async def telegram_webhook_handler(request):
+    """Принимает апдейты Telegram в режиме webhook."""
+    if not hmac.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), TELEGRAM_WEBHOOK_SECRET):
+        return web.Response(status=403)
+
+    application = request.app['bot_app']
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    # Обработка идёт в фоне, Telegram получает ответ сразу
+    await application.update_queue.put(Update.de_json(data, application.bot))
+    return web.Response()
+
+
+def build_application(bot_logic, token=BOT_TOKEN, base_url=None):
+    builder = Application.builder().token(token)
+    if base_url:
+        builder = builder.base_url(base_url)
+    # Без polling-а updater не нужен: апдейты приходят в telegram_webhook_handler
+    if bot_logic.update_mode == 'webhook':
+        builder = builder.updater(None)
+    application = builder.build()
     bot_logic.set_application(application)
 
     commands_to_register = [
@@ -458,6 +816,9 @@ def main():
         ("my_channels", bot_logic.my_channels),
         ("remove_channel", bot_logic.remove_channel),
         ("schedule_post", bot_logic.schedule_post),
+        ("import_posts", bot_logic.import_posts),
+        ("repeat_post", bot_logic.repeat_post),
+        ("my_repeats", bot_logic.my_repeats),
         ("my_posts", bot_logic.my_posts),
         ("cancel_post", bot_logic.cancel_post),
         ("balance", bot_logic.balance),
@@ -465,35 +826,97 @@ def main():
     ]
     
     for command_name, handler_func in commands_to_register:
-        application.add_handler(CommandHandler(command_name, handler_func))
-
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot_logic.handle_message))
-    application.add_handler(MessageHandler(filters.PHOTO | filters.VIDEO, bot_logic.handle_media))
-    application.add_handler(CallbackQueryHandler(bot_logic.handle_callback_query))
-
-    # Запускаем все задачи
-    async def on_startup(app):
-        # Эта функция будет вызвана при старте polling-а
-        app_web = web.Application()
-        app_web['bot_app'] = application
-        app_web['bot_logic'] = bot_logic
-        app_web.router.add_post(CRYPTOPAY_WEBHOOK_PATH, cryptopay_webhook_handler)
+        application.add_handler(CommandHandler(command_name, timed(HANDLER_DURATION, command_name)(handler_func)))
+
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, timed(HANDLER_DURATION, 'message')(bot_logic.handle_message)))
+    application.add_handler(MessageHandler(filters.PHOTO | filters.VIDEO, timed(HANDLER_DURATION, 'media')(bot_logic.handle_media)))
+    application.add_handler(MessageHandler(filters.Document.ALL, timed(HANDLER_DURATION, 'document')(bot_logic.handle_document)))
+    application.add_handler(CallbackQueryHandler(timed(HANDLER_DURATION, 'callback_query')(bot_logic.handle_callback_query)))
+    return application
+
+
+def create_web_app(application, bot_logic, webhook_base_url=WEB_SERVER_BASE_URL, cryptopay_url=CRYPTOPAY_API_URL):
+    app_web = web.Application()
+    app_web['bot_app'] = application
+    app_web['bot_logic'] = bot_logic
+    app_web['webhook_base_url'] = webhook_base_url
+    app_web['cryptopay_url'] = cryptopay_url
+    app_web.router.add_post(CRYPTOPAY_WEBHOOK_PATH, timed(WEBHOOK_DURATION, 'cryptopay')(cryptopay_webhook_handler))
+    if bot_logic.update_mode == 'webhook':
+        app_web.router.add_post(TELEGRAM_WEBHOOK_PATH, timed(WEBHOOK_DURATION, 'telegram')(telegram_webhook_handler))
+    app_web.router.add_get(METRICS_PATH, metrics_handler)
+    if bot_logic.publisher_mode != 'external':
+        register_publisher_gauges(bot_logic.scheduler)
+    app_web.on_startup.append(on_startup)
+    app_web.on_shutdown.append(on_shutdown)
+    return app_web
+
+
+async def on_startup(app_web):
+    application = app_web['bot_app']
+    bot_logic = app_web['bot_logic']
+    bot_logic.cryptopay = CryptoPayClient(base_url=app_web['cryptopay_url'])
+    bot_logic.notifications = NotificationQueue(application.bot, bot_logic.dispatcher)
+    bot_logic.notifications.start()
+
+    if bot_logic.update_mode == 'webhook':
+        webhook_url = f"{app_web['webhook_base_url'].rstrip('/')}{TELEGRAM_WEBHOOK_PATH}"
+        await application.bot.set_webhook(
+            webhook_url, secret_token=TELEGRAM_WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES
+        )
+        logging.info(f"Telegram webhook set to {webhook_url}")
+    else:
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        logging.info("Telegram polling started.")
+
+    if bot_logic.publisher_mode != 'external':
+        await bot_logic.scheduler.start(application.bot)
+
+
+async def on_shutdown(app_web):
+    application = app_web['bot_app']
+    bot_logic = app_web['bot_logic']
+
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+    await bot_logic.scheduler.stop()
+    if bot_logic.notifications:
+        await bot_logic.notifications.stop()
+    if bot_logic.cryptopay:
+        await bot_logic.cryptopay.close()
+
+
+async def run(application, bot_logic, port=WEB_SERVER_PORT, webhook_base_url=WEB_SERVER_BASE_URL,
+              cryptopay_url=CRYPTOPAY_API_URL, stop_event=None):
+    """Запускает бота и общий aiohttp-сервер (платежи и webhook Telegram) до `stop_event` или сигнала."""
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
 
-        runner = web.AppRunner(app_web)
+    runner = web.AppRunner(create_web_app(application, bot_logic, webhook_base_url, cryptopay_url))
+    async with application:
+        await application.start()
         await runner.setup()
-        site = web.TCPSite(runner, '0.0.0.0', WEB_SERVER_PORT)
+        site = web.TCPSite(runner, '0.0.0.0', port)
         await site.start()
-        logging.info(f"Payment webhook server started on port {WEB_SERVER_PORT}")
+        logging.info(f"Web server started on port {port}, update mode: {bot_logic.update_mode}")
+        try:
+            await stop_event.wait()
+        finally:
+            await runner.cleanup()
+            await application.stop()
+            await bot_logic.db.close()
 
-        # Запускаем фоновую задачу для публикации постов
-        asyncio.create_task(bot_logic.publish_scheduled_posts())
-        logging.info("Publisher task started.")
 
-    # Запускаем все задачи
-    application.run_polling(
-        allowed_updates=Update.ALL_TYPES,
-        on_startup=on_startup
-    )
+def main():
+    bot_logic = SchedulerBot(DB_NAME)
+    application = build_application(bot_logic)
+    asyncio.run(run(application, bot_logic))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,75 @@
+import heapq
+import logging
+import time
+
+from config import CATCHUP_POLICY, CATCHUP_THRESHOLD, CATCHUP_MAX_AGE, CATCHUP_WINDOW
+
+CATCHUP_POLICIES = ('none', 'drop', 'spread', 'latest')
+
+
+def plan_catchup(overdue, now, policy=CATCHUP_POLICY, max_age=CATCHUP_MAX_AGE, window=CATCHUP_WINDOW):
+    """Решает, что делать с просроченными постами: (skipped_ids, [(release_at, post_id)]).
+
+    `overdue` - строки (post_id, channel_id, publish_time). Посты разбираются
+    из кучи по убыванию опоздания, то есть в исходном порядке публикации.
+    Посты, не попавшие ни в один список, публикуются сразу.
+    """
+    heap = [(publish_time - now, post_id, channel_id, publish_time) for post_id, channel_id, publish_time in overdue]
+    heapq.heapify(heap)
+    latest = {}
+    if policy == 'latest':
+        for post_id, channel_id, publish_time in overdue:
+            latest[channel_id] = max(latest.get(channel_id, (publish_time, post_id)), (publish_time, post_id))
+
+    skipped, kept = [], []
+    while heap:
+        negative_lateness, post_id, channel_id, publish_time = heapq.heappop(heap)
+        if policy == 'drop' and -negative_lateness > max_age:
+            skipped.append(post_id)
+        elif policy == 'latest' and latest[channel_id] != (publish_time, post_id):
+            skipped.append(post_id)
+        else:
+            kept.append(post_id)
+
+    deferred = []
+    if policy == 'spread' and kept:
+        # Восстановление займёт не больше `window` секунд при любом объёме простоя
+        step = window / len(kept)
+        deferred = [(now + index * step, post_id) for index, post_id in enumerate(kept)]
+    return skipped, deferred
+
+
+class CatchupPolicy:
+    """Этап догоняющей публикации перед запуском очереди.
+
+    Просроченными считаются посты, опоздавшие больше чем на `threshold`
+    секунд: так после рестарта или простоя в каналы не уходит пачка
+    устаревших постов подряд и бот не упирается в flood-лимиты.
+    """
+
+    def __init__(self, db, policy=CATCHUP_POLICY, threshold=CATCHUP_THRESHOLD,
+                 max_age=CATCHUP_MAX_AGE, window=CATCHUP_WINDOW):
+        if policy not in CATCHUP_POLICIES:
+            raise ValueError(f"Unknown catch-up policy {policy!r}, expected one of {CATCHUP_POLICIES}")
+        self.db = db
+        self.policy = policy
+        self.threshold = threshold
+        self.max_age = max_age
+        self.window = window
+
+    async def apply(self, now=None):
+        """Возвращает (skipped_ids, deferred) применённого плана."""
+        if self.policy == 'none':
+            return [], []
+        now = time.time() if now is None else now
+        overdue = await self.db.get_overdue_posts(int(now - self.threshold))
+        if not overdue:
+            return [], []
+
+        skipped, deferred = plan_catchup(overdue, now, self.policy, self.max_age, self.window)
+        await self.db.apply_catchup(skipped, deferred)
+        logging.warning(
+            f"Catch-up ({self.policy}): {len(overdue)} overdue posts, {len(skipped)} skipped, "
+            f"{len(deferred)} spread over {self.window}s"
+        )
+        return skipped, deferred
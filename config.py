@@ -1,4 +1,5 @@
 import os
+import secrets
 import pytz
 from dotenv import load_dotenv
 
@@ -12,11 +13,111 @@ MOSCOW_TZ = pytz.timezone('Europe/Moscow')
 # --- Настройки базы данных ---
 DB_NAME = "scheduler.db"
 
+# --- Состояние диалогов ---
+# 'sqlite' - переживает перезапуск и общее для реплик, 'memory' - только в процессе
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite')
+STATE_TTL = int(os.getenv('STATE_TTL', 6 * 3600))
+STATE_MAX_ENTRIES = int(os.getenv('STATE_MAX_ENTRIES', 10000))
+
+# --- Интерфейс ---
+# Постов на странице /my_posts (сообщение не должно превышать 4096 символов)
+MY_POSTS_PAGE_SIZE = int(os.getenv('MY_POSTS_PAGE_SIZE', 10))
+
+# Сколько секунд /status отдаёт счётчики из кэша
+STATUS_CACHE_TTL = float(os.getenv('STATUS_CACHE_TTL', 10))
+
+# Лимиты тарифа: кэш на пользователя и бесплатные лимиты (после истечения тарифа)
+QUOTA_CACHE_TTL = float(os.getenv('QUOTA_CACHE_TTL', 60))
+QUOTA_CACHE_SIZE = int(os.getenv('QUOTA_CACHE_SIZE', 10000))
+FREE_MAX_CHANNELS = int(os.getenv('FREE_MAX_CHANNELS', 1))
+FREE_MAX_POSTS_PER_DAY = int(os.getenv('FREE_MAX_POSTS_PER_DAY', 2))
+
+# Импорт постов файлом: Bot API отдаёт ботам файлы не больше 20 МБ
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+MAX_IMPORT_ROWS = int(os.getenv('MAX_IMPORT_ROWS', 10000))
+# Сколько ошибок строк показывать в ответе (сообщение ограничено 4096 символами)
+IMPORT_ERRORS_SHOWN = 20
+
 # --- Настройки WebHook на Railway ---
 WEB_SERVER_PORT = int(os.environ.get('PORT', 8080))
 WEB_SERVER_BASE_URL = os.getenv('RAILWAY_STATIC_URL', "https://mimikcopiraitingbot-v1-production.up.railway.app")
 
+# --- Получение апдейтов Telegram ---
+# 'polling' - long polling, 'webhook' - апдейты приходят на общий aiohttp-сервер
+TELEGRAM_UPDATE_MODE = os.getenv('TELEGRAM_UPDATE_MODE', 'polling')
+TELEGRAM_WEBHOOK_PATH = '/telegram/webhook'
+# Секрет сверяется с заголовком X-Telegram-Bot-Api-Secret-Token; без настройки генерируется при старте
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
 # --- Настройки CryptoPay Bot ---
 CRYPTOPAY_BOT_TOKEN = os.getenv('CRYPTOPAY_BOT_TOKEN')
-CRYPTOPAY_CREATE_INVOICE_URL = "https://pay.crypt.bot/api/createInvoice"
+CRYPTOPAY_API_URL = os.getenv('CRYPTOPAY_API_URL', "https://pay.crypt.bot/api")
+CRYPTOPAY_CREATE_INVOICE_URL = f"{CRYPTOPAY_API_URL}/createInvoice"
 CRYPTOPAY_WEBHOOK_PATH = '/payment/cryptopay'
+# Таймауты (секунды), размер пула соединений и circuit breaker клиента CryptoPay
+CRYPTOPAY_CONNECT_TIMEOUT = float(os.getenv('CRYPTOPAY_CONNECT_TIMEOUT', 5))
+CRYPTOPAY_READ_TIMEOUT = float(os.getenv('CRYPTOPAY_READ_TIMEOUT', 10))
+CRYPTOPAY_MAX_CONNECTIONS = int(os.getenv('CRYPTOPAY_MAX_CONNECTIONS', 10))
+CRYPTOPAY_BREAKER_THRESHOLD = int(os.getenv('CRYPTOPAY_BREAKER_THRESHOLD', 5))
+CRYPTOPAY_BREAKER_RESET = float(os.getenv('CRYPTOPAY_BREAKER_RESET', 30))
+
+# --- Метрики ---
+METRICS_PATH = '/metrics'
+# Если задан, /metrics требует заголовок Authorization: Bearer <токен>
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# --- Догоняющая публикация после простоя ---
+# Пост считается просроченным, если опоздал больше чем на CATCHUP_THRESHOLD секунд.
+# 'spread' - в исходном порядке, равномерно за CATCHUP_WINDOW секунд;
+# 'drop' - пропустить опоздавшие больше чем на CATCHUP_MAX_AGE, остальные сразу;
+# 'latest' - только самый свежий просроченный пост в каждом канале;
+# 'none' - всё сразу, как есть
+CATCHUP_POLICY = os.getenv('CATCHUP_POLICY', 'spread')
+CATCHUP_THRESHOLD = int(os.getenv('CATCHUP_THRESHOLD', 300))
+CATCHUP_MAX_AGE = int(os.getenv('CATCHUP_MAX_AGE', 3600))
+CATCHUP_WINDOW = int(os.getenv('CATCHUP_WINDOW', 600))
+
+# --- Воркер публикации ---
+# 'inprocess' - публикация в процессе бота, 'external' - отдельным процессом: python scheduler.py
+PUBLISHER_MODE = os.getenv('PUBLISHER_MODE', 'inprocess')
+# UDP-адрес, на котором отдельный воркер принимает уведомления о новых постах ('' - выключено).
+# Слушать его может только один воркер на хосте; следующие воркеры пишут предупреждение,
+# работают без уведомлений и подхватывают новые посты сверкой (PUBLISH_RECONCILE_INTERVAL)
+PUBLISHER_NOTIFY_ADDR = os.getenv('PUBLISHER_NOTIFY_ADDR', '127.0.0.1:8765')
+# Порт /metrics отдельного воркера (0 - не запускать)
+PUBLISHER_METRICS_PORT = int(os.getenv('PUBLISHER_METRICS_PORT', 0))
+
+# --- Архив постов ---
+# Завершённые посты старше ARCHIVE_AFTER_DAYS дней переносятся в posts_archive (0 - не архивировать)
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 30))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 1000))
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', 3600))
+# Сколько свободных страниц возвращать ОС за проход (0 - все)
+ARCHIVE_VACUUM_PAGES = int(os.getenv('ARCHIVE_VACUUM_PAGES', 0))
+
+# --- Настройки публикации ---
+# Раз в столько секунд очередь публикаций сверяется с БД
+PUBLISH_RECONCILE_INTERVAL = int(os.getenv('PUBLISH_RECONCILE_INTERVAL', 300))
+# Аренда поста воркером: должна превышать худшее время ожидания лимитов при отправке
+PUBLISH_LEASE_SECONDS = int(os.getenv('PUBLISH_LEASE_SECONDS', 600))
+PUBLISH_CLAIM_BATCH = int(os.getenv('PUBLISH_CLAIM_BATCH', 100))
+# Ограничения Bot API: ~30 сообщений в секунду всего и ~20 в минуту в один канал
+PUBLISH_CONCURRENCY = int(os.getenv('PUBLISH_CONCURRENCY', 10))
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+TELEGRAM_CHAT_RATE_PER_MINUTE = float(os.getenv('TELEGRAM_CHAT_RATE_PER_MINUTE', 20))
+# Повторные попытки публикации: экспоненциальный backoff, затем статус 'failed'
+PUBLISH_MAX_ATTEMPTS = int(os.getenv('PUBLISH_MAX_ATTEMPTS', 8))
+PUBLISH_RETRY_BASE_DELAY = float(os.getenv('PUBLISH_RETRY_BASE_DELAY', 30))
+PUBLISH_RETRY_MAX_DELAY = float(os.getenv('PUBLISH_RETRY_MAX_DELAY', 3600))
+# Результаты публикаций сохраняются пачками: по размеру или по таймеру (секунды)
+PUBLISH_FLUSH_SIZE = int(os.getenv('PUBLISH_FLUSH_SIZE', 50))
+PUBLISH_FLUSH_INTERVAL = float(os.getenv('PUBLISH_FLUSH_INTERVAL', 1.0))
+# Альбомы: до 10 медиа в посте (лимит send_media_group), окно сбора альбома в секундах
+MAX_MEDIA_PER_POST = 10
+MEDIA_GROUP_WINDOW = float(os.getenv('MEDIA_GROUP_WINDOW', 1.5))
+# Повторяющиеся посты: вхождения создаются в posts за столько секунд до публикации
+# (больше интервала сверки, чтобы сверка успевала их подхватить)
+RECURRING_LOOKAHEAD = int(os.getenv('RECURRING_LOOKAHEAD', 2 * PUBLISH_RECONCILE_INTERVAL))
+# Вхождения, пропущенные дольше этого (бот был выключен), не публикуются
+RECURRING_MISSED_GRACE = int(os.getenv('RECURRING_MISSED_GRACE', 3600))
+RECURRING_MIN_INTERVAL = int(os.getenv('RECURRING_MIN_INTERVAL', 300))
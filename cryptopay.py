@@ -0,0 +1,125 @@
+import importlib.util
+import logging
+import time
+
+import httpx
+
+from config import (
+    CRYPTOPAY_BOT_TOKEN, CRYPTOPAY_API_URL,
+    CRYPTOPAY_CONNECT_TIMEOUT, CRYPTOPAY_READ_TIMEOUT, CRYPTOPAY_MAX_CONNECTIONS,
+    CRYPTOPAY_BREAKER_THRESHOLD, CRYPTOPAY_BREAKER_RESET
+)
+
+# HTTP/2 включается, только если установлен пакет h2 (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+
+class CryptoPayError(Exception):
+    pass
+
+
+class CircuitOpenError(CryptoPayError):
+    pass
+
+
+class CircuitBreaker:
+    """После `failure_threshold` сбоев подряд перестаёт пропускать запросы на `reset_timeout` секунд.
+
+    Затем пропускает один пробный запрос (half-open): пока он не завершился,
+    остальные запросы отклоняются; успех закрывает цепь, сбой снова
+    размыкает её. Пробный запрос, не сообщивший результат (например,
+    отменённый), перестаёт блокировать цепь через `reset_timeout` секунд.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        state = self.state
+        if state != 'half-open':
+            return state == 'closed'
+        now = time.monotonic()
+        if self.trial_started_at is not None and now - self.trial_started_at < self.reset_timeout:
+            return False
+        self.trial_started_at = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_started_at = None
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class CryptoPayClient:
+    """Долгоживущий клиент CryptoPay API с пулом keep-alive соединений.
+
+    Создаётся при старте приложения и закрывается при остановке, поэтому
+    счета не платят за новое TCP/TLS-соединение.
+    """
+
+    def __init__(self, token=CRYPTOPAY_BOT_TOKEN, base_url=CRYPTOPAY_API_URL):
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={'Crypto-Pay-API-Token': token or ''},
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(CRYPTOPAY_READ_TIMEOUT, connect=CRYPTOPAY_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=CRYPTOPAY_MAX_CONNECTIONS,
+                max_keepalive_connections=CRYPTOPAY_MAX_CONNECTIONS,
+            ),
+        )
+        self.breaker = CircuitBreaker(CRYPTOPAY_BREAKER_THRESHOLD, CRYPTOPAY_BREAKER_RESET)
+
+    async def _call(self, method, payload):
+        if not self.breaker.allow():
+            raise CircuitOpenError("CryptoPay API temporarily disabled after repeated failures")
+        try:
+            response = await self._client.post(f'/{method}', json=payload)
+        except httpx.HTTPError as e:
+            self.breaker.record_failure()
+            raise CryptoPayError(f"CryptoPay {method} request failed: {e!r}") from e
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+            raise CryptoPayError(f"CryptoPay {method} returned HTTP {response.status_code}")
+        try:
+            data = response.json()
+        except ValueError as e:
+            # Не JSON (например, страница ошибки прокси) - API недоступно так же, как при 5xx
+            self.breaker.record_failure()
+            raise CryptoPayError(f"CryptoPay {method} returned invalid JSON (HTTP {response.status_code})") from e
+        self.breaker.record_success()
+
+        if not response.is_success or not isinstance(data, dict) or not data.get('ok'):
+            raise CryptoPayError(f"CryptoPay {method} error: {data}")
+        return data['result']
+
+    async def create_invoice(self, amount, description, external_id, asset='USDT'):
+        return await self._call('createInvoice', {
+            'asset': asset,
+            'amount': amount,
+            'description': description,
+            'external_id': external_id,
+        })
+
+    async def close(self):
+        await self._client.aclose()
+        logging.info("CryptoPay client closed.")
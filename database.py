@@ -1,17 +1,268 @@
 import sqlite3
 import logging
 import datetime
-import pytz
+import json
+import threading
+import time
+from config import DB_NAME, MOSCOW_TZ
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Настройки соединения SQLite
+SQLITE_CACHE_SIZE_KIB = 16384           # PRAGMA cache_size (в KiB, отрицательное значение в PRAGMA)
+SQLITE_MMAP_SIZE = 64 * 1024 * 1024     # PRAGMA mmap_size (в байтах)
+SQLITE_BUSY_TIMEOUT = 5.0               # секунды ожидания блокировки
+SQLITE_CACHED_STATEMENTS = 256          # размер кэша подготовленных выражений
+
+
+class QuotaExceededError(Exception):
+    def __init__(self, day, limit):
+        super().__init__(f"Daily post limit {limit} exceeded for {day}")
+        self.day = day
+        self.limit = limit
+
+
+def post_day(publish_time):
+    """День публикации по МСК ('ГГГГ-ММ-ДД') - ключ дневного счётчика постов."""
+    return datetime.datetime.fromtimestamp(publish_time, MOSCOW_TZ).strftime('%Y-%m-%d')
+
+
+def legacy_publish_time_to_epoch(value):
+    """Переводит старое текстовое publish_time в UTC epoch (секунды).
+
+    bot.py писал ISO-строки с часовым поясом (UTC), scheduler.py - строки
+    'ГГГГ-ММ-ДД ЧЧ:ММ:СС' по московскому времени без пояса.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    dt = datetime.datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = MOSCOW_TZ.localize(dt)
+    return int(dt.timestamp())
+
+
+def _migrate_publish_time_to_epoch(conn):
+    # Тип столбца в SQLite не меняется через ALTER, поэтому таблица пересоздаётся
+    conn.create_function('legacy_publish_time_to_epoch', 1, legacy_publish_time_to_epoch)
+    conn.execute('''
+        CREATE TABLE posts_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            text TEXT,
+            media_ids TEXT,
+            publish_time INTEGER NOT NULL,
+            is_published INTEGER DEFAULT 0,
+            message_id INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            status TEXT NOT NULL DEFAULT 'pending',
+            lease_owner TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL,
+            last_error TEXT
+        )
+    ''')
+    columns = (
+        'id, user_id, channel_id, text, media_ids, {publish_time}, is_published, message_id, created_at, '
+        'status, lease_owner, lease_expires, attempts, next_attempt_at, last_error'
+    )
+    conn.execute(
+        f"INSERT INTO posts_new ({columns.format(publish_time='publish_time')}) "
+        f"SELECT {columns.format(publish_time='legacy_publish_time_to_epoch(publish_time)')} FROM posts"
+    )
+    conn.execute('DROP TABLE posts')
+    conn.execute('ALTER TABLE posts_new RENAME TO posts')
+    conn.execute('CREATE INDEX idx_posts_user_publish_time ON posts (user_id, publish_time)')
+    conn.execute("CREATE INDEX idx_posts_due ON posts (publish_time) WHERE status IN ('pending', 'publishing')")
+
+
+def _create_post_counters(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS post_counters (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.create_function('post_day', 1, post_day)
+    conn.execute(
+        'INSERT INTO post_counters (user_id, day, count) '
+        'SELECT user_id, post_day(publish_time), COUNT(*) FROM posts GROUP BY 1, 2'
+    )
+
+
+# Версионированные миграции схемы. Миграция с индексом i переводит базу
+# на PRAGMA user_version = i + 1; уже применённые миграции пропускаются.
+# Миграция - это кортеж SQL-выражений или функция, принимающая соединение.
+MIGRATIONS = [
+    # 1: индексы под горячие запросы
+    (
+        # get_posts_to_publish: только неопубликованные посты
+        'CREATE INDEX IF NOT EXISTS idx_posts_pending_publish_time ON posts (publish_time) WHERE is_published = 0',
+        # get_user_posts: WHERE user_id = ? ORDER BY publish_time
+        'CREATE INDEX IF NOT EXISTS idx_posts_user_publish_time ON posts (user_id, publish_time)',
+        # get_user_channels: покрывающий индекс, таблица не читается
+        'CREATE INDEX IF NOT EXISTS idx_channels_user ON channels (user_id, channel_id, channel_name)',
+        # get_channel_info и JOIN channels c ON p.channel_id = c.channel_id
+        'CREATE INDEX IF NOT EXISTS idx_channels_channel ON channels (channel_id)',
+        'CREATE INDEX IF NOT EXISTS idx_payments_user ON payments (user_id)',
+    ),
+    # 2: статус и аренда (lease) постов для нескольких воркеров-публикаторов
+    (
+        "ALTER TABLE posts ADD COLUMN status TEXT NOT NULL DEFAULT 'pending'",
+        'ALTER TABLE posts ADD COLUMN lease_owner TEXT',
+        'ALTER TABLE posts ADD COLUMN lease_expires REAL',
+        "UPDATE posts SET status = 'published' WHERE is_published = 1",
+    ),
+    # 3: повторные попытки с backoff; посты в статусе 'failed' больше не сканируются
+    (
+        'ALTER TABLE posts ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE posts ADD COLUMN next_attempt_at REAL',
+        'ALTER TABLE posts ADD COLUMN last_error TEXT',
+        'DROP INDEX IF EXISTS idx_posts_pending_publish_time',
+        "CREATE INDEX IF NOT EXISTS idx_posts_due ON posts (publish_time) WHERE status IN ('pending', 'publishing')",
+    ),
+    # 4: состояние диалогов (state_store.SQLiteStateStore)
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            namespace TEXT NOT NULL,
+            key INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_conversation_state_updated ON conversation_state (namespace, updated_at)',
+    ),
+    # 5: posts.publish_time - INTEGER UTC epoch вместо строк разных форматов
+    _migrate_publish_time_to_epoch,
+    # 6: шаблоны повторяющихся постов; в posts попадает только ближайшее вхождение
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS recurring_posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            text TEXT,
+            media_ids TEXT,
+            cron TEXT,
+            interval_seconds INTEGER,
+            next_run INTEGER NOT NULL,
+            end_time INTEGER,
+            active INTEGER NOT NULL DEFAULT 1,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_recurring_posts_next_run ON recurring_posts (next_run) WHERE active = 1',
+        'CREATE INDEX IF NOT EXISTS idx_recurring_posts_user ON recurring_posts (user_id)',
+        'ALTER TABLE posts ADD COLUMN recurring_id INTEGER',
+        'CREATE INDEX IF NOT EXISTS idx_posts_recurring ON posts (recurring_id) WHERE recurring_id IS NOT NULL',
+    ),
+    # 7: пост в несколько каналов - один post_contents, по строке posts на канал
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS post_contents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            text TEXT,
+            media_ids TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'ALTER TABLE posts ADD COLUMN content_id INTEGER REFERENCES post_contents (id)',
+        'CREATE INDEX IF NOT EXISTS idx_posts_content ON posts (content_id) WHERE content_id IS NOT NULL',
+    ),
+    # 8: дневные счётчики постов по пользователю (по дню публикации, МСК)
+    _create_post_counters,
+    # 9: архив завершённых постов; в posts остаются ожидающие и недавние
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS posts_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            channel_id INTEGER NOT NULL,
+            text TEXT,
+            media_ids TEXT,
+            publish_time INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            message_id INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            recurring_id INTEGER,
+            created_at DATETIME,
+            archived_at INTEGER NOT NULL
+        )
+        ''',
+        # archive_posts: кандидаты в архив по времени публикации
+        "CREATE INDEX IF NOT EXISTS idx_posts_finished ON posts (publish_time) WHERE status IN ('published', 'failed', 'skipped')",
+        # get_user_pending_posts (/cancel_post)
+        "CREATE INDEX IF NOT EXISTS idx_posts_user_pending ON posts (user_id, publish_time) WHERE status = 'pending'",
+    ),
+]
+
+# Завершённые статусы: такие посты больше не меняются и уходят в архив
+FINISHED_STATUSES = ('published', 'failed', 'skipped')
+
+# Текст и медиа поста: свои у одиночного поста, общие из post_contents у рассылки
+POST_TEXT_SQL = 'COALESCE(text, (SELECT text FROM post_contents WHERE post_contents.id = posts.content_id))'
+POST_MEDIA_SQL = 'COALESCE(media_ids, (SELECT media_ids FROM post_contents WHERE post_contents.id = posts.content_id))'
+
+
 class Database:
     def __init__(self, db_name):
         self.db_name = db_name
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
         self.init_db()
 
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_name,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            timeout=SQLITE_BUSY_TIMEOUT,
+            cached_statements=SQLITE_CACHED_STATEMENTS,
+            check_same_thread=False,
+        )
+        # Действует только на новый файл (до первой таблицы); существующую базу
+        # переводит enable_incremental_vacuum(). На непустой базе прагма берёт
+        # блокировку записи, поэтому выполняется только для пустого файла
+        if conn.execute('PRAGMA page_count').fetchone()[0] == 0:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KIB}')
+        conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
     def get_connection(self):
-        return sqlite3.connect(self.db_name, detect_types=sqlite3.PARSE_DECLTYPES)
+        """Возвращает долгоживущее соединение текущего потока.
+
+        Соединение открывается один раз на поток и переиспользуется всеми
+        методами; `with conn:` управляет только транзакцией, а не закрытием.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                logging.exception("Error closing database connection")
+        self._local = threading.local()
 
     def init_db(self):
         with self.get_connection() as conn:
@@ -62,6 +313,49 @@ class Database:
                 )
             ''')
             conn.commit()
+        self.apply_migrations()
+        if self.get_connection().execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            logging.warning(
+                f"{self.db_name} does not use incremental auto_vacuum; archived posts will not free disk space "
+                f"until 'python database.py' is run with the bot stopped."
+            )
+
+    def enable_incremental_vacuum(self):
+        """Переводит существующую базу в auto_vacuum = INCREMENTAL - разовое обслуживание.
+
+        Новые базы создаются в этом режиме сразу (см. _connect). Для старой
+        режим применяется только полным VACUUM: он переписывает весь файл и
+        держит блокировку записи, поэтому запускается отдельно при
+        остановленном боте: python database.py. Возвращает True, если база
+        была переведена.
+        """
+        conn = self.get_connection()
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return False
+        logging.warning(f"Running VACUUM on {self.db_name} to enable incremental auto_vacuum...")
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        return True
+
+    def apply_migrations(self):
+        conn = self.get_connection()
+        # BEGIN IMMEDIATE: несколько процессов не применят одну миграцию дважды
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for target in range(version + 1, len(MIGRATIONS) + 1):
+                migration = MIGRATIONS[target - 1]
+                if callable(migration):
+                    migration(conn)
+                else:
+                    for statement in migration:
+                        conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {target}')
+                logging.info(f"Database migrated to version {target}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
 
     def add_user(self, user_id, username):
         with self.get_connection() as conn:
@@ -101,13 +395,109 @@ class Database:
         with self.get_connection() as conn:
             return conn.execute('SELECT * FROM channels WHERE channel_id = ?', (channel_id,)).fetchone()
 
-    def add_post(self, user_id, channel_id, text, media_ids, publish_time):
+    def add_post(self, user_id, channel_id, text, media_ids, publish_time, daily_limit=None):
+        """Добавляет пост; `publish_time` - UTC epoch в секундах.
+
+        С `daily_limit` бросает QuotaExceededError, если пост не укладывается в дневной лимит.
+        """
         with self.get_connection() as conn:
-            conn.execute(
+            cursor = conn.execute(
                 'INSERT INTO posts (user_id, channel_id, text, media_ids, publish_time) VALUES (?, ?, ?, ?, ?)',
                 (user_id, channel_id, text, media_ids, publish_time)
             )
+            self._count_posts(conn, [(user_id, publish_time)], daily_limit)
             conn.commit()
+            return cursor.lastrowid
+
+    def _count_posts(self, conn, posts, daily_limit=None):
+        """Прибавляет посты (user_id, publish_time) к дневным счётчикам внутри текущей транзакции.
+
+        При превышении `daily_limit` бросает QuotaExceededError - вызывающий откатывает транзакцию.
+        """
+        counts = {}
+        for user_id, publish_time in posts:
+            key = (user_id, post_day(publish_time))
+            counts[key] = counts.get(key, 0) + 1
+        for (user_id, day), count in counts.items():
+            total = conn.execute(
+                '''
+                INSERT INTO post_counters (user_id, day, count) VALUES (?, ?, ?)
+                ON CONFLICT (user_id, day) DO UPDATE SET count = count + excluded.count
+                RETURNING count
+                ''',
+                (user_id, day, count)
+            ).fetchone()[0]
+            if daily_limit is not None and total > daily_limit:
+                raise QuotaExceededError(day, daily_limit)
+
+    def get_post_count(self, user_id, day):
+        with self.get_connection() as conn:
+            row = conn.execute('SELECT count FROM post_counters WHERE user_id = ? AND day = ?', (user_id, day)).fetchone()
+            return row[0] if row else 0
+
+    def get_user_limits(self, user_id):
+        """(tariff_id, tariff_expires, max_channels, max_posts_per_day, число каналов) или None."""
+        with self.get_connection() as conn:
+            return conn.execute(
+                '''
+                SELECT tariff_id, tariff_expires, max_channels, max_posts_per_day,
+                       (SELECT COUNT(*) FROM channels WHERE user_id = users.id)
+                FROM users WHERE id = ?
+                ''',
+                (user_id,)
+            ).fetchone()
+
+    def add_posts(self, posts, daily_limit=None):
+        """Добавляет пачку постов одной транзакцией.
+
+        `posts` - кортежи (user_id, channel_id, text, media_ids, publish_time).
+        Возвращает [(id, publish_time)] добавленных постов.
+        """
+        conn = self.get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            added = self._insert_posts(conn, posts)
+            self._count_posts(conn, [(post[0], post[4]) for post in posts], daily_limit)
+            conn.commit()
+            return added
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _insert_posts(self, conn, posts, recurring_id=None):
+        # Вызывается внутри BEGIN IMMEDIATE: пока держим блокировку записи, новые id идут после last_id
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM posts').fetchone()[0]
+        conn.executemany(
+            'INSERT INTO posts (user_id, channel_id, text, media_ids, publish_time, recurring_id) VALUES (?, ?, ?, ?, ?, ?)',
+            [(*post, recurring_id) for post in posts]
+        )
+        return conn.execute('SELECT id, publish_time FROM posts WHERE id > ? ORDER BY id', (last_id,)).fetchall()
+
+    def add_fanout_post(self, user_id, channel_ids, text, media_ids, publish_time, daily_limit=None):
+        """Один пост в несколько каналов: строка post_contents и по строке posts на канал.
+
+        У каждого канала свой статус и свои повторы, поэтому сбой в одном
+        канале не мешает остальным. Возвращает [(id, publish_time)].
+        """
+        conn = self.get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            content_id = conn.execute(
+                'INSERT INTO post_contents (user_id, text, media_ids) VALUES (?, ?, ?)',
+                (user_id, text, media_ids)
+            ).lastrowid
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM posts').fetchone()[0]
+            conn.executemany(
+                'INSERT INTO posts (user_id, channel_id, publish_time, content_id) VALUES (?, ?, ?, ?)',
+                [(user_id, channel_id, publish_time, content_id) for channel_id in channel_ids]
+            )
+            added = conn.execute('SELECT id, publish_time FROM posts WHERE id > ? ORDER BY id', (last_id,)).fetchall()
+            self._count_posts(conn, [(user_id, publish_time)] * len(channel_ids), daily_limit)
+            conn.commit()
+            return added
+        except Exception:
+            conn.rollback()
+            raise
 
     def get_user_posts(self, user_id):
         with self.get_connection() as conn:
@@ -116,14 +506,175 @@ class Database:
                 (user_id,)
             ).fetchall()
 
+    def get_user_pending_posts(self, user_id):
+        with self.get_connection() as conn:
+            return conn.execute(
+                "SELECT id, channel_id, publish_time FROM posts WHERE user_id = ? AND status = 'pending' ORDER BY publish_time",
+                (user_id,)
+            ).fetchall()
+
+    def get_user_posts_page(self, user_id, limit, before=None, after=None):
+        """Страница постов пользователя с именами каналов, от новых к старым.
+
+        Keyset-пагинация по (publish_time, id): `before` - курсор последнего
+        поста текущей страницы (следующая страница), `after` - курсор первого
+        (предыдущая). Возвращает (rows, has_more), где has_more - есть ли ещё
+        посты в запрошенном направлении.
+        Строка: (id, channel_id, channel_name, text, publish_time, status).
+        """
+        query = '''
+            SELECT p.id, p.channel_id, c.channel_name, COALESCE(p.text, pc.text), p.publish_time, p.status
+            FROM posts p
+            LEFT JOIN channels c ON c.user_id = p.user_id AND c.channel_id = p.channel_id
+            LEFT JOIN post_contents pc ON pc.id = p.content_id
+            WHERE p.user_id = ?
+        '''
+        params = [user_id]
+        if after is not None:
+            query += ' AND (p.publish_time, p.id) > (?, ?) ORDER BY p.publish_time ASC, p.id ASC LIMIT ?'
+            params += [after[0], after[1], limit + 1]
+        else:
+            if before is not None:
+                query += ' AND (p.publish_time, p.id) < (?, ?)'
+                params += [before[0], before[1]]
+            query += ' ORDER BY p.publish_time DESC, p.id DESC LIMIT ?'
+            params.append(limit + 1)
+
+        with self.get_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if after is not None:
+            rows.reverse()
+        return rows, has_more
+
     def get_posts_to_publish(self):
-        now_utc_str = datetime.datetime.now(pytz.utc).isoformat()
+        now_ts = int(time.time())
         with self.get_connection() as conn:
             return conn.execute(
-                'SELECT id, user_id, channel_id, text, media_ids FROM posts WHERE publish_time <= ? AND is_published = 0',
-                (now_utc_str,)
+                f"SELECT id, user_id, channel_id, {POST_TEXT_SQL}, {POST_MEDIA_SQL} FROM posts "
+                "WHERE status IN ('pending', 'publishing') AND publish_time <= ?",
+                (now_ts,)
             ).fetchall()
             
+    def get_pending_post_times(self):
+        with self.get_connection() as conn:
+            return conn.execute(
+                "SELECT id, publish_time, next_attempt_at FROM posts WHERE status IN ('pending', 'publishing')"
+            ).fetchall()
+
+    def claim_due_posts(self, owner, lease_seconds, limit, per_chat_limit=None):
+        """Атомарно забирает до `limit` наступивших постов в работу воркеру `owner`.
+
+        Пост переводится в статус 'publishing' с арендой до now + lease_seconds.
+        Посты с истёкшей арендой (упавший воркер) забираются повторно, поэтому
+        несколько процессов могут делить одну базу без двойных публикаций.
+
+        `per_chat_limit` ограничивает число постов одного канала под активной
+        арендой у всех воркеров вместе: больше, чем канал успеет отправить за
+        время аренды, брать нельзя - аренда истечёт до отправки.
+        """
+        now_ts = time.time()
+        with self.get_connection() as conn:
+            return conn.execute(
+                f'''
+                UPDATE posts SET status = 'publishing', lease_owner = ?, lease_expires = ?
+                WHERE id IN (
+                    SELECT id FROM (
+                        SELECT p.id, p.publish_time,
+                               ROW_NUMBER() OVER (PARTITION BY p.channel_id ORDER BY p.publish_time, p.id)
+                               + COALESCE(held.leased, 0) AS slot
+                        FROM posts p
+                        LEFT JOIN (
+                            SELECT channel_id, COUNT(*) AS leased FROM posts
+                            WHERE status IN ('pending', 'publishing') AND publish_time <= ?
+                              AND status = 'publishing' AND lease_expires >= ?
+                            GROUP BY channel_id
+                        ) held ON held.channel_id = p.channel_id
+                        WHERE p.status IN ('pending', 'publishing') AND p.publish_time <= ?
+                          AND (p.status = 'pending' OR p.lease_expires < ?)
+                          AND (p.next_attempt_at IS NULL OR p.next_attempt_at <= ?)
+                    )
+                    WHERE ? IS NULL OR slot <= ?
+                    ORDER BY publish_time, id
+                    LIMIT ?
+                )
+                RETURNING id, user_id, channel_id, {POST_TEXT_SQL}, {POST_MEDIA_SQL}, attempts, publish_time
+                ''',
+                (owner, now_ts + lease_seconds, int(now_ts), now_ts, int(now_ts), now_ts, now_ts,
+                 per_chat_limit, per_chat_limit, limit)
+            ).fetchall()
+
+    def renew_leases(self, owner, post_ids, lease_seconds):
+        """Продлевает аренду постов воркера `owner`, ещё ждущих отправки (heartbeat)."""
+        with self.get_connection() as conn:
+            conn.execute(
+                "UPDATE posts SET lease_expires = ? "
+                "WHERE id IN (SELECT value FROM json_each(?)) AND status = 'publishing' AND lease_owner = ?",
+                (time.time() + lease_seconds, json.dumps(list(post_ids)), owner)
+            )
+            conn.commit()
+
+    def release_leases(self, owner, post_ids):
+        """Возвращает неотправленные посты воркера `owner` в 'pending' (при остановке воркера)."""
+        with self.get_connection() as conn:
+            conn.execute(
+                "UPDATE posts SET status = 'pending', lease_owner = NULL, lease_expires = NULL "
+                "WHERE id IN (SELECT value FROM json_each(?)) AND status = 'publishing' AND lease_owner = ?",
+                (json.dumps(list(post_ids)), owner)
+            )
+            conn.commit()
+
+    def record_publish_failure(self, post_id, owner, error, next_attempt_at):
+        """Фиксирует неудачную попытку публикации.
+
+        Если `next_attempt_at` (UTC epoch) задан, пост вернётся в очередь не
+        раньше этого времени, иначе переходит в статус 'failed' навсегда.
+        """
+        with self.get_connection() as conn:
+            conn.execute(
+                '''
+                UPDATE posts SET
+                    attempts = attempts + 1, last_error = ?, next_attempt_at = ?,
+                    status = CASE WHEN ? IS NULL THEN 'failed' ELSE 'pending' END,
+                    lease_owner = NULL, lease_expires = NULL
+                WHERE id = ? AND status = 'publishing' AND lease_owner = ?
+                ''',
+                (error, next_attempt_at, next_attempt_at, post_id, owner)
+            )
+            conn.commit()
+
+    def get_overdue_posts(self, before):
+        """Ожидающие посты с publish_time раньше `before`, ещё ни разу не отложенные.
+
+        Посты в повторах (next_attempt_at задан) опоздали из-за backoff, а не простоя.
+        Строка: (id, channel_id, publish_time).
+        """
+        with self.get_connection() as conn:
+            return conn.execute(
+                "SELECT id, channel_id, publish_time FROM posts "
+                "WHERE status = 'pending' AND publish_time < ? AND next_attempt_at IS NULL",
+                (before,)
+            ).fetchall()
+
+    def apply_catchup(self, skipped, deferred):
+        """Пропускает просроченные посты `skipped` и откладывает `deferred` - пары (release_at, post_id).
+
+        Условие next_attempt_at IS NULL не даёт двум воркерам переписать план друг друга.
+        """
+        with self.get_connection() as conn:
+            conn.executemany(
+                "UPDATE posts SET status = 'skipped', last_error = 'overdue' "
+                "WHERE id = ? AND status = 'pending' AND next_attempt_at IS NULL",
+                [(post_id,) for post_id in skipped]
+            )
+            conn.executemany(
+                "UPDATE posts SET next_attempt_at = ? "
+                "WHERE id = ? AND status = 'pending' AND next_attempt_at IS NULL",
+                deferred
+            )
+            conn.commit()
+
     def get_scheduled_posts(self):
         with self.get_connection() as conn:
             return conn.execute(
@@ -133,15 +684,94 @@ class Database:
                     p.is_published, p.message_id, p.created_at, c.channel_name 
                 FROM posts p
                 JOIN channels c ON p.channel_id = c.channel_id
-                WHERE p.is_published = 0
+                WHERE p.status IN ('pending', 'publishing')
                 ORDER BY p.publish_time ASC
                 '''
             ).fetchall()
 
-    def set_post_published(self, post_id, message_id):
+    def get_status_counters(self):
+        """(число каналов, число ожидающих постов, ближайший publish_time или None).
+
+        COUNT/MIN по частичному индексу idx_posts_due не читает сами посты.
+        """
         with self.get_connection() as conn:
-            conn.execute('UPDATE posts SET is_published = 1, message_id = ? WHERE id = ?', (message_id, post_id))
+            return conn.execute(
+                '''
+                SELECT
+                    (SELECT COUNT(*) FROM channels),
+                    (SELECT COUNT(*) FROM posts WHERE status IN ('pending', 'publishing')),
+                    (SELECT MIN(publish_time) FROM posts WHERE status IN ('pending', 'publishing'))
+                '''
+            ).fetchone()
+
+    def set_post_published(self, post_id, message_id, owner):
+        self.mark_published([(post_id, message_id)], owner)
+
+    def mark_published(self, results, owner):
+        """Отмечает опубликованными сразу несколько постов одной транзакцией.
+
+        `results` - список пар (post_id, message_id). Обновляются только посты
+        под арендой воркера `owner`: пост, чью аренду перехватил другой
+        воркер, отмечает тот воркер.
+        """
+        with self.get_connection() as conn:
+            conn.executemany(
+                "UPDATE posts SET is_published = 1, status = 'published', message_id = ?, "
+                "lease_owner = NULL, lease_expires = NULL WHERE id = ? AND status = 'publishing' AND lease_owner = ?",
+                [(message_id, post_id, owner) for post_id, message_id in results]
+            )
+            conn.commit()
+
+    def archive_posts(self, before, batch_size):
+        """Переносит до `batch_size` завершённых постов с publish_time < `before` в posts_archive.
+
+        Текст и медиа рассылок копируются в архивную строку, а общее
+        содержимое удаляется вместе с последним постом рассылки. Счётчики
+        дней, целиком ушедших в архив, больше не нужны лимитам и тоже
+        удаляются. Возвращает число перенесённых постов.
+        """
+        conn = self.get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            ids = json.dumps([post_id for post_id, in conn.execute(
+                f"SELECT id FROM posts WHERE status IN {FINISHED_STATUSES} AND publish_time < ? "
+                "ORDER BY publish_time LIMIT ?",
+                (before, batch_size)
+            )])
+            conn.execute(
+                f'''
+                INSERT INTO posts_archive (id, user_id, channel_id, text, media_ids, publish_time, status,
+                                           message_id, attempts, last_error, recurring_id, created_at, archived_at)
+                SELECT id, user_id, channel_id, {POST_TEXT_SQL}, {POST_MEDIA_SQL}, publish_time, status,
+                       message_id, attempts, last_error, recurring_id, created_at, ?
+                FROM posts WHERE id IN (SELECT value FROM json_each(?))
+                ''',
+                (int(time.time()), ids)
+            )
+            content_ids = conn.execute(
+                'DELETE FROM posts WHERE id IN (SELECT value FROM json_each(?)) RETURNING content_id', (ids,)
+            ).fetchall()
+            conn.executemany(
+                'DELETE FROM post_contents WHERE id = ? AND NOT EXISTS (SELECT 1 FROM posts WHERE content_id = ?)',
+                {(content_id, content_id) for content_id, in content_ids if content_id is not None}
+            )
+            conn.execute('DELETE FROM post_counters WHERE day < ?', (post_day(before),))
             conn.commit()
+            return len(content_ids)
+        except Exception:
+            conn.rollback()
+            raise
+
+    def vacuum_free_pages(self, max_pages=0):
+        """PRAGMA incremental_vacuum: возвращает ОС до `max_pages` свободных страниц (0 - все).
+
+        Возвращает число освобождённых страниц.
+        """
+        conn = self.get_connection()
+        free_before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        # execute() делает один шаг прагмы и освобождает одну страницу; executescript выполняет её до конца
+        conn.executescript(f'PRAGMA incremental_vacuum({int(max_pages)});')
+        return free_before - conn.execute('PRAGMA freelist_count').fetchone()[0]
 
     def get_post_info(self, post_id):
         with self.get_connection() as conn:
@@ -149,8 +779,135 @@ class Database:
 
     def delete_post(self, post_id):
         with self.get_connection() as conn:
-            conn.execute('DELETE FROM posts WHERE id = ?', (post_id,))
+            deleted = conn.execute(
+                'DELETE FROM posts WHERE id = ? RETURNING content_id, user_id, publish_time, status', (post_id,)
+            ).fetchone()
+            if deleted is None:
+                return None
+            content_id, user_id, publish_time, status = deleted
+            if content_id is not None:
+                # Общее содержимое удаляется вместе с последним каналом рассылки
+                conn.execute(
+                    'DELETE FROM post_contents WHERE id = ? AND NOT EXISTS (SELECT 1 FROM posts WHERE content_id = ?)',
+                    (content_id, content_id)
+                )
+            if status == 'pending':
+                # Отменённый до публикации пост возвращает место в дневном лимите
+                conn.execute(
+                    'UPDATE post_counters SET count = MAX(count - 1, 0) WHERE user_id = ? AND day = ?',
+                    (user_id, post_day(publish_time))
+                )
+            conn.commit()
+            return user_id, publish_time, status
+
+    def add_recurring_post(self, user_id, channel_id, text, media_ids, cron, interval_seconds, next_run, end_time):
+        """Добавляет шаблон повторяющегося поста; `next_run` - первое вхождение (UTC epoch)."""
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                '''
+                INSERT INTO recurring_posts (user_id, channel_id, text, media_ids, cron, interval_seconds, next_run, end_time)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                (user_id, channel_id, text, media_ids, cron, interval_seconds, next_run, end_time)
+            )
+            conn.commit()
+            return cursor.lastrowid
+
+    def get_due_recurring_posts(self, horizon):
+        """Активные шаблоны, чьё ближайшее вхождение наступает не позже `horizon`."""
+        with self.get_connection() as conn:
+            return conn.execute(
+                '''
+                SELECT id, user_id, channel_id, text, media_ids, cron, interval_seconds, next_run, end_time
+                FROM recurring_posts
+                WHERE active = 1 AND next_run <= ?
+                ''',
+                (horizon,)
+            ).fetchall()
+
+    def expand_recurring_post(self, template, publish_times, next_run, daily_limit=None):
+        """Создаёт посты-вхождения шаблона и сдвигает его next_run одной транзакцией.
+
+        `template` - строка из `get_due_recurring_posts`. `next_run` равен None,
+        если вхождений больше не будет: тогда шаблон выключается. Если шаблон
+        уже развернул другой процесс, ничего не делает. Вхождения, которые
+        превысили бы `daily_limit` постов пользователя в свой день,
+        пропускаются, шаблон остаётся активным. Возвращает [(id, publish_time)]
+        созданных постов.
+        """
+        recurring_id, user_id, channel_id, text, media_ids, _, _, expected_next_run, _ = template
+        conn = self.get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = conn.execute(
+                'UPDATE recurring_posts SET next_run = ?, active = ? WHERE id = ? AND next_run = ? AND active = 1',
+                (expected_next_run if next_run is None else next_run, int(next_run is not None), recurring_id, expected_next_run)
+            )
+            added = []
+            if cursor.rowcount:
+                if daily_limit is not None:
+                    publish_times = self._within_daily_limit(conn, user_id, publish_times, daily_limit)
+                added = self._insert_posts(
+                    conn,
+                    [(user_id, channel_id, text, media_ids, publish_time) for publish_time in publish_times],
+                    recurring_id
+                )
+                self._count_posts(conn, [(user_id, publish_time) for publish_time in publish_times])
+            conn.commit()
+            return added
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _within_daily_limit(self, conn, user_id, publish_times, daily_limit):
+        # Вызывается внутри BEGIN IMMEDIATE: счётчики не меняются до конца транзакции
+        used, accepted = {}, []
+        for publish_time in publish_times:
+            day = post_day(publish_time)
+            if day not in used:
+                row = conn.execute('SELECT count FROM post_counters WHERE user_id = ? AND day = ?', (user_id, day)).fetchone()
+                used[day] = row[0] if row else 0
+            if used[day] < daily_limit:
+                used[day] += 1
+                accepted.append(publish_time)
+        if len(accepted) < len(publish_times):
+            logging.warning(
+                f"User {user_id}: skipped {len(publish_times) - len(accepted)} recurring occurrences "
+                f"over the daily limit of {daily_limit} posts."
+            )
+        return accepted
+
+    def get_user_recurring_posts(self, user_id):
+        with self.get_connection() as conn:
+            return conn.execute(
+                '''
+                SELECT id, channel_id, text, cron, interval_seconds, next_run, end_time
+                FROM recurring_posts
+                WHERE user_id = ? AND active = 1
+                ORDER BY next_run
+                ''',
+                (user_id,)
+            ).fetchall()
+
+    def cancel_recurring_post(self, user_id, recurring_id):
+        """Выключает шаблон и удаляет его ещё не отправленные вхождения. Возвращает их id."""
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                'UPDATE recurring_posts SET active = 0 WHERE id = ? AND user_id = ?',
+                (recurring_id, user_id)
+            )
+            if not cursor.rowcount:
+                return []
+            deleted = conn.execute(
+                "DELETE FROM posts WHERE recurring_id = ? AND status = 'pending' RETURNING id, publish_time",
+                (recurring_id,)
+            ).fetchall()
+            conn.executemany(
+                'UPDATE post_counters SET count = MAX(count - 1, 0) WHERE user_id = ? AND day = ?',
+                [(user_id, post_day(publish_time)) for _, publish_time in deleted]
+            )
             conn.commit()
+            return [post_id for post_id, _ in deleted]
 
     def add_payment(self, user_id, amount, order_id, status, external_url, payment_system):
         with self.get_connection() as conn:
@@ -174,7 +931,88 @@ class Database:
             conn.execute('UPDATE users SET balance = balance + ? WHERE id = ?', (amount, user_id))
             conn.commit()
 
+    def settle_payment(self, order_id):
+        """Атомарно переводит платёж из 'pending' в 'success' и зачисляет баланс.
+
+        Условный UPDATE и зачисление идут одной транзакцией, поэтому
+        повторные и одновременные вебхуки по одному order_id зачисляют
+        деньги ровно один раз. Возвращает (user_id, amount), если зачисление
+        выполнил этот вызов, иначе None.
+        """
+        conn = self.get_connection()
+        with conn:
+            rows = conn.execute(
+                "UPDATE payments SET status = 'success' WHERE order_id = ? AND status = 'pending' "
+                "RETURNING user_id, amount",
+                (order_id,)
+            ).fetchall()
+            if not rows:
+                return None
+            user_id, amount = rows[0]
+            conn.execute('INSERT OR IGNORE INTO users (id) VALUES (?)', (user_id,))
+            conn.execute('UPDATE users SET balance = balance + ? WHERE id = ?', (amount, user_id))
+        return user_id, amount
+
     def get_user_balance(self, user_id):
         with self.get_connection() as conn:
             result = conn.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()
             return result[0] if result else 0.0
+
+    def get_state(self, namespace, key):
+        with self.get_connection() as conn:
+            row = conn.execute(
+                'SELECT data, expires_at FROM conversation_state WHERE namespace = ? AND key = ? AND expires_at > ?',
+                (namespace, key, time.time())
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def set_state(self, namespace, key, value, expires_at):
+        with self.get_connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO conversation_state (namespace, key, data, expires_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (namespace, key, json.dumps(value), expires_at, time.time())
+            )
+            conn.commit()
+
+    def pop_state(self, namespace, key):
+        """Удаляет состояние и возвращает его значение (None, если его не было или оно истекло)."""
+        with self.get_connection() as conn:
+            row = conn.execute(
+                'DELETE FROM conversation_state WHERE namespace = ? AND key = ? RETURNING data, expires_at',
+                (namespace, key)
+            ).fetchone()
+            conn.commit()
+        return json.loads(row[0]) if row and row[1] > time.time() else None
+
+    def prune_states(self, namespace, max_entries):
+        """Удаляет истёкшие состояния и самые старые сверх `max_entries`."""
+        with self.get_connection() as conn:
+            conn.execute(
+                'DELETE FROM conversation_state WHERE namespace = ? AND expires_at <= ?',
+                (namespace, time.time())
+            )
+            conn.execute(
+                '''
+                DELETE FROM conversation_state WHERE namespace = ? AND key NOT IN (
+                    SELECT key FROM conversation_state WHERE namespace = ?
+                    ORDER BY updated_at DESC LIMIT ?
+                )
+                ''',
+                (namespace, namespace, max_entries)
+            )
+            conn.commit()
+
+
+def main():
+    db = Database(DB_NAME)
+    try:
+        if db.enable_incremental_vacuum():
+            logging.info(f"{DB_NAME} now uses incremental auto_vacuum.")
+        else:
+            logging.info(f"{DB_NAME} already uses incremental auto_vacuum.")
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
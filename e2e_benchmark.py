@@ -0,0 +1,292 @@
+"""Сквозной бенчмарк бота против локальных Telegram Bot API и CryptoPay.
+
+Запуск: python e2e_benchmark.py [--users N] [--due-posts M] [--webhooks K] [--output FILE]
+
+SchedulerBot запускается целиком, как в проде (webhook, публикация в
+процессе бота), но api.telegram.org и CryptoPay заменены фейковыми
+серверами из fake_servers.py. Сценарии:
+
+- scheduling: N пользователей одновременно проходят диалог /schedule_post
+  (выбор каналов, текст, медиа, время) - задержка от апдейта до ответа бота;
+- due_burst: M постов с одной и той же секундой публикации - задержка
+  публикации (p50/p95/p99) и время, за которое уходит вся пачка;
+- webhook_storm: K пользователей создают счёт через /deposit, затем K
+  уведомлений invoice_paid одновременно приходят на CRYPTOPAY_WEBHOOK_PATH.
+
+Для каждого сценария выводится время обработчиков (по
+bot_handler_duration_seconds) и операции БД в секунду (по
+bot_db_call_duration_seconds). Результат - JSON, чтобы сравнивать версии.
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import os
+import platform
+import sqlite3
+import tempfile
+import time
+
+import aiohttp
+
+from benchmark import _free_port, _latency_report, percentile
+from bot import SchedulerBot, build_application, run
+from config import ADMIN_IDS, CRYPTOPAY_WEBHOOK_PATH, MOSCOW_TZ
+from database import Database
+from fake_servers import FakeCryptoPayServer, FakeTelegramServer, callback_update, command_update, text_update
+from metrics import DB_CALL_DURATION, HANDLER_DURATION
+
+REPLY_METHODS = ('sendMessage', 'editMessageText', 'editMessageReplyMarkup')
+CHANNELS_PER_USER = 2
+BURST_USER_ID = 900_000
+STORM_USER_OFFSET = 500_000
+
+
+def _histogram_delta(before, after):
+    """{метка: (количество, сумма)} наблюдений, сделанных между двумя снимками `totals()`."""
+    delta = {}
+    for labels, (count, total) in after.items():
+        prev_count, prev_total = before.get(labels, (0, 0.0))
+        if count > prev_count:
+            delta[labels[0] if labels else ''] = (count - prev_count, total - prev_total)
+    return delta
+
+
+class E2EHarness:
+    def __init__(self, db_path, cryptopay_latency=0.0):
+        self.db_path = db_path
+        self.telegram = FakeTelegramServer()
+        self.cryptopay = FakeCryptoPayServer(latency=cryptopay_latency)
+        self.bot_logic = None
+        self.port = None
+        self._update_ids = itertools.count(1)
+        self._replies = {}
+        self._channel_sends = []
+        self._stop_event = asyncio.Event()
+        self._bot_task = None
+
+    def seed_users(self, user_ids, channels_per_user=CHANNELS_PER_USER):
+        """Пользователи с каналами и без дневного лимита постов; до запуска бота."""
+        db = Database(self.db_path)
+        for user_id in user_ids:
+            db.add_user(user_id, f'user{user_id}')
+            for index in range(channels_per_user):
+                db.add_channel(user_id, -user_id * 10 - index, f'Канал {user_id}/{index}')
+        with db.get_connection() as conn:
+            conn.execute('UPDATE users SET max_posts_per_day = 0')
+        db.close()
+        # Команды бота доступны только админам
+        ADMIN_IDS.extend(user_id for user_id in user_ids if user_id not in ADMIN_IDS)
+
+    def _on_call(self, method, params):
+        chat_id = params.get('chat_id')
+        if chat_id is None:
+            return
+        chat_id = int(chat_id)
+        if chat_id < 0:
+            if method == 'sendMessage':
+                self._channel_sends.append((time.time(), params.get('text') or ''))
+            return
+        waiter = self._replies.get(chat_id)
+        if method in REPLY_METHODS and waiter and not waiter.done():
+            waiter.set_result(time.perf_counter())
+
+    async def start(self):
+        await self.telegram.start()
+        await self.cryptopay.start()
+        self.telegram.call_listeners.append(self._on_call)
+
+        self.bot_logic = SchedulerBot(self.db_path, update_mode='webhook')
+        application = build_application(self.bot_logic, token='123:E2E', base_url=self.telegram.base_url)
+        self.port = _free_port()
+        self._bot_task = asyncio.create_task(run(
+            application, self.bot_logic, self.port, webhook_base_url=f'http://127.0.0.1:{self.port}',
+            cryptopay_url=self.cryptopay.base_url, stop_event=self._stop_event
+        ))
+        while not self.telegram.webhook_url:
+            if self._bot_task.done():
+                self._bot_task.result()
+            await asyncio.sleep(0.01)
+
+    async def stop(self):
+        self._stop_event.set()
+        await self._bot_task
+        await self.cryptopay.stop()
+        await self.telegram.stop()
+
+    async def send(self, user_id, update, timeout=30):
+        """Отправляет апдейт и ждёт ответа бота этому пользователю; возвращает задержку в секундах."""
+        loop = asyncio.get_running_loop()
+        self._replies[user_id] = loop.create_future()
+        started = time.perf_counter()
+        await self.telegram.push_update(update)
+        return await asyncio.wait_for(self._replies[user_id], timeout) - started
+
+    async def measure(self, scenario):
+        """Выполняет корутину `scenario` и добавляет к её отчёту время обработчиков и операции БД."""
+        handlers_before, db_before = HANDLER_DURATION.totals(), DB_CALL_DURATION.totals()
+        started = time.perf_counter()
+        report = await scenario
+        elapsed = time.perf_counter() - started
+        handlers = _histogram_delta(handlers_before, HANDLER_DURATION.totals())
+        db_calls = _histogram_delta(db_before, DB_CALL_DURATION.totals())
+        db_ops = sum(count for count, _ in db_calls.values())
+        report.update({
+            'wall_time_s': elapsed,
+            'handler_mean_ms': {name: total / count * 1000 for name, (count, total) in sorted(handlers.items())},
+            'db_ops': db_ops,
+            'db_ops_per_s': db_ops / elapsed if elapsed else 0.0,
+            'db_calls': {name: count for name, (count, _) in sorted(db_calls.items())},
+        })
+        return report
+
+    async def scheduling(self, user_ids):
+        publish_at = datetime.datetime.now(MOSCOW_TZ) + datetime.timedelta(days=1)
+        latencies = []
+
+        async def dialog(user_id):
+            steps = [command_update(next(self._update_ids), user_id, '/schedule_post')]
+            steps += [
+                callback_update(next(self._update_ids), user_id, f'schedule_toggle_{-user_id * 10 - index}')
+                for index in range(CHANNELS_PER_USER)
+            ]
+            steps += [
+                callback_update(next(self._update_ids), user_id, 'schedule_done'),
+                text_update(next(self._update_ids), user_id, f'E2E post from {user_id}'),
+                text_update(next(self._update_ids), user_id, '-'),
+                text_update(next(self._update_ids), user_id, publish_at.strftime('%Y-%m-%d %H:%M')),
+            ]
+            for update in steps:
+                latencies.append(await self.send(user_id, update))
+
+        await asyncio.gather(*(dialog(user_id) for user_id in user_ids))
+        _, scheduled, _ = await self.bot_logic.db.get_status_counters()
+        return {
+            'users': len(user_ids),
+            'updates': len(latencies),
+            'posts_scheduled': scheduled,
+            'update_to_reply': _latency_report(latencies),
+        }
+
+    async def due_burst(self, posts, per_channel=10, lead=2):
+        publish_time = int(time.time()) + lead
+        channels = max(1, posts // per_channel)
+        added = await self.bot_logic.db.add_posts([
+            (BURST_USER_ID, -BURST_USER_ID * 10 - i % channels, f'burst {i}', '[]', publish_time)
+            for i in range(posts)
+        ])
+        for post_id, post_time in added:
+            self.bot_logic.scheduler.add_new_post(post_id, post_time)
+
+        deadline = time.time() + lead + posts / 10 + 30
+        while time.time() < deadline:
+            if sum(1 for _, text in self._channel_sends if text.startswith('burst ')) >= posts:
+                break
+            await asyncio.sleep(0.05)
+        lags = [sent_at - publish_time for sent_at, text in self._channel_sends if text.startswith('burst ')]
+        return {
+            'posts': posts,
+            'channels': channels,
+            'published': len(lags),
+            'publish_lag_s': {
+                'p50': percentile(lags, 50),
+                'p95': percentile(lags, 95),
+                'p99': percentile(lags, 99),
+                'max': max(lags, default=0.0),
+            },
+        }
+
+    async def webhook_storm(self, user_ids):
+        invoice_latencies = []
+
+        async def deposit(user_id):
+            invoice_latencies.append(await self.send(user_id, command_update(next(self._update_ids), user_id, '/deposit')))
+            invoice_latencies.append(await self.send(user_id, text_update(next(self._update_ids), user_id, '5')))
+
+        await asyncio.gather(*(deposit(user_id) for user_id in user_ids))
+        order_ids = [invoice['external_id'] for invoice in self.cryptopay.invoices[-len(user_ids):]]
+
+        url = f'http://127.0.0.1:{self.port}{CRYPTOPAY_WEBHOOK_PATH}'
+        latencies, statuses = [], []
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+
+            async def paid(order_id):
+                payload = {'update_type': 'invoice_paid', 'payload': {'external_id': order_id}}
+                started = time.perf_counter()
+                async with session.post(url, json=payload) as response:
+                    await response.read()
+                    statuses.append(response.status)
+                latencies.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(paid(order_id) for order_id in order_ids))
+            storm_time = time.perf_counter() - started
+
+        settled = 0
+        for order_id in order_ids:
+            payment = await self.bot_logic.db.get_payment_by_order_id(order_id)
+            settled += payment is not None and payment[4] == 'success'
+        return {
+            'webhooks': len(order_ids),
+            'settled': settled,
+            'errors': sum(status != 200 for status in statuses),
+            'requests_per_s': len(order_ids) / storm_time if storm_time else 0.0,
+            'webhook_latency': _latency_report(latencies),
+            'deposit_update_to_reply': _latency_report(invoice_latencies),
+        }
+
+
+async def run_suite(users, due_posts, webhooks, cryptopay_latency):
+    with tempfile.TemporaryDirectory() as tmp:
+        harness = E2EHarness(os.path.join(tmp, 'e2e.db'), cryptopay_latency)
+        user_ids = list(range(1, users + 1))
+        storm_user_ids = list(range(STORM_USER_OFFSET + 1, STORM_USER_OFFSET + webhooks + 1))
+        harness.seed_users(user_ids + storm_user_ids + [BURST_USER_ID])
+        await harness.start()
+        try:
+            return {
+                'scheduling': await harness.measure(harness.scheduling(user_ids)),
+                'due_burst': await harness.measure(harness.due_burst(due_posts)),
+                'webhook_storm': await harness.measure(harness.webhook_storm(storm_user_ids)),
+            }
+        finally:
+            await harness.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--due-posts', type=int, default=300)
+    parser.add_argument('--webhooks', type=int, default=200)
+    parser.add_argument('--cryptopay-latency', type=float, default=0.0)
+    parser.add_argument('--output', help='записать JSON в файл вместо stdout')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+
+    report = {
+        'meta': {
+            'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'params': {
+                'users': args.users,
+                'due_posts': args.due_posts,
+                'webhooks': args.webhooks,
+                'cryptopay_latency': args.cryptopay_latency,
+            },
+        },
+        **asyncio.run(run_suite(args.users, args.due_posts, args.webhooks, args.cryptopay_latency)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
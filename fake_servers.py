@@ -0,0 +1,205 @@
+"""Локальные замены api.telegram.org и CryptoPay API для бенчмарков.
+
+FakeTelegramServer поддерживает ровно то подмножество Bot API, которое
+использует бот: getMe, getUpdates (long polling), setWebhook/deleteWebhook
+с доставкой апдейтов на webhook и методы отправки сообщений.
+FakeCryptoPayServer отвечает на createInvoice с настраиваемой задержкой.
+"""
+import asyncio
+import itertools
+import json
+import time
+import uuid
+
+import aiohttp
+from aiohttp import web
+
+BOT_USER = {'id': 1000, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'}
+
+
+def text_update(update_id, user_id, text):
+    """Апдейт с текстовым сообщением от пользователя в личном чате."""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': _user(user_id),
+            'text': text,
+        },
+    }
+
+
+def command_update(update_id, user_id, command):
+    """Апдейт с командой от пользователя в личном чате."""
+    update = text_update(update_id, user_id, command)
+    update['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command.split()[0])}]
+    return update
+
+
+def callback_update(update_id, user_id, data):
+    """Нажатие inline-кнопки с `data` под сообщением бота."""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': '...',
+            },
+        },
+    }
+
+
+class _FakeServer:
+    def __init__(self, host='127.0.0.1', port=0):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    def add_routes(self, app):
+        raise NotImplementedError
+
+    async def start(self):
+        app = web.Application()
+        self.add_routes(app)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+class FakeCryptoPayServer(_FakeServer):
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        super().__init__(host, port)
+        self.latency = latency
+        self.invoices = []
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}/api'
+
+    def add_routes(self, app):
+        app.router.add_post('/api/createInvoice', self._create_invoice)
+
+    async def _create_invoice(self, request):
+        payload = await request.json()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        invoice_id = len(self.invoices) + 1
+        self.invoices.append(payload)
+        return web.json_response({'ok': True, 'result': {
+            'invoice_id': invoice_id,
+            'status': 'active',
+            'amount': str(payload['amount']),
+            'pay_url': f'https://t.me/CryptoBot?start={uuid.uuid4().hex}',
+        }})
+
+
+class FakeTelegramServer(_FakeServer):
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__(host, port)
+        self.base_url = None
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.calls = []
+        self.call_listeners = []
+        self._updates = []
+        self._updates_changed = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self._session = None
+
+    def add_routes(self, app):
+        app.router.add_post('/bot{token}/{method}', self._handle)
+
+    async def start(self):
+        await super().start()
+        self.base_url = f'http://{self.host}:{self.port}/bot'
+        self._session = aiohttp.ClientSession()
+
+    async def stop(self):
+        await self._session.close()
+        await super().stop()
+
+    async def push_update(self, update):
+        """Передаёт апдейт боту: через webhook, если он установлен, иначе в очередь getUpdates."""
+        if self.webhook_url:
+            headers = {'X-Telegram-Bot-Api-Secret-Token': self.webhook_secret or ''}
+            async with self._session.post(self.webhook_url, json=update, headers=headers) as response:
+                response.raise_for_status()
+            return
+        self._updates.append(update)
+        self._updates_changed.set()
+
+    async def _params(self, request):
+        if request.content_type == 'application/json':
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        params = await self._params(request)
+        self.calls.append((method, params, time.perf_counter()))
+        for listener in self.call_listeners:
+            listener(method, params)
+
+        handler = getattr(self, f'_method_{method.lower()}', None)
+        result = await handler(params) if handler else self._message(params)
+        return web.json_response({'ok': True, 'result': result})
+
+    def _message(self, params):
+        if 'chat_id' not in params:
+            return True
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': params['chat_id'], 'type': 'channel' if int(params['chat_id']) < 0 else 'private'},
+            'text': params.get('text') or params.get('caption') or '',
+        }
+
+    async def _method_getme(self, params):
+        return BOT_USER
+
+    async def _method_setwebhook(self, params):
+        self.webhook_url = params['url']
+        self.webhook_secret = params.get('secret_token')
+        return True
+
+    async def _method_deletewebhook(self, params):
+        self.webhook_url = None
+        return True
+
+    async def _method_sendmediagroup(self, params):
+        return [self._message(params) for _ in params.get('media', [])]
+
+    async def _method_getupdates(self, params):
+        offset = int(params.get('offset') or 0)
+        self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates:
+            self._updates_changed.clear()
+            try:
+                await asyncio.wait_for(self._updates_changed.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get('limit') or 100)]
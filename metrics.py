@@ -0,0 +1,166 @@
+"""Метрики в текстовом формате Prometheus (без внешних зависимостей).
+
+Все наблюдения делаются из потока event loop, поэтому блокировки не нужны:
+`observe` - это bisect по границам корзин и пара сложений.
+"""
+import bisect
+import functools
+import hmac
+import time
+
+from aiohttp import web
+
+from config import METRICS_TOKEN
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PUBLISH_DELAY_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Counter:
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self._values.items():
+            yield f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}'
+
+
+class Gauge:
+    """Значение задаётся через `set` или вычисляется функцией `func` при выдаче метрик."""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, func=None):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        value = self.func() if self.func else self.value
+        yield f'{self.name} {_format_value(value)}'
+
+
+class Histogram:
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            # [счётчики корзин (без +Inf), сумма, количество]
+            series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def totals(self):
+        """{значения меток: (количество, сумма)} - для сравнения до и после нагрузки."""
+        return {label_values: (count, total) for label_values, (_, total, count) in self._series.items()}
+
+    def samples(self):
+        for label_values, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, label_values, [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.label_names, label_values, [('le', '+Inf')])
+            yield f'{self.name}_bucket{labels} {count}'
+            labels = _format_labels(self.label_names, label_values)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_DURATION = REGISTRY.register(Histogram(
+    'bot_handler_duration_seconds', 'Time spent in Telegram update handlers.', ('handler',)
+))
+DB_CALL_DURATION = REGISTRY.register(Histogram(
+    'bot_db_call_duration_seconds', 'Database method latency including executor queueing.', ('method',)
+))
+PUBLISH_DELAY = REGISTRY.register(Histogram(
+    'bot_publish_delay_seconds', 'Actual publish time minus scheduled publish time.', buckets=PUBLISH_DELAY_BUCKETS
+))
+SEND_ERRORS = REGISTRY.register(Counter(
+    'bot_send_errors_total', 'Bot API send errors by exception type.', ('error',)
+))
+WEBHOOK_DURATION = REGISTRY.register(Histogram(
+    'bot_webhook_duration_seconds', 'Webhook request processing time.', ('webhook',)
+))
+
+
+def timed(histogram, *label_values):
+    """Декоратор корутины: длительность каждого вызова пишется в `histogram`."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *label_values)
+
+        return wrapper
+
+    return decorator
+
+
+async def metrics_handler(request):
+    """GET /metrics; при заданном METRICS_TOKEN требует Authorization: Bearer <токен>."""
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return web.Response(status=401)
+    return web.Response(text=REGISTRY.render(), content_type='text/plain')
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+
+NOTIFICATION_WORKERS = 4
+NOTIFICATION_QUEUE_SIZE = 10000
+
+
+class NotificationQueue:
+    """Фоновая отправка служебных сообщений пользователям.
+
+    Обработчики вебхуков ставят сообщение в очередь и сразу отвечают,
+    отправка идёт через `PublishDispatcher` с учётом лимитов Telegram.
+    """
+
+    def __init__(self, bot, dispatcher, workers=NOTIFICATION_WORKERS, maxsize=NOTIFICATION_QUEUE_SIZE):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        self._workers_count = workers
+        self._workers = []
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def notify(self, chat_id, text, parse_mode='Markdown'):
+        try:
+            self._queue.put_nowait((chat_id, text, parse_mode))
+        except asyncio.QueueFull:
+            logging.warning(f"Notification queue is full, dropping message to {chat_id}")
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+
+    async def stop(self, timeout=5.0):
+        """Дожидается отправки оставшихся сообщений (не дольше `timeout`) и останавливает воркеры."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Dropping {self._queue.qsize()} unsent notifications on shutdown")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _worker(self):
+        while True:
+            chat_id, text, parse_mode = await self._queue.get()
+            try:
+                await self.dispatcher.send(
+                    chat_id, lambda: self.bot.send_message(chat_id, text, parse_mode=parse_mode)
+                )
+            except Exception:
+                logging.exception(f"Error sending notification to {chat_id}")
+            finally:
+                self._queue.task_done()
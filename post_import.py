@@ -0,0 +1,147 @@
+"""Импорт запланированных постов из CSV / JSON.
+
+Каждая строка файла - один пост с полями:
+- channel: ID канала или его название (канал должен быть привязан);
+- text: текст поста;
+- media: file_id фото/видео через пробел или ';', видео - с префиксом
+  'video:' (в JSON - список строк или объектов {type, file_id});
+- time: 'ГГГГ-ММ-ДД ЧЧ:ММ' по МСК или ISO-время с часовым поясом.
+
+Поддерживаются CSV с заголовком, JSON Lines (объект на строку) и JSON-массив
+объектов. CSV и JSON Lines разбираются построчно, без загрузки всего файла.
+"""
+import codecs
+import csv
+import datetime
+import io
+import json
+import time
+
+from config import MOSCOW_TZ, MAX_MEDIA_PER_POST, MAX_IMPORT_ROWS
+
+class ImportRowError(ValueError):
+    pass
+
+
+def detect_format(file_name):
+    name = (file_name or '').lower()
+    for extension, file_format in (('.csv', 'csv'), ('.jsonl', 'jsonl'), ('.json', 'json')):
+        if name.endswith(extension):
+            return file_format
+    return None
+
+
+def iter_rows(stream, file_format):
+    """Генератор (номер строки, dict) из бинарного потока `stream`."""
+    if file_format == 'csv':
+        text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line_no, line in enumerate(codecs.getreader('utf-8-sig')(stream), 1):
+            if line.strip():
+                try:
+                    yield line_no, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_no, ImportRowError(f"некорректный JSON: {e.msg}")
+    elif file_format == 'json':
+        # Массив целиком: размер файла ограничен MAX_IMPORT_FILE_SIZE
+        rows = json.load(codecs.getreader('utf-8-sig')(stream))
+        if not isinstance(rows, list):
+            raise ImportRowError("JSON-файл должен содержать массив постов")
+        yield from enumerate(rows, 1)
+    else:
+        raise ImportRowError("поддерживаются файлы .csv, .json и .jsonl")
+
+
+def parse_media(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.replace(';', ' ').split()
+    if not isinstance(value, list):
+        raise ImportRowError("media должно быть строкой или списком")
+
+    media = []
+    for item in value:
+        if isinstance(item, dict):
+            media_type, file_id = item.get('type', 'photo'), item.get('file_id')
+        elif isinstance(item, str):
+            media_type, _, file_id = item.partition(':') if item.startswith('video:') else ('photo', '', item)
+        else:
+            raise ImportRowError("некорректный элемент media")
+        if media_type not in ('photo', 'video') or not file_id:
+            raise ImportRowError(f"некорректный элемент media: {item}")
+        media.append({'type': media_type, 'file_id': file_id})
+    if len(media) > MAX_MEDIA_PER_POST:
+        raise ImportRowError(f"не больше {MAX_MEDIA_PER_POST} медиа в посте")
+    return media
+
+
+def parse_publish_time(value):
+    """'ГГГГ-ММ-ДД ЧЧ:ММ' по МСК или ISO с поясом -> UTC epoch."""
+    try:
+        publish_time = datetime.datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ImportRowError(f"неверное время '{value}', нужен формат ГГГГ-ММ-ДД ЧЧ:ММ")
+    if publish_time.tzinfo is None:
+        publish_time = MOSCOW_TZ.localize(publish_time)
+    return int(publish_time.timestamp())
+
+
+class PostImporter:
+    """Проверяет строки импорта и превращает их в строки для `Database.add_posts`.
+
+    `channels` - пары (channel_id, channel_name) каналов пользователя.
+    """
+
+    def __init__(self, user_id, channels, max_rows=MAX_IMPORT_ROWS, now=None):
+        self.user_id = user_id
+        self.max_rows = max_rows
+        self.now = time.time() if now is None else now
+        self._channel_ids = {channel_id for channel_id, _ in channels}
+        self._channels_by_name = {name.lower(): channel_id for channel_id, name in channels if name}
+
+    def resolve_channel(self, value):
+        value = str(value or '').strip()
+        if value.lstrip('-').isdigit() and int(value) in self._channel_ids:
+            return int(value)
+        channel_id = self._channels_by_name.get(value.lower())
+        if channel_id is None:
+            raise ImportRowError(f"канал '{value}' не привязан")
+        return channel_id
+
+    def validate(self, row):
+        if isinstance(row, ImportRowError):
+            raise row
+        if not isinstance(row, dict):
+            raise ImportRowError("строка должна быть объектом с полями channel, text, media, time")
+        channel_id = self.resolve_channel(row.get('channel'))
+        text = str(row.get('text') or '').strip() or None
+        media = parse_media(row.get('media'))
+        if not text and not media:
+            raise ImportRowError("пустой пост: нужен текст или медиа")
+        if not row.get('time'):
+            raise ImportRowError("не указано время")
+        publish_time = parse_publish_time(row['time'])
+        if publish_time <= self.now:
+            raise ImportRowError("время должно быть в будущем")
+        return self.user_id, channel_id, text, json.dumps(media), publish_time
+
+    def run(self, stream, file_format):
+        """Возвращает (строки для вставки, [(номер строки, ошибка)])."""
+        posts, errors = [], []
+        try:
+            for line_no, row in iter_rows(stream, file_format):
+                if len(posts) + len(errors) >= self.max_rows:
+                    errors.append((line_no, f"превышен лимит в {self.max_rows} строк, остаток файла пропущен"))
+                    break
+                try:
+                    posts.append(self.validate(row))
+                except ImportRowError as e:
+                    errors.append((line_no, str(e)))
+        except (ImportRowError, ValueError, csv.Error) as e:
+            # Файл не читается целиком (битая кодировка, JSON и т.п.)
+            errors.append((0, f"файл не разобран: {e}"))
+        return posts, errors
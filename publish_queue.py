@@ -0,0 +1,80 @@
+import asyncio
+import heapq
+import time
+
+
+class PublishQueue:
+    """Очередь неопубликованных постов в памяти (min-heap по времени публикации, UTC epoch).
+
+    Удаление ленивое: в куче могут оставаться устаревшие записи, актуальное
+    время поста хранится в `_entries`, и лишние записи отбрасываются при
+    извлечении. `wait_due` спит ровно до ближайшего publish_time или до
+    изменения очереди и не обращается к БД.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._changed = asyncio.Event()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, post_id):
+        return post_id in self._entries
+
+    def push(self, post_id, publish_ts):
+        self._entries[post_id] = publish_ts
+        heapq.heappush(self._heap, (publish_ts, post_id))
+        self._changed.set()
+
+    def discard(self, post_id):
+        self._entries.pop(post_id, None)
+
+    def replace_all(self, posts):
+        """Полностью пересобирает очередь из пар (post_id, publish_ts)."""
+        self._entries = dict(posts)
+        self._heap = [(publish_ts, post_id) for post_id, publish_ts in self._entries.items()]
+        heapq.heapify(self._heap)
+        self._changed.set()
+
+    def next_time(self):
+        while self._heap:
+            publish_ts, post_id = self._heap[0]
+            if self._entries.get(post_id) == publish_ts:
+                return publish_ts
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now_ts=None):
+        now_ts = time.time() if now_ts is None else now_ts
+        due = []
+        while True:
+            next_ts = self.next_time()
+            if next_ts is None or next_ts > now_ts:
+                return due
+            _, post_id = heapq.heappop(self._heap)
+            del self._entries[post_id]
+            due.append(post_id)
+
+    async def wait_due(self, timeout=None):
+        """Ждёт, пока наступит время хотя бы одного поста, и возвращает их id.
+
+        По истечении `timeout` секунд возвращает пустой список.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            now = time.time()
+            due = self.pop_due(now)
+            if due:
+                return due
+            if deadline is not None and now >= deadline:
+                return []
+
+            wake_times = [ts for ts in (self.next_time(), deadline) if ts is not None]
+            delay = max(0.0, min(wake_times) - now) if wake_times else None
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,260 @@
+import asyncio
+import collections
+import datetime
+import json
+import logging
+import random
+import time
+
+from telegram import InputMediaPhoto, InputMediaVideo
+from telegram.error import BadRequest, ChatMigrated, Forbidden, RetryAfter
+
+from config import (
+    PUBLISH_CONCURRENCY, TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE_PER_MINUTE,
+    PUBLISH_MAX_ATTEMPTS, PUBLISH_RETRY_BASE_DELAY, PUBLISH_RETRY_MAX_DELAY,
+    PUBLISH_FLUSH_SIZE, PUBLISH_FLUSH_INTERVAL
+)
+from metrics import SEND_ERRORS
+
+# Ошибки, которые не исправятся повтором: бот удалён из канала, битая разметка и т.п.
+PERMANENT_ERRORS = (Forbidden, BadRequest, ChatMigrated)
+
+
+def parse_media(media_ids_str):
+    """Разбирает поле posts.media_ids в список {'type', 'file_id'}.
+
+    Старые записи хранят просто список file_id фотографий.
+    """
+    media = json.loads(media_ids_str or '[]')
+    return [item if isinstance(item, dict) else {'type': 'photo', 'file_id': item} for item in media]
+
+
+def build_send_request(bot, channel_id, text, media_ids_str, parse_mode='Markdown'):
+    """Возвращает фабрику корутины, публикующей пост одним вызовом Bot API."""
+    media = parse_media(media_ids_str)
+    if not media:
+        return lambda: bot.send_message(channel_id, text, parse_mode=parse_mode)
+    if len(media) == 1:
+        item = media[0]
+        if item['type'] == 'video':
+            return lambda: bot.send_video(channel_id, item['file_id'], caption=text, parse_mode=parse_mode)
+        return lambda: bot.send_photo(channel_id, item['file_id'], caption=text, parse_mode=parse_mode)
+
+    album = []
+    for index, item in enumerate(media):
+        input_cls = InputMediaVideo if item['type'] == 'video' else InputMediaPhoto
+        # Подпись альбома - у первого элемента
+        if index == 0:
+            album.append(input_cls(item['file_id'], caption=text, parse_mode=parse_mode))
+        else:
+            album.append(input_cls(item['file_id']))
+    return lambda: bot.send_media_group(channel_id, album)
+
+
+def retry_after_seconds(error: RetryAfter):
+    delay = error.retry_after
+    if isinstance(delay, datetime.timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+
+def is_permanent_error(error):
+    return isinstance(error, PERMANENT_ERRORS)
+
+
+def next_retry_time(attempts, error, now=None):
+    """Время следующей попытки (UTC epoch) после `attempts` неудач или None, если пост сдаётся.
+
+    Экспоненциальный backoff с jitter: случайная задержка в [base, base * 2^n]
+    (не больше PUBLISH_RETRY_MAX_DELAY), так что повтор никогда не идёт
+    сразу вслед за сбоем.
+    """
+    if is_permanent_error(error) or attempts >= PUBLISH_MAX_ATTEMPTS:
+        return None
+    now = time.time() if now is None else now
+    base = PUBLISH_RETRY_BASE_DELAY
+    ceiling = max(base, min(PUBLISH_RETRY_MAX_DELAY, base * 2 ** (attempts - 1)))
+    return now + base + random.uniform(0, ceiling - base)
+
+
+class TokenBucket:
+    """Token bucket: `rate` токенов в секунду, не больше `capacity` в запасе."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause(self, seconds):
+        """Запрещает выдачу токенов на `seconds` секунд (ответ RetryAfter)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PublisherMetrics:
+    def __init__(self, latency_window=1000):
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.sent = 0
+        self.errors = 0
+        self.retry_after = 0
+        self._latencies = collections.deque(maxlen=latency_window)
+
+    def observe_latency(self, seconds):
+        self._latencies.append(seconds)
+
+    def snapshot(self):
+        latencies = sorted(self._latencies)
+
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] if latencies else 0.0
+
+        return {
+            'queue_depth': self.queue_depth,
+            'in_flight': self.in_flight,
+            'sent': self.sent,
+            'errors': self.errors,
+            'retry_after': self.retry_after,
+            'send_latency_p50': pct(50),
+            'send_latency_p99': pct(99),
+        }
+
+
+class PublishDispatcher:
+    """Конкурентная отправка сообщений с учётом лимитов Telegram.
+
+    Глобальный bucket ограничивает общий поток (~30 msg/s), bucket канала -
+    поток в один чат (~20 msg/min). Одновременно выполняется не более
+    `concurrency` запросов; посты одного канала уходят по порядку.
+    """
+
+    def __init__(self, concurrency=PUBLISH_CONCURRENCY, global_rate=TELEGRAM_GLOBAL_RATE,
+                 chat_rate_per_minute=TELEGRAM_CHAT_RATE_PER_MINUTE):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._global_rate = global_rate
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_rate_per_minute = chat_rate_per_minute
+        self._chat_buckets = {}
+        self._chat_locks = collections.defaultdict(asyncio.Lock)
+        self.metrics = PublisherMetrics()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self._chat_rate_per_minute / 60, self._chat_rate_per_minute)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def claim_budget(self, lease_seconds, held=0):
+        """(всего, на канал): сколько постов можно взять в аренду, чтобы успеть отправить их за `lease_seconds`.
+
+        `held` - посты, уже взятые этим воркером и ещё не отправленные.
+        """
+        per_chat = max(1, int(self._chat_rate_per_minute / 60 * lease_seconds))
+        total = max(0, int(self._global_rate * lease_seconds) - held)
+        return total, per_chat
+
+    async def send(self, chat_id, request):
+        """Выполняет `request()` (корутинную фабрику вызова Bot API) с учётом лимитов."""
+        chat_bucket = self._chat_bucket(chat_id)
+        self.metrics.queue_depth += 1
+        try:
+            async with self._chat_locks[chat_id]:
+                while True:
+                    await chat_bucket.acquire()
+                    await self._global_bucket.acquire()
+                    async with self._semaphore:
+                        self.metrics.in_flight += 1
+                        started = time.monotonic()
+                        try:
+                            result = await request()
+                        except RetryAfter as e:
+                            delay = retry_after_seconds(e)
+                            self.metrics.retry_after += 1
+                            SEND_ERRORS.inc('RetryAfter')
+                            logging.warning(f"Flood control for chat {chat_id}, retry in {delay}s")
+                            chat_bucket.pause(delay)
+                            self._global_bucket.pause(delay)
+                            continue
+                        except Exception as e:
+                            self.metrics.errors += 1
+                            SEND_ERRORS.inc(type(e).__name__)
+                            raise
+                        finally:
+                            self.metrics.in_flight -= 1
+                    self.metrics.sent += 1
+                    self.metrics.observe_latency(time.monotonic() - started)
+                    return result
+        finally:
+            self.metrics.queue_depth -= 1
+
+
+class PublishedBuffer:
+    """Копит результаты успешных отправок и сохраняет их пачкой.
+
+    Пачка уходит в `flush_func` одной транзакцией, когда набирается
+    `max_size` результатов или через `max_delay` секунд после первого.
+
+    Гарантии при падении: до сброса пост остаётся в статусе 'publishing'
+    под арендой воркера. Если процесс упадёт между отправкой и сбросом,
+    после истечения аренды пост будет заново забран и отправлен повторно
+    (at-least-once). Окно таких дублей ограничено `max_delay`. Перед
+    остановкой нужно вызвать `flush()`.
+    """
+
+    def __init__(self, flush_func, max_size=PUBLISH_FLUSH_SIZE, max_delay=PUBLISH_FLUSH_INTERVAL):
+        self._flush_func = flush_func
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._items = []
+        self._timer = None
+
+    def __len__(self):
+        return len(self._items)
+
+    def post_ids(self):
+        return {post_id for post_id, _ in self._items}
+
+    async def add(self, post_id, message_id):
+        self._items.append((post_id, message_id))
+        if len(self._items) >= self.max_size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+            self._timer = None
+        items, self._items = self._items, []
+        if not items:
+            return
+        try:
+            await self._flush_func(items)
+            logging.info(f"Saved {len(items)} published posts.")
+        except Exception:
+            # Посты останутся под арендой и будут отправлены повторно после её истечения
+            logging.exception(f"Failed to save {len(items)} published posts")
@@ -0,0 +1,100 @@
+import collections
+import datetime
+import time
+
+from config import QUOTA_CACHE_TTL, QUOTA_CACHE_SIZE, FREE_MAX_CHANNELS, FREE_MAX_POSTS_PER_DAY
+
+
+class QuotaService:
+    """Лимиты тарифа пользователя: каналы и посты в день.
+
+    Лимиты и число каналов читаются одним запросом и кэшируются на `ttl`
+    секунд (LRU на `max_size` пользователей); смена каналов сбрасывает кэш
+    пользователя через `invalidate()`. Число постов за день хранится в
+    таблице post_counters, которую база обновляет в той же транзакции, что
+    и вставку постов, поэтому проверка лимита - это чтение одного счётчика,
+    а не подсчёт строк posts. Окончательно лимит проверяет сама вставка
+    (`daily_limit`), так что устаревший кэш не даёт его превысить.
+    """
+
+    def __init__(self, db, ttl=QUOTA_CACHE_TTL, max_size=QUOTA_CACHE_SIZE):
+        self.db = db
+        self.ttl = ttl
+        self.max_size = max_size
+        self._limits = collections.OrderedDict()
+        self._counters = {}
+
+    def invalidate(self, user_id):
+        self._limits.pop(user_id, None)
+        for key in [key for key in self._counters if key[0] == user_id]:
+            del self._counters[key]
+
+    def forget_day(self, user_id, day):
+        self._counters.pop((user_id, day), None)
+
+    def record_posts(self, user_id, day, count):
+        """Учитывает в кэше посты, уже добавленные в базу."""
+        if (user_id, day) in self._counters:
+            self._counters[user_id, day] += count
+
+    async def limits(self, user_id):
+        """Возвращает {'max_channels', 'max_posts_per_day', 'channels'} или None для неизвестного пользователя."""
+        cached = self._limits.get(user_id)
+        if cached and time.monotonic() < cached[0]:
+            self._limits.move_to_end(user_id)
+            return cached[1]
+        row = await self.db.get_user_limits(user_id)
+        if row is None:
+            return None
+        _, tariff_expires, max_channels, max_posts_per_day, channels = row
+        if tariff_expires and _parse_expires(tariff_expires) <= datetime.datetime.now(datetime.timezone.utc):
+            # Истёкший тариф - бесплатные лимиты
+            max_channels, max_posts_per_day = FREE_MAX_CHANNELS, FREE_MAX_POSTS_PER_DAY
+        limits = {
+            'max_channels': FREE_MAX_CHANNELS if max_channels is None else max_channels,
+            'max_posts_per_day': FREE_MAX_POSTS_PER_DAY if max_posts_per_day is None else max_posts_per_day,
+            'channels': channels,
+        }
+        self._limits[user_id] = (time.monotonic() + self.ttl, limits)
+        self._limits.move_to_end(user_id)
+        while len(self._limits) > self.max_size:
+            self._limits.popitem(last=False)
+        return limits
+
+    async def check_channel_limit(self, user_id):
+        """(можно ли привязать ещё канал, лимит каналов); None для неизвестного пользователя.
+
+        В отличие от лимита постов, max_channels = 0 означает «каналы
+        недоступны», а не «без ограничений».
+        """
+        limits = await self.limits(user_id)
+        if limits is None:
+            return None
+        max_channels = limits['max_channels']
+        return limits['channels'] < max_channels, max_channels
+
+    async def daily_limit(self, user_id):
+        """Лимит постов в день или None, если он не ограничен."""
+        limits = await self.limits(user_id)
+        if limits is None or limits['max_posts_per_day'] <= 0:
+            return None
+        return limits['max_posts_per_day']
+
+    async def remaining_posts(self, user_id, day):
+        """Сколько постов ещё можно запланировать на `day` ('ГГГГ-ММ-ДД' по МСК); None - без ограничений."""
+        limit = await self.daily_limit(user_id)
+        if limit is None:
+            return None
+        count = self._counters.get((user_id, day))
+        if count is None:
+            count = self._counters[user_id, day] = await self.db.get_post_count(user_id, day)
+            if len(self._counters) > self.max_size:
+                # Счётчики прошедших дней больше не нужны - чистим кэш целиком
+                self._counters = {(user_id, day): count}
+        return max(limit - count, 0)
+
+
+def _parse_expires(value):
+    # sqlite3 отдаёт DATETIME строкой; время без пояса считаем UTC
+    expires = value if isinstance(value, datetime.datetime) else datetime.datetime.fromisoformat(str(value))
+    return expires if expires.tzinfo else expires.replace(tzinfo=datetime.timezone.utc)
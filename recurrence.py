@@ -0,0 +1,133 @@
+import datetime
+import functools
+import logging
+import math
+import re
+import time
+
+from apscheduler.triggers.cron import CronTrigger
+
+from config import MOSCOW_TZ, RECURRING_LOOKAHEAD, RECURRING_MISSED_GRACE, RECURRING_MIN_INTERVAL
+from database import post_day
+from quota import QuotaService
+
+INTERVAL_UNITS = {
+    'm': 60, 'м': 60,
+    'h': 3600, 'ч': 3600,
+    'd': 86400, 'д': 86400,
+    'w': 604800, 'н': 604800,
+}
+INTERVAL_RE = re.compile(r'^(?:every\s+|каждые?\s+)?(\d+)\s*([mhdwмчдн])$', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=256)
+def cron_trigger(cron):
+    # Cron-выражения задаются по московскому времени
+    return CronTrigger.from_crontab(cron, timezone=MOSCOW_TZ)
+
+
+def parse_recurrence(spec):
+    """Разбирает '2h' / 'каждые 30м' / cron '0 10 * * mon' в (cron, interval_seconds).
+
+    Бросает ValueError с понятным пользователю текстом.
+    """
+    spec = ' '.join(spec.split())
+    match = INTERVAL_RE.match(spec)
+    if match:
+        interval_seconds = int(match.group(1)) * INTERVAL_UNITS[match.group(2).lower()]
+        if interval_seconds < RECURRING_MIN_INTERVAL:
+            raise ValueError(f"Интервал должен быть не меньше {RECURRING_MIN_INTERVAL // 60} мин.")
+        return None, interval_seconds
+    try:
+        cron_trigger(spec)
+    except ValueError:
+        raise ValueError("Не удалось разобрать расписание: укажите интервал (например, 6h) или cron из 5 полей.")
+    return spec, None
+
+
+def describe_recurrence(cron, interval_seconds):
+    if cron:
+        return f"cron `{cron}`"
+    for unit, seconds, label in ((604800, 604800, 'нед.'), (86400, 86400, 'дн.'), (3600, 3600, 'ч'), (60, 60, 'мин')):
+        if interval_seconds % unit == 0:
+            return f"каждые {interval_seconds // seconds} {label}"
+    return f"каждые {interval_seconds} с"
+
+
+def next_occurrence(cron, interval_seconds, after_ts):
+    """Первое вхождение строго позже `after_ts` (UTC epoch) или None."""
+    if interval_seconds:
+        return after_ts + interval_seconds
+    after = datetime.datetime.fromtimestamp(after_ts + 1, MOSCOW_TZ)
+    fire_time = cron_trigger(cron).get_next_fire_time(None, after)
+    return int(fire_time.timestamp()) if fire_time else None
+
+
+def skip_missed(cron, interval_seconds, run, not_before):
+    """Сдвигает вхождение `run` на первое не раньше `not_before`, не перебирая пропущенные."""
+    if run >= not_before:
+        return run
+    if interval_seconds:
+        return run + math.ceil((not_before - run) / interval_seconds) * interval_seconds
+    return next_occurrence(cron, interval_seconds, not_before - 1)
+
+
+def day_over_limit(cron, interval_seconds, first_run, end_time, daily_limit, window=31 * 86400):
+    """Первый день ('ГГГГ-ММ-ДД' по МСК), в который расписание даёт больше `daily_limit` вхождений, или None.
+
+    Проверяются вхождения за `window` секунд от `first_run`: этого хватает,
+    чтобы увидеть любой день недели и месяца в cron.
+    """
+    counts = {}
+    run = first_run
+    while run is not None and run <= first_run + window and (end_time is None or run <= end_time):
+        day = post_day(run)
+        counts[day] = counts.get(day, 0) + 1
+        if counts[day] > daily_limit:
+            return day
+        run = next_occurrence(cron, interval_seconds, run)
+    return None
+
+
+class RecurringExpander:
+    """Ленивая материализация повторяющихся постов.
+
+    Шаблон в recurring_posts хранит только ближайшее вхождение (next_run).
+    `expand()` создаёт в posts вхождения, наступающие в ближайшие
+    `lookahead` секунд, и сдвигает next_run дальше, поэтому posts содержит
+    лишь несколько строк на шаблон, а не все будущие публикации.
+
+    Вхождения учитываются в дневном лимите постов наравне с обычными
+    постами: вхождение, которому не хватило лимита в свой день, пропускается.
+    """
+
+    def __init__(self, db, quota=None, lookahead=RECURRING_LOOKAHEAD, missed_grace=RECURRING_MISSED_GRACE):
+        self.db = db
+        self.quota = quota or QuotaService(db)
+        self.lookahead = lookahead
+        self.missed_grace = missed_grace
+
+    async def expand(self, now=None):
+        """Возвращает [(post_id, publish_time)] созданных постов."""
+        now = int(time.time() if now is None else now)
+        added = []
+        for template in await self.db.get_due_recurring_posts(now + self.lookahead):
+            recurring_id, user_id, _, _, _, cron, interval_seconds, next_run, end_time = template
+            run = skip_missed(cron, interval_seconds, next_run, now - self.missed_grace)
+            if run != next_run:
+                logging.warning(f"Recurring post {recurring_id}: skipped occurrences missed since {next_run}")
+
+            publish_times = []
+            while run is not None and run <= now + self.lookahead:
+                if end_time is not None and run > end_time:
+                    break
+                publish_times.append(run)
+                run = next_occurrence(cron, interval_seconds, run)
+            if run is not None and end_time is not None and run > end_time:
+                run = None
+
+            daily_limit = await self.quota.daily_limit(user_id)
+            added += await self.db.expand_recurring_post(template, publish_times, run, daily_limit)
+        if added:
+            logging.info(f"Expanded {len(added)} recurring post occurrences.")
+        return added
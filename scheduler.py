@@ -1,291 +1,340 @@
+"""Воркер публикации запланированных постов.
+
+`PostScheduler` работает внутри процесса бота (PUBLISHER_MODE=inprocess) или
+отдельным процессом: `python scheduler.py` (у бота PUBLISHER_MODE=external).
+Бот и воркер общаются только через общую базу: посты забираются в аренду
+(`claim_due_posts`), поэтому воркеров может быть несколько, а длинная волна
+публикаций не задерживает обработку команд. Чтобы новые посты попадали в
+очередь сразу, а не при следующей сверке с БД, бот шлёт воркеру
+UDP-уведомления (`PublishNotifier`); потерянное уведомление лишь
+откладывает пост до сверки. Адрес уведомлений слушает один воркер на
+хосте; остальные воркеры запускаются без него и находят посты сверкой.
+"""
+import asyncio
+import json
 import logging
-from telegram import Update, BotCommand
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackContext
-from datetime import datetime, timedelta
-import re
-import psutil
 import os
+import signal
+import socket
+import time
+import traceback
+import uuid
 
-from config import BOT_TOKEN, ADMIN_IDS, MOSCOW_TZ
-from database import Database
-from scheduler import PostScheduler
-
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-class SchedulerBot:
-    def __init__(self):
-        self.db = Database('scheduler.db')
-        self.scheduler = PostScheduler(BOT_TOKEN, 'scheduler.db')
-        self.user_states = {}
-        self.start_time = datetime.now(MOSCOW_TZ)
-    
-    async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
-        
-        if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ У вас нет доступа к этому боту")
-            return
-        
-        commands = [
-            BotCommand("start", "Запуск бота"),
-            BotCommand("status", "Статус бота и время"),
-            BotCommand("add_channel", "Добавить канал"),
-            BotCommand("channels", "Список каналов"),
-            BotCommand("add_post", "Добавить публикацию"),
-            BotCommand("posts", "Список публикаций"),
-        ]
-        
-        await context.bot.set_my_commands(commands)
-        
-        current_time = datetime.now(MOSCOW_TZ).strftime('%d.%m.%Y %H:%M:%S')
-        
-        await update.message.reply_text(
-            f"📅 **Бот-планировщик публикаций**\n\n"
-            f"⏰ Текущее время по Москве: {current_time}\n\n"
-            "Доступные команды:\n"
-            "/status - Статус бота и время\n"
-            "/add_channel - Добавить канал\n"
-            "/channels - Список каналов\n"
-            "/add_post - Добавить публикацию\n"
-            "/posts - Список публикаций"
+from aiohttp import web
+from telegram import Bot
+
+from config import (
+    BOT_TOKEN, CATCHUP_THRESHOLD, DB_NAME, METRICS_PATH,
+    PUBLISH_RECONCILE_INTERVAL, PUBLISH_LEASE_SECONDS, PUBLISH_CLAIM_BATCH,
+    PUBLISHER_NOTIFY_ADDR, PUBLISHER_METRICS_PORT
+)
+from archive import PostArchiver
+from async_database import AsyncDatabase
+from catchup import CatchupPolicy
+from metrics import REGISTRY, Gauge, PUBLISH_DELAY, metrics_handler
+from publish_queue import PublishQueue
+from publisher import PublishDispatcher, PublishedBuffer, build_send_request, next_retry_time
+from recurrence import RecurringExpander
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Служебная запись очереди: повторная попытка забрать посты, не влезшие в лимит аренды
+CLAIM_RECHECK_ID = 0
+# Пауза перед повтором после ошибки в цикле публикации (например, database is locked)
+LOOP_ERROR_RETRY_DELAY = 5
+
+
+def parse_address(addr):
+    host, _, port = addr.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class PostScheduler:
+    """Очередь публикаций в памяти и отправка наступивших постов.
+
+    `on_change` вызывается, когда посты публикуются или окончательно
+    падают (бот сбрасывает по нему кэш /status).
+    """
+
+    def __init__(self, db, on_change=None):
+        self.db = db
+        self.on_change = on_change
+        self.bot = None
+        self.publish_queue = PublishQueue()
+        self.dispatcher = PublishDispatcher()
+        self.published_buffer = PublishedBuffer(self.save_published)
+        self.recurring = RecurringExpander(db)
+        self.catchup = CatchupPolicy(db)
+        self.archiver = PostArchiver(db)
+        self.publishing = set()
+        self._publish_tasks = set()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task = None
+        self._archive_task = None
+        self._heartbeat_task = None
+        self._notify_transport = None
+
+    def add_new_post(self, post_id, publish_time):
+        self.publish_queue.push(post_id, publish_time)
+
+    def discard_post(self, post_id):
+        self.publish_queue.discard(post_id)
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    async def start(self, bot, notify_addr=None):
+        """Запускает цикл публикации; с `notify_addr` ещё и приём UDP-уведомлений."""
+        self.bot = bot
+        if notify_addr:
+            loop = asyncio.get_running_loop()
+            try:
+                self._notify_transport, _ = await loop.create_datagram_endpoint(
+                    lambda: NotifyProtocol(self), local_addr=parse_address(notify_addr)
+                )
+                logging.info(f"Publisher notify channel listening on {notify_addr}")
+            except OSError as e:
+                # Адрес уже занят другим воркером на этом хосте: уведомления получает он,
+                # а этот воркер находит новые посты при сверке с БД
+                logging.warning(f"Publisher notify channel unavailable on {notify_addr}, relying on reconcile: {e}")
+        self._task = asyncio.create_task(self.run())
+        self._archive_task = asyncio.create_task(self.archiver.run())
+        self._heartbeat_task = asyncio.create_task(self.renew_leases())
+        logging.info(f"Publisher {self.worker_id} started.")
+
+    async def stop(self):
+        for task in (self._task, self._archive_task, self._heartbeat_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        if self._notify_transport:
+            self._notify_transport.close()
+
+        # Незавершённые отправки отменяются, их посты сразу возвращаются в очередь,
+        # а не ждут истечения аренды; уже отправленные сохраняются сбросом буфера
+        unsent = self.publishing - self.published_buffer.post_ids()
+        for task in self._publish_tasks:
+            task.cancel()
+        await asyncio.gather(*self._publish_tasks, return_exceptions=True)
+        if unsent:
+            await self.db.release_leases(self.worker_id, unsent)
+            logging.info(f"Released {len(unsent)} unsent posts back to the queue.")
+        await self.published_buffer.flush()
+        logging.info("Publisher stopped.")
+
+    async def expand_recurring_posts(self):
+        added = await self.recurring.expand()
+        for post_id, publish_time in added:
+            self.publish_queue.push(post_id, publish_time)
+
+    async def reconcile_publish_queue(self, catchup=False):
+        """Пересобирает очередь публикаций из БД, исправляя возможный дрейф.
+
+        С `catchup` посты, просроченные за время простоя, сначала пропускаются
+        или растягиваются по политике CATCHUP_POLICY.
+        """
+        # Вхождения повторяющихся постов создаются заранее, на RECURRING_LOOKAHEAD вперёд
+        await self.expand_recurring_posts()
+        if catchup:
+            skipped, _ = await self.catchup.apply()
+            if skipped:
+                self._changed()
+        pending = await self.db.get_pending_post_times()
+        self.publish_queue.replace_all(
+            (post_id, max(publish_time, next_attempt_at or 0))
+            for post_id, publish_time, next_attempt_at in pending
         )
-    
-    async def show_status(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показывает статус бота, время и статистику"""
-        user_id = update.effective_user.id
-        if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ У вас нет доступа")
-            return
-        
+        logging.info(f"Publish queue reconciled: {len(self.publish_queue)} pending posts.")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        last_reconcile = None
+        last_reconcile_at = None
+        due_ids = []
+        while True:
+            try:
+                if last_reconcile is None or loop.time() - last_reconcile >= PUBLISH_RECONCILE_INTERVAL:
+                    # Догоняющая публикация - только после простоя: при первой сверке после
+                    # запуска или если сверка опоздала (процесс стоял); обычная очередь
+                    # постов, ждущих лимитов Telegram, простоем не считается
+                    catchup = (last_reconcile_at is None
+                               or time.time() - last_reconcile_at > PUBLISH_RECONCILE_INTERVAL + CATCHUP_THRESHOLD)
+                    # Сверка с БД заодно подхватывает посты, добавленные другими процессами
+                    await self.reconcile_publish_queue(catchup)
+                    last_reconcile = loop.time()
+                    last_reconcile_at = time.time()
+                if due_ids:
+                    await self.dispatch_due_posts()
+            except Exception:
+                # Ошибка одного прохода не должна останавливать публикацию: повторяем через паузу
+                logging.exception("Publisher loop iteration failed")
+                self.publish_queue.push(CLAIM_RECHECK_ID, time.time() + LOOP_ERROR_RETRY_DELAY)
+            due_ids = await self.publish_queue.wait_due(timeout=PUBLISH_RECONCILE_INTERVAL)
+
+    async def dispatch_due_posts(self):
+        """Забирает наступившие посты в аренду пачками и отправляет их.
+
+        Берётся не больше, чем диспетчер успеет отправить за время аренды
+        (и не больше этого на канал), так что остальное достаётся другим
+        воркерам или следующему проходу.
+        """
+        dispatched = 0
+        total, per_chat = self.dispatcher.claim_budget(PUBLISH_LEASE_SECONDS, len(self.publishing))
+        while total > 0:
+            batch = min(PUBLISH_CLAIM_BATCH, total)
+            posts = await self.db.claim_due_posts(self.worker_id, PUBLISH_LEASE_SECONDS, batch, per_chat)
+            for post in posts:
+                # Пост, чья аренда истекла, пока он ждал лимитов, уже отправляется этим воркером
+                if post[0] in self.publishing:
+                    continue
+                self.publishing.add(post[0])
+                task = asyncio.create_task(self.publish_post(post))
+                self._publish_tasks.add(task)
+                task.add_done_callback(self._publish_tasks.discard)
+                dispatched += 1
+            total -= len(posts)
+            if len(posts) < batch:
+                break
+        if self.publishing:
+            # Пока идут отправки, у каналов освобождается место: проверяем остаток через один токен канала
+            self.publish_queue.push(CLAIM_RECHECK_ID, time.time() + PUBLISH_LEASE_SECONDS / per_chat)
+        if dispatched:
+            logging.info(f"Dispatched {dispatched} posts, publisher metrics: {self.dispatcher.metrics.snapshot()}")
+
+    async def renew_leases(self):
+        """Heartbeat: продлевает аренду постов, которые ещё ждут лимитов Telegram."""
+        while True:
+            await asyncio.sleep(PUBLISH_LEASE_SECONDS / 3)
+            if self.publishing:
+                try:
+                    await self.db.renew_leases(self.worker_id, list(self.publishing), PUBLISH_LEASE_SECONDS)
+                except Exception:
+                    logging.exception("Failed to renew publish leases")
+
+    async def save_published(self, results):
+        await self.db.mark_published(results, self.worker_id)
+        self._changed()
+
+    async def publish_post(self, post):
+        post_id, user_id, channel_id, text, media_ids_str, attempts, publish_time = post
         try:
-            # Текущее время по Москве
-            current_time = datetime.now(MOSCOW_TZ)
-            current_time_str = current_time.strftime('%d.%m.%Y %H:%M:%S')
-            
-            # Время работы бота
-            uptime = current_time - self.start_time
-            hours, remainder = divmod(uptime.total_seconds(), 3600)
-            minutes, seconds = divmod(remainder, 60)
-            uptime_str = f"{int(hours)}ч {int(minutes)}м {int(seconds)}с"
-            
-            # Статистика из базы данных
-            channels = self.db.get_channels()
-            posts = self.db.get_scheduled_posts()
-            
-            # Количество запланированных публикаций
-            scheduled_count = len(posts)
-            
-            # Ближайшая публикация
-            next_post_time = "Нет запланированных"
-            if posts:
-                next_post = min(posts, key=lambda x: datetime.strptime(x[5], '%Y-%m-%d %H:%M:%S'))
-                next_time = datetime.strptime(next_post[5], '%Y-%m-%d %H:%M:%S')
-                next_post_time = MOSCOW_TZ.localize(next_time).strftime('%d.%m.%Y %H:%M')
-            
-            # Статус сообщение
-            status_message = (
-                f"🤖 **СТАТУС БОТА**\n\n"
-                f"⏰ **Текущее время:** {current_time_str} (МСК)\n"
-                f"🕐 **Время работы:** {uptime_str}\n"
-                f"📊 **Каналов подключено:** {len(channels)}\n"
-                f"📅 **Запланировано публикаций:** {scheduled_count}\n"
-                f"⏱ **Ближайшая публикация:** {next_post_time}\n"
-                f"🟢 **Статус:** Активен\n\n"
-                f"_Последнее обновление: {current_time.strftime('%H:%M:%S')}_"
-            )
-            
-            await update.message.reply_text(status_message, parse_mode='Markdown')
-            
+            request = build_send_request(self.bot, channel_id, text, media_ids_str)
+            message = await self.dispatcher.send(channel_id, request)
+            if message:
+                # send_media_group возвращает все сообщения альбома, храним id первого
+                if isinstance(message, (list, tuple)):
+                    message = message[0]
+                await self.published_buffer.add(post_id, message.message_id)
+                PUBLISH_DELAY.observe(max(0.0, time.time() - publish_time))
+                logging.info(f"Post {post_id} published.")
         except Exception as e:
-            logging.error(f"Error in status command: {e}")
-            await update.message.reply_text("❌ Ошибка при получении статуса")
-    
-    async def add_channel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
-        if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ У вас нет доступа")
-            return
-        
-        await update.message.reply_text(
-            "📝 **Добавление канала**\n\n"
-            "1. Добавьте бота в канал как администратора\n"
-            "2. Дайте боту право на публикацию сообщений\n"
-            "3. Перешлите любое сообщение из канала в этот чат"
-        )
-        self.user_states[user_id] = 'awaiting_channel'
-    
-    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
-        
-        if user_id not in ADMIN_IDS:
-            return
-        
-        # Обработка пересланного сообщения для добавления канала
-        if self.user_states.get(user_id) == 'awaiting_channel' and update.message.forward_from_chat:
-            channel = update.message.forward_from_chat
-            
-            if channel.type == 'channel':
-                success = self.db.add_channel(
-                    channel.id,
-                    channel.title,
-                    channel.username
-                )
-                
-                if success:
-                    await update.message.reply_text(
-                        f"✅ Канал **{channel.title}** успешно добавлен!",
-                        parse_mode='Markdown'
-                    )
-                else:
-                    await update.message.reply_text("❌ Ошибка при добавлении канала")
-                
-                self.user_states[user_id] = None
-                return
-        
-        # Обработка добавления поста
-        if self.user_states.get(user_id) == 'awaiting_post_content':
-            context.user_data['post_content'] = update.message.text
-            context.user_data['media_type'] = 'text'
-            
-            current_time = datetime.now(MOSCOW_TZ).strftime('%d.%m.%Y %H:%M')
-            await update.message.reply_text(
-                f"⏰ **Укажите время публикации по Москве**\n\n"
-                f"Сейчас: {current_time} (МСК)\n\n"
-                "Формат: `ГГГГ-ММ-ДД ЧЧ:ММ`\n"
-                "Пример: `2024-12-25 15:30`",
-                parse_mode='Markdown'
-            )
-            self.user_states[user_id] = 'awaiting_post_time'
+            attempts += 1
+            retry_at = next_retry_time(attempts, e)
+            await self.db.record_publish_failure(post_id, self.worker_id, f"{type(e).__name__}: {e}"[:500], retry_at)
+            if retry_at is None:
+                self._changed()
+                logging.error(f"Post {post_id} failed permanently after {attempts} attempts: {traceback.format_exc()}")
+            else:
+                logging.warning(f"Error publishing post {post_id} (attempt {attempts}), retry at {retry_at:.0f}: {e}")
+                self.publish_queue.push(post_id, retry_at)
+        finally:
+            self.publishing.discard(post_id)
+
+
+class NotifyProtocol(asyncio.DatagramProtocol):
+    """Принимает уведомления PublishNotifier: {"op": "add"|"discard", "id": ..., "time": ...}."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    def datagram_received(self, data, addr):
+        try:
+            message = json.loads(data)
+            if message['op'] == 'add':
+                self.scheduler.add_new_post(int(message['id']), float(message['time']))
+            elif message['op'] == 'discard':
+                self.scheduler.discard_post(int(message['id']))
+        except (ValueError, KeyError, TypeError):
+            logging.warning(f"Ignoring malformed publisher notification from {addr}: {data[:200]!r}")
+
+
+class PublishNotifier:
+    """Сторона бота при отдельном воркере: тот же интерфейс, что у PostScheduler.
+
+    Уведомления - неблокирующие UDP-датаграммы на localhost; если воркер
+    не запущен или датаграмма потеряна, пост подхватит сверка с БД.
+    """
+
+    def __init__(self, notify_addr=PUBLISHER_NOTIFY_ADDR):
+        self._addr = parse_address(notify_addr) if notify_addr else None
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+
+    def _send(self, message):
+        if self._addr is None:
             return
-        
-        if self.user_states.get(user_id) == 'awaiting_post_time':
+        try:
+            self._sock.sendto(json.dumps(message).encode(), self._addr)
+        except OSError as e:
+            logging.warning(f"Publisher notification failed, post will be picked up on reconcile: {e}")
+
+    def add_new_post(self, post_id, publish_time):
+        self._send({'op': 'add', 'id': post_id, 'time': publish_time})
+
+    def discard_post(self, post_id):
+        self._send({'op': 'discard', 'id': post_id})
+
+    async def stop(self):
+        self._sock.close()
+
+
+def register_publisher_gauges(scheduler):
+    # Размеры очередей считываются в момент запроса /metrics
+    REGISTRY.register(Gauge('bot_publish_queue_size', 'Posts waiting in the in-memory publish queue.', lambda: len(scheduler.publish_queue)))
+    REGISTRY.register(Gauge('bot_publish_in_flight', 'Bot API send requests in flight.', lambda: scheduler.dispatcher.metrics.in_flight))
+    REGISTRY.register(Gauge('bot_publish_waiting', 'Sends waiting for rate limits.', lambda: scheduler.dispatcher.metrics.queue_depth))
+
+
+async def run_worker(token=BOT_TOKEN, db_name=DB_NAME, notify_addr=PUBLISHER_NOTIFY_ADDR,
+                     metrics_port=PUBLISHER_METRICS_PORT, base_url=None, stop_event=None):
+    """Отдельный процесс публикации: работает до `stop_event` или сигнала."""
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
             try:
-                # Парсим введенное время как московское
-                naive_time = datetime.strptime(update.message.text, '%Y-%m-%d %H:%M')
-                moscow_time = MOSCOW_TZ.localize(naive_time)
-                current_moscow_time = datetime.now(MOSCOW_TZ)
-                
-                if moscow_time <= current_moscow_time:
-                    await update.message.reply_text("❌ Время должно быть в будущем!")
-                    return
-                
-                # Получаем данные из контекста
-                channel_id = context.user_data.get('selected_channel')
-                message_text = context.user_data.get('post_content', '')
-                media_type = context.user_data.get('media_type', 'text')
-                media_file_id = context.user_data.get('media_file_id', '')
-                
-                # Сохраняем время в формате для БД
-                scheduled_time_str = moscow_time.strftime('%Y-%m-%d %H:%M:%S')
-                
-                # Добавляем пост в планировщик
-                success = self.scheduler.add_new_post(
-                    channel_id, message_text, media_type, media_file_id, scheduled_time_str
-                )
-                
-                if success:
-                    formatted_time = moscow_time.strftime('%d.%m.%Y %H:%M')
-                    await update.message.reply_text(
-                        f"✅ Публикация запланирована на {formatted_time} (МСК)"
-                    )
-                else:
-                    await update.message.reply_text("❌ Ошибка при планировании публикации")
-                
-                # Очищаем состояние
-                self.user_states[user_id] = None
-                context.user_data.clear()
-                
-            except ValueError:
-                await update.message.reply_text("❌ Неверный формат времени! Используйте: ГГГГ-ММ-ДД ЧЧ:ММ")
-    
-    async def list_channels(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
-        if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ У вас нет доступа")
-            return
-        
-        channels = self.db.get_channels()
-        
-        if not channels:
-            await update.message.reply_text("📭 Каналы не добавлены")
-            return
-        
-        message = "📋 **Список каналов:**\n\n"
-        for channel in channels:
-            message += f"• {channel[2]} (@{channel[3]})\n"
-        
-        await update.message.reply_text(message, parse_mode='Markdown')
-    
-    async def add_post(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
-        if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ У вас нет доступа")
-            return
-        
-        channels = self.db.get_channels()
-        
-        if not channels:
-            await update.message.reply_text("❌ Сначала добавьте канал через /add_channel")
-            return
-        
-        current_time = datetime.now(MOSCOW_TZ).strftime('%d.%m.%Y %H:%M')
-        await update.message.reply_text(
-            f"📝 **Добавление публикации**\n\n"
-            f"⏰ Текущее время: {current_time} (МСК)\n\n"
-            "Отправьте текст публикации:"
-        )
-        
-        self.user_states[user_id] = 'awaiting_post_content'
-        # Сохраняем первый канал (можно улучшить выбор)
-        context.user_data['selected_channel'] = channels[0][0]
-    
-    async def list_posts(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
-        if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ У вас нет доступа")
-            return
-        
-        posts = self.db.get_scheduled_posts()
-        
-        if not posts:
-            await update.message.reply_text("📭 Нет запланированных публикаций")
-            return
-        
-        current_time = datetime.now(MOSCOW_TZ)
-        message = f"📋 **Запланированные публикации** (МСК):\n\n"
-        
-        for post in posts:
-            post_time = datetime.strptime(post[5], '%Y-%m-%d %H:%M:%S')
-            moscow_time = MOSCOW_TZ.localize(post_time)
-            time_str = moscow_time.strftime('%d.%m.%Y %H:%M')
-            message += f"• {time_str} - {post[9]}\n"
-        
-        await update.message.reply_text(message, parse_mode='Markdown')
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+
+    db = AsyncDatabase(db_name)
+    scheduler = PostScheduler(db)
+    register_publisher_gauges(scheduler)
+    runner = None
+    bot = Bot(token, base_url=base_url) if base_url else Bot(token)
+    async with bot:
+        try:
+            if metrics_port:
+                app_web = web.Application()
+                app_web.router.add_get(METRICS_PATH, metrics_handler)
+                runner = web.AppRunner(app_web)
+                await runner.setup()
+                await web.TCPSite(runner, '0.0.0.0', metrics_port).start()
+            await scheduler.start(bot, notify_addr)
+            await stop_event.wait()
+        finally:
+            await scheduler.stop()
+            if runner:
+                await runner.cleanup()
+            await db.close()
+
 
 def main():
-    bot = SchedulerBot()
-    
-    application = Application.builder().token(BOT_TOKEN).build()
-    
-    # Обработчики команд
-    application.add_handler(CommandHandler("start", bot.start))
-    application.add_handler(CommandHandler("status", bot.show_status))
-    application.add_handler(CommandHandler("add_channel", bot.add_channel))
-    application.add_handler(CommandHandler("channels", bot.list_channels))
-    application.add_handler(CommandHandler("add_post", bot.add_post))
-    application.add_handler(CommandHandler("posts", bot.list_posts))
-    
-    # Обработчик сообщений
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_message))
-    
-    # Запуск бота
-    current_time = datetime.now(MOSCOW_TZ).strftime('%d.%m.%Y %H:%M:%S')
-    print(f"🤖 Бот запущен...")
-    print(f"⏰ Текущее время по Москве: {current_time}")
-    print(f"📊 Для проверки статуса используйте команду /status")
-    application.run_polling()
+    asyncio.run(run_worker())
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,92 @@
+import collections
+import time
+
+from config import STATE_BACKEND, STATE_TTL, STATE_MAX_ENTRIES
+
+# Раз в столько записей SQLite-хранилище удаляет устаревшие и лишние состояния
+STATE_PRUNE_EVERY = 200
+
+
+class MemoryStateStore:
+    """Состояние диалогов в памяти с TTL и LRU-ограничением числа записей.
+
+    Брошенные диалоги удаляются по истечении `ttl` секунд с последней
+    записи, при превышении `max_entries` вытесняются давно не используемые.
+    """
+
+    def __init__(self, ttl=STATE_TTL, max_entries=STATE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_cached(self, key):
+        """Возвращает (найдено, значение) без обращения к внешнему хранилищу."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def put(self, key, value, expires_at=None):
+        self._entries[key] = (expires_at or time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key, default=None):
+        found, value = self.get_cached(key)
+        return value if found else default
+
+    async def set(self, key, value):
+        self.put(key, value)
+
+    async def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[0] <= time.time():
+            return default
+        return entry[1]
+
+
+class SQLiteStateStore:
+    """Состояние диалогов в таблице conversation_state.
+
+    Каждое чтение идёт в БД (поиск по первичному ключу в потоке-читателе),
+    запись - одна короткая upsert-операция, поэтому состояние переживает
+    перезапуск, а реплики на общей базе видят одно и то же состояние:
+    локального кэша, который мог бы устареть, нет. `db` - экземпляр
+    `AsyncDatabase`.
+    """
+
+    def __init__(self, db, namespace, ttl=STATE_TTL, max_entries=STATE_MAX_ENTRIES):
+        self.db = db
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._writes = 0
+
+    async def get(self, key, default=None):
+        row = await self.db.get_state(self.namespace, key)
+        return default if row is None else row[0]
+
+    async def set(self, key, value):
+        await self.db.set_state(self.namespace, key, value, time.time() + self.ttl)
+        self._writes += 1
+        if self._writes % STATE_PRUNE_EVERY == 0:
+            await self.db.prune_states(self.namespace, self.max_entries)
+
+    async def pop(self, key, default=None):
+        value = await self.db.pop_state(self.namespace, key)
+        return default if value is None else value
+
+
+def create_state_store(db, namespace, backend=STATE_BACKEND):
+    if backend == 'sqlite':
+        return SQLiteStateStore(db, namespace)
+    return MemoryStateStore()
@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+from config import STATUS_CACHE_TTL
+
+
+class StatsService:
+    """Счётчики для /status: каналы, ожидающие посты и ближайшая публикация.
+
+    Значения берутся одним COUNT/MIN-запросом и кэшируются на `ttl` секунд.
+    Добавление, удаление и публикация постов сбрасывают кэш через
+    `invalidate()`, так что после изменений /status сразу видит свежие данные.
+    """
+
+    def __init__(self, db, ttl=STATUS_CACHE_TTL):
+        self.db = db
+        self.ttl = ttl
+        self._stats = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._expires_at = 0.0
+
+    async def get(self):
+        """Возвращает {'channels', 'scheduled', 'next_publish_time'}."""
+        if time.monotonic() < self._expires_at:
+            return self._stats
+        # Одновременные /status после сброса кэша делают один запрос
+        async with self._lock:
+            if time.monotonic() >= self._expires_at:
+                expires_at = time.monotonic() + self.ttl
+                channels, scheduled, next_publish_time = await self.db.get_status_counters()
+                self._stats = {
+                    'channels': channels,
+                    'scheduled': scheduled,
+                    'next_publish_time': next_publish_time,
+                }
+                self._expires_at = expires_at
+        return self._stats
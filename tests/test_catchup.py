@@ -0,0 +1,96 @@
+"""Догоняющая публикация: план по каждой политике и запуск только после простоя."""
+import asyncio
+import types
+
+import pytest
+
+import scheduler as scheduler_module
+from catchup import CATCHUP_POLICIES, CatchupPolicy, plan_catchup
+
+NOW = 1_000_000
+# (post_id, channel_id, publish_time): канал -1 опоздал на 2 ч, 30 и 10 мин, канал -2 - на 20 мин
+OVERDUE = [
+    (1, -1, NOW - 7200),
+    (2, -1, NOW - 1800),
+    (3, -2, NOW - 1200),
+    (4, -1, NOW - 600),
+]
+
+
+@pytest.mark.parametrize('policy, skipped, deferred', [
+    ('none', [], []),
+    ('drop', [1], []),
+    ('latest', [1, 2], []),
+    ('spread', [], [(NOW, 1), (NOW + 150, 2), (NOW + 300, 3), (NOW + 450, 4)]),
+])
+def test_plan_catchup(policy, skipped, deferred):
+    assert plan_catchup(OVERDUE, NOW, policy, max_age=3600, window=600) == (skipped, deferred)
+
+
+class CatchupDb:
+    def __init__(self, overdue):
+        self.overdue = overdue
+        self.overdue_before = None
+        self.applied = None
+
+    async def get_overdue_posts(self, before):
+        self.overdue_before = before
+        return [post for post in self.overdue if post[2] < before]
+
+    async def apply_catchup(self, skipped, deferred):
+        self.applied = (skipped, deferred)
+
+
+@pytest.mark.parametrize('policy', CATCHUP_POLICIES)
+def test_catchup_policy_apply(policy):
+    db = CatchupDb(OVERDUE)
+    catchup = CatchupPolicy(db, policy, threshold=900, max_age=3600, window=600)
+    result = asyncio.run(catchup.apply(now=NOW))
+    if policy == 'none':
+        assert result == ([], []) and db.applied is None
+        return
+    # Пост, опоздавший на 10 мин, - в пределах порога и в план не попадает
+    assert db.overdue_before == NOW - 900
+    assert db.applied == result == plan_catchup(OVERDUE[:3], NOW, policy, 3600, 600)
+
+
+def test_unknown_policy_rejected():
+    with pytest.raises(ValueError):
+        CatchupPolicy(CatchupDb([]), 'skip-all')
+
+
+def _reconcile_calls(monkeypatch, clock_jumps):
+    """Флаги catchup первых сверок цикла; после i-й сверки часы уходят вперёд на clock_jumps[i] секунд."""
+    monkeypatch.setattr(scheduler_module, 'PUBLISH_RECONCILE_INTERVAL', 0.05)
+    clock = [float(NOW)]
+    monkeypatch.setattr(scheduler_module, 'time', types.SimpleNamespace(time=lambda: clock[0]))
+
+    async def scenario():
+        worker = scheduler_module.PostScheduler(db=None)
+        calls = []
+
+        async def reconcile(catchup=False):
+            calls.append(catchup)
+
+        worker.reconcile_publish_queue = reconcile
+        task = asyncio.create_task(worker.run())
+        seen = 0
+        while len(calls) <= len(clock_jumps):
+            # Цикл публикации ждёт следующей сверки - двигаем часы между сверками
+            if len(calls) > seen:
+                clock[0] += clock_jumps[seen]
+                seen += 1
+            await asyncio.sleep(0.01)
+        task.cancel()
+        return calls[:len(clock_jumps) + 1]
+
+    return asyncio.run(scenario())
+
+
+def test_catchup_runs_only_on_first_reconcile(monkeypatch):
+    assert _reconcile_calls(monkeypatch, [0.05, 0.05, 0.05]) == [True, False, False, False]
+
+
+def test_catchup_runs_after_a_stall(monkeypatch):
+    stall = 0.05 + scheduler_module.CATCHUP_THRESHOLD + 1
+    assert _reconcile_calls(monkeypatch, [0.05, stall, 0.05]) == [True, False, True, False]
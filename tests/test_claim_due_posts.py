@@ -0,0 +1,85 @@
+"""Аренда постов: несколько воркеров на одной базе не публикуют пост дважды."""
+import multiprocessing
+import time
+
+import pytest
+
+from database import Database
+
+WORKERS = 4
+POSTS = 400
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'claim.db')
+
+
+def _add_due_posts(db_path, count, channels=20):
+    db = Database(db_path)
+    past = int(time.time()) - 60
+    added = db.add_posts([(1, -100 - i % channels, f'post {i}', '[]', past) for i in range(count)])
+    db.close()
+    return [post_id for post_id, _ in added]
+
+
+def _claim_all(db_path, owner, barrier, results):
+    db = Database(db_path)
+    barrier.wait()
+    claimed = []
+    while True:
+        posts = db.claim_due_posts(owner, 600, 7)
+        if not posts:
+            break
+        claimed += [post[0] for post in posts]
+    db.close()
+    results.put(claimed)
+
+
+def test_processes_claim_each_post_once(db_path):
+    post_ids = _add_due_posts(db_path, POSTS)
+    ctx = multiprocessing.get_context('fork')
+    barrier = ctx.Barrier(WORKERS)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_claim_all, args=(db_path, f'worker-{i}', barrier, results)) for i in range(WORKERS)]
+    for worker in workers:
+        worker.start()
+    claimed = [post_id for _ in workers for post_id in results.get(timeout=60)]
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+
+    assert len(claimed) == len(set(claimed))
+    assert sorted(claimed) == sorted(post_ids)
+
+
+def test_per_chat_limit_counts_leases_of_all_workers(db_path):
+    _add_due_posts(db_path, 10, channels=1)
+    db = Database(db_path)
+    assert len(db.claim_due_posts('a', 600, 100, per_chat_limit=3)) == 3
+    assert db.claim_due_posts('b', 600, 100, per_chat_limit=3) == []
+    db.close()
+
+
+def test_expired_lease_is_reclaimed_and_old_owner_cannot_finish(db_path):
+    post_id, = _add_due_posts(db_path, 1)
+    db = Database(db_path)
+    assert [post[0] for post in db.claim_due_posts('a', -1, 10)] == [post_id]
+    assert [post[0] for post in db.claim_due_posts('b', 600, 10)] == [post_id]
+
+    db.mark_published([(post_id, 1)], 'a')
+    assert db.get_connection().execute('SELECT status, lease_owner FROM posts WHERE id = ?', (post_id,)).fetchone() == ('publishing', 'b')
+
+    db.mark_published([(post_id, 1)], 'b')
+    assert db.get_connection().execute('SELECT status FROM posts WHERE id = ?', (post_id,)).fetchone() == ('published',)
+    db.close()
+
+
+def test_renewed_lease_is_not_reclaimed(db_path):
+    _add_due_posts(db_path, 1)
+    db = Database(db_path)
+    post_id = db.claim_due_posts('a', 1, 10)[0][0]
+    db.renew_leases('a', [post_id], 600)
+    time.sleep(1.1)
+    assert db.claim_due_posts('b', 600, 10) == []
+    db.close()
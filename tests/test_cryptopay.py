@@ -0,0 +1,71 @@
+"""Клиент CryptoPay: разбор ответов API и автомат CircuitBreaker."""
+import asyncio
+
+import httpx
+import pytest
+
+from cryptopay import CircuitBreaker, CryptoPayClient, CryptoPayError
+
+
+def _create_invoice(response):
+    async def scenario():
+        client = CryptoPayClient(token='test', base_url='http://cryptopay.test')
+        await client._client.aclose()
+        client._client = httpx.AsyncClient(
+            base_url='http://cryptopay.test', transport=httpx.MockTransport(lambda request: response)
+        )
+        try:
+            return await client.create_invoice(5, 'test', 'order-1')
+        finally:
+            await client.close()
+
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('response', [
+    httpx.Response(200, text='<html>Bad Gateway</html>'),
+    httpx.Response(400, text=''),
+    httpx.Response(200, json=['not', 'an', 'object']),
+    httpx.Response(400, json={'ok': False, 'error': {'name': 'AMOUNT_TOO_SMALL'}}),
+])
+def test_bad_response_raises_cryptopay_error(response):
+    with pytest.raises(CryptoPayError):
+        _create_invoice(response)
+
+
+def test_ok_response_returns_result():
+    assert _create_invoice(httpx.Response(200, json={'ok': True, 'result': {'invoice_id': 1}})) == {'invoice_id': 1}
+
+
+def test_half_open_breaker_lets_one_trial_through(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('cryptopay.time.monotonic', lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now[0] = 30.0
+    assert [breaker.allow() for _ in range(5)] == [True, False, False, False, False]
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+
+    now[0] = 60.0
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert all(breaker.allow() for _ in range(5))
+
+
+def test_lost_trial_expires(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('cryptopay.time.monotonic', lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    now[0] = 30.0
+    assert breaker.allow()
+    # Пробный запрос отменён и не сообщил результат
+    now[0] = 59.0
+    assert not breaker.allow()
+    now[0] = 60.0
+    assert breaker.allow()
@@ -0,0 +1,38 @@
+"""auto_vacuum = INCREMENTAL: сразу у новой базы, у старой - только явным обслуживанием."""
+import sqlite3
+
+from database import Database
+
+
+def _auto_vacuum(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_new_database_is_incremental(tmp_path):
+    path = str(tmp_path / 'new.db')
+    Database(path).close()
+    assert _auto_vacuum(path) == 2
+
+
+def test_existing_database_is_converted_only_explicitly(tmp_path):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT)')
+    conn.execute("INSERT INTO users (id, username) VALUES (1, 'old')")
+    conn.commit()
+    conn.close()
+
+    # Открытие базы (в каждом процессе бота) не переписывает файл VACUUM'ом
+    db = Database(path)
+    Database(path).close()
+    assert _auto_vacuum(path) == 0
+
+    assert db.enable_incremental_vacuum() is True
+    assert db.enable_incremental_vacuum() is False
+    assert _auto_vacuum(path) == 2
+    assert db.get_user(1)[1] == 'old'
+    db.close()
@@ -0,0 +1,21 @@
+"""Backoff повторных публикаций: задержка не меньше PUBLISH_RETRY_BASE_DELAY."""
+import random
+
+import pytest
+from telegram.error import NetworkError
+
+from config import PUBLISH_MAX_ATTEMPTS, PUBLISH_RETRY_BASE_DELAY, PUBLISH_RETRY_MAX_DELAY
+from publisher import next_retry_time
+
+
+@pytest.mark.parametrize('attempts', range(1, PUBLISH_MAX_ATTEMPTS))
+@pytest.mark.parametrize('jitter', [0.0, 1.0])
+def test_retry_delay_bounds(monkeypatch, attempts, jitter):
+    monkeypatch.setattr(random, 'uniform', lambda low, high: low + (high - low) * jitter)
+    delay = next_retry_time(attempts, NetworkError('timeout'), now=1000.0) - 1000.0
+    ceiling = max(PUBLISH_RETRY_BASE_DELAY, min(PUBLISH_RETRY_MAX_DELAY, PUBLISH_RETRY_BASE_DELAY * 2 ** (attempts - 1)))
+    assert delay == (ceiling if jitter else PUBLISH_RETRY_BASE_DELAY)
+
+
+def test_gives_up_after_max_attempts():
+    assert next_retry_time(PUBLISH_MAX_ATTEMPTS, NetworkError('timeout')) is None
@@ -0,0 +1,45 @@
+"""Горячие запросы идут по индексам миграции 1 и 3 (EXPLAIN QUERY PLAN)."""
+import time
+
+import pytest
+
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'plans.db'))
+    db.add_channel(1, -100, 'Канал')
+    past = int(time.time()) - 60
+    db.add_posts([(1, -100, f'post {i}', '[]', past + i) for i in range(20)])
+    yield db
+    db.close()
+
+
+def query_plan(db, call):
+    """Планы всех запросов, выполненных `call(db)`, одной строкой."""
+    conn = db.get_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        call(db)
+    finally:
+        conn.set_trace_callback(None)
+    plans = []
+    for sql in statements:
+        if sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+            plans += [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+    assert plans, "method executed no queries"
+    return '\n'.join(plans)
+
+
+@pytest.mark.parametrize('call, index', [
+    (lambda db: db.get_posts_to_publish(), 'idx_posts_due'),
+    (lambda db: db.claim_due_posts('worker', 600, 10), 'idx_posts_due'),
+    (lambda db: db.get_user_posts(1), 'idx_posts_user_publish_time'),
+    (lambda db: db.get_user_channels(1), 'idx_channels_user'),
+])
+def test_hot_query_uses_index(db, call, index):
+    plan = query_plan(db, call)
+    assert f'USING INDEX {index}' in plan or f'USING COVERING INDEX {index}' in plan, plan
+    assert 'SCAN posts' not in plan and 'SCAN channels' not in plan, plan
@@ -0,0 +1,25 @@
+"""Лимит каналов QuotaService сохраняет прежний смысл: 0 - каналы недоступны."""
+import asyncio
+
+import pytest
+
+from quota import QuotaService
+
+
+class LimitsDb:
+    def __init__(self, max_channels, channels):
+        self.row = (0, None, max_channels, 2, channels)
+
+    async def get_user_limits(self, user_id):
+        return self.row
+
+
+@pytest.mark.parametrize('max_channels, channels, allowed', [
+    (0, 0, False),
+    (1, 0, True),
+    (1, 1, False),
+    (3, 2, True),
+])
+def test_check_channel_limit(max_channels, channels, allowed):
+    quota = QuotaService(LimitsDb(max_channels, channels))
+    assert asyncio.run(quota.check_channel_limit(1)) == (allowed, max_channels)
@@ -0,0 +1,42 @@
+"""Повторяющиеся посты не обходят дневной лимит постов тарифа."""
+import asyncio
+
+from async_database import AsyncDatabase
+from recurrence import RecurringExpander, day_over_limit
+
+# 2026-01-05 10:00 МСК, понедельник
+MONDAY_10_MSK = 1767596400
+
+
+def test_day_over_limit():
+    assert day_over_limit(None, 300, MONDAY_10_MSK, None, 2) == '2026-01-05'
+    assert day_over_limit(None, 12 * 3600, MONDAY_10_MSK, None, 2) is None
+    assert day_over_limit('0 10 * * *', None, MONDAY_10_MSK, None, 1) is None
+    assert day_over_limit('0 10,18 * * mon', None, MONDAY_10_MSK + 8 * 3600, None, 1) == '2026-01-12'
+    # Ограничение end_time: до конца расписания лимит не превышается
+    assert day_over_limit(None, 300, MONDAY_10_MSK, MONDAY_10_MSK + 300, 2) is None
+
+
+def test_expansion_respects_daily_limit(tmp_path):
+    async def scenario():
+        db = AsyncDatabase(str(tmp_path / 'recurring.db'))
+        await db.add_user(1, 'user')  # по умолчанию 2 поста в день
+        await db.add_post(1, -1, 'one-off', '[]', MONDAY_10_MSK - 3600)
+        await db.add_recurring_post(1, -1, 'every 5m', '[]', None, 300, MONDAY_10_MSK, None)
+
+        expander = RecurringExpander(db, lookahead=600)
+        for now in range(MONDAY_10_MSK - 600, MONDAY_10_MSK + 6 * 3600, 600):
+            await expander.expand(now=now)
+
+        conn = db.db.get_connection()
+        counters = conn.execute('SELECT day, count FROM post_counters WHERE user_id = 1').fetchall()
+        posts = conn.execute('SELECT COUNT(*) FROM posts WHERE user_id = 1').fetchone()[0]
+        active = conn.execute('SELECT active FROM recurring_posts').fetchone()[0]
+        await db.close()
+        return counters, posts, active
+
+    counters, posts, active = asyncio.run(scenario())
+    assert counters == [('2026-01-05', 2)]
+    # Одно вхождение и обычный пост, остальные вхождения пропущены; шаблон жив
+    assert posts == 2
+    assert active == 1
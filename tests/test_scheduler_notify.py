@@ -0,0 +1,41 @@
+"""Несколько воркеров на одном хосте делят адрес UDP-уведомлений."""
+import asyncio
+import socket
+
+from async_database import AsyncDatabase
+from scheduler import PostScheduler, PublishNotifier
+
+
+def _free_udp_addr():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f"127.0.0.1:{sock.getsockname()[1]}"
+
+
+def test_second_worker_starts_without_notify_channel(tmp_path):
+    async def scenario():
+        addr = _free_udp_addr()
+        db = AsyncDatabase(str(tmp_path / 'notify.db'))
+        first, second = PostScheduler(db), PostScheduler(db)
+        await first.start(object(), addr)
+        # Раньше здесь падало OSError: Address already in use
+        await second.start(object(), addr)
+        assert first._notify_transport is not None
+        assert second._notify_transport is None
+
+        notifier = PublishNotifier(addr)
+        for _ in range(100):
+            # Сверка при старте пересобирает очередь из БД, поэтому шлём, пока пост не останется в очереди
+            notifier.add_new_post(42, 2_000_000_000)
+            await asyncio.sleep(0.01)
+            if 42 in first.publish_queue:
+                break
+        in_queue = 42 in first.publish_queue
+
+        await notifier.stop()
+        await second.stop()
+        await first.stop()
+        await db.close()
+        return in_queue
+
+    assert asyncio.run(scenario())
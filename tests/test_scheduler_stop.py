@@ -0,0 +1,43 @@
+"""Остановка воркера публикации во время отправок."""
+import asyncio
+import time
+
+from async_database import AsyncDatabase
+from scheduler import PostScheduler
+
+
+class Message:
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+class SlowBot:
+    """Отправка в канал -1 мгновенная, в остальные - дольше, чем живёт тест."""
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if chat_id != -1:
+            await asyncio.sleep(60)
+        return Message(1)
+
+
+def test_stop_releases_unsent_and_saves_sent(tmp_path):
+    async def scenario():
+        db = AsyncDatabase(str(tmp_path / 'stop.db'))
+        past = int(time.time()) - 1
+        await db.add_posts([(1, -1 - i, f'post {i}', '[]', past) for i in range(6)])
+        scheduler = PostScheduler(db)
+        await scheduler.start(SlowBot())
+        while len(scheduler.published_buffer) < 1 or len(scheduler.publishing) < 5:
+            await asyncio.sleep(0.01)
+
+        await scheduler.stop()
+        assert not scheduler._publish_tasks
+        # Читаем из потока теста отдельным соединением
+        conn = db.db.get_connection()
+        statuses = dict(conn.execute('SELECT channel_id, status FROM posts WHERE lease_owner IS NULL').fetchall())
+        await db.close()
+        return statuses
+
+    statuses = asyncio.run(scenario())
+    assert statuses[-1] == 'published'
+    assert sorted(status for channel_id, status in statuses.items() if channel_id != -1) == ['pending'] * 5
@@ -0,0 +1,96 @@
+"""Несколько процессов PostScheduler на одной базе публикуют каждый пост ровно один раз.
+
+Аренда короче, чем отправка всех взятых постов канала (фейковый бот
+отвечает медленно, посты канала уходят по очереди), так что без
+продления аренды другой воркер забрал бы ещё не отправленные посты.
+"""
+import asyncio
+import collections
+import multiprocessing
+import time
+
+from async_database import AsyncDatabase
+from database import Database
+from publisher import PublishDispatcher
+
+WORKERS = 3
+CHANNELS = 3
+POSTS_PER_CHANNEL = 12
+LEASE_SECONDS = 1
+SEND_LATENCY = 0.5
+POSTS_PER_SECOND = 3
+CHAT_RATE_PER_MINUTE = 240
+TIMEOUT = 60
+
+
+class Message:
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        await asyncio.sleep(SEND_LATENCY)
+        self.sent.append(text)
+        return Message(len(self.sent))
+
+
+def _run_worker(db_path, barrier, results):
+    import scheduler as scheduler_module
+    scheduler_module.PUBLISH_LEASE_SECONDS = LEASE_SECONDS
+
+    async def work():
+        db = AsyncDatabase(db_path)
+        worker = scheduler_module.PostScheduler(db)
+        # Лимит канала пускает в аренду 4 поста, а их отправка занимает 2 с - дольше аренды
+        worker.dispatcher = PublishDispatcher(chat_rate_per_minute=CHAT_RATE_PER_MINUTE)
+        worker.published_buffer.max_delay = 0.1
+        bot = FakeBot()
+        barrier.wait()
+        await worker.start(bot)
+        conn = db.db.get_connection()
+        deadline = time.time() + TIMEOUT
+        while time.time() < deadline:
+            if not conn.execute("SELECT COUNT(*) FROM posts WHERE status != 'published'").fetchone()[0]:
+                break
+            await asyncio.sleep(0.1)
+        await worker.stop()
+        await db.close()
+        return bot.sent
+
+    results.put(asyncio.run(work()))
+
+
+def test_workers_publish_each_post_once(tmp_path):
+    db_path = str(tmp_path / 'workers.db')
+    db = Database(db_path)
+    # Посты наступают чаще, чем канал успевает их отправить: воркеры просыпаются
+    # на каждом из них и забирают всё, что не под действующей арендой
+    start = int(time.time()) + 2
+    db.add_posts([
+        (1, -1 - channel, f'post {channel}/{i}', '[]', start + i // POSTS_PER_SECOND)
+        for channel in range(CHANNELS) for i in range(POSTS_PER_CHANNEL)
+    ])
+    db.close()
+
+    ctx = multiprocessing.get_context('fork')
+    barrier = ctx.Barrier(WORKERS)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_run_worker, args=(db_path, barrier, results)) for _ in range(WORKERS)]
+    for worker in workers:
+        worker.start()
+    sent = [text for _ in workers for text in results.get(timeout=TIMEOUT + 30)]
+    for worker in workers:
+        worker.join(timeout=30)
+        assert worker.exitcode == 0
+
+    duplicates = {text: count for text, count in collections.Counter(sent).items() if count > 1}
+    assert duplicates == {}
+    assert len(sent) == CHANNELS * POSTS_PER_CHANNEL
+
+    db = Database(db_path)
+    assert db.get_connection().execute("SELECT COUNT(*) FROM posts WHERE status = 'published'").fetchone()[0] == len(sent)
+    db.close()
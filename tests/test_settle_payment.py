@@ -0,0 +1,45 @@
+"""Повторные и одновременные вебхуки CryptoPay зачисляют платёж ровно один раз."""
+import threading
+
+from database import Database
+
+WEBHOOKS = 100
+
+
+def test_concurrent_settle_credits_once(tmp_path):
+    db = Database(str(tmp_path / 'payments.db'))
+    db.add_user(1, 'payer')
+    db.add_payment(1, 5.0, 'order-1', 'pending', 'https://pay.example/1', 'cryptopay')
+
+    barrier = threading.Barrier(WEBHOOKS)
+    results, errors = [], []
+
+    def webhook():
+        # У каждого потока своё соединение - как у нескольких процессов на одной базе
+        barrier.wait()
+        try:
+            results.append(db.settle_payment('order-1'))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=webhook) for _ in range(WEBHOOKS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert [result for result in results if result is not None] == [(1, 5.0)]
+    assert db.get_user_balance(1) == 5.0
+    assert db.get_payment_by_order_id('order-1')[4] == 'success'
+    db.close()
+
+
+def test_settle_unknown_or_repeated_order(tmp_path):
+    db = Database(str(tmp_path / 'payments.db'))
+    db.add_payment(2, 3.0, 'order-2', 'pending', 'https://pay.example/2', 'cryptopay')
+    assert db.settle_payment('missing') is None
+    assert db.settle_payment('order-2') == (2, 3.0)
+    assert db.settle_payment('order-2') is None
+    assert db.get_user_balance(2) == 3.0
+    db.close()
@@ -0,0 +1,40 @@
+"""Реплики бота на общей базе видят одно и то же состояние диалога."""
+import asyncio
+
+from async_database import AsyncDatabase
+from state_store import SQLiteStateStore
+
+
+def test_replicas_share_state(tmp_path):
+    async def scenario():
+        path = str(tmp_path / 'state.db')
+        db_a, db_b = AsyncDatabase(path), AsyncDatabase(path)
+        replica_a, replica_b = SQLiteStateStore(db_a, 'user_states'), SQLiteStateStore(db_b, 'user_states')
+
+        await replica_a.set(1, {'stage': 'awaiting_channel'})
+        assert await replica_b.get(1) == {'stage': 'awaiting_channel'}
+
+        # Диалог продвинулся на другой реплике - первая не отдаёт старую стадию
+        await replica_b.set(1, {'stage': 'awaiting_post_text'})
+        assert await replica_a.get(1) == {'stage': 'awaiting_post_text'}
+
+        assert await replica_a.pop(1) == {'stage': 'awaiting_post_text'}
+        assert await replica_b.get(1, {}) == {}
+        assert await replica_b.pop(1, 'gone') == 'gone'
+
+        await db_a.close()
+        await db_b.close()
+
+    asyncio.run(scenario())
+
+
+def test_expired_state_is_not_returned(tmp_path):
+    async def scenario():
+        db = AsyncDatabase(str(tmp_path / 'state.db'))
+        store = SQLiteStateStore(db, 'post_data', ttl=-1)
+        await store.set(1, {'text': 'draft'})
+        assert await store.get(1) is None
+        assert await store.pop(1) is None
+        await db.close()
+
+    asyncio.run(scenario())